@@ -2,164 +2,254 @@ import json
 import time
 import threading
 import os
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, Response, g, render_template, request, jsonify, session, stream_with_context
 from flask_cors import CORS
-import redis
 from main import TicketBooking
+from redis_pool import get_redis_client
+from ticket_parser import TrainRecord
+from qr_scheduler import qr_scheduler, TERMINAL_STATUSES
+from session_pool import BookingManagerPool, current_rss_bytes
+from session_store import SessionStore
+from ticket_cache import ticket_query_cache
+from ticket_table import TicketFilter, select_records
+import metrics
+from log_setup import get_logger, setup_logging
+
+setup_logging()
+log = get_logger("web")
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'  # 生产环境请更换为安全的密钥
 CORS(app)
 
-# Redis连接配置
+# Redis连接配置（连接参数见 redis_pool，进程内共享同一个连接池）
 try:
-    redis_client = redis.Redis(
-        host=os.getenv('REDIS_HOST', 'localhost'),
-        port=int(os.getenv('REDIS_PORT', 6379)),
-        password=os.getenv('REDIS_PASSWORD', 'xiaodun'),  # 使用您提供的密码
-        db=int(os.getenv('REDIS_DB', 0)),
-        decode_responses=True,
-        socket_connect_timeout=5
-    )
+    redis_client = get_redis_client()
     # 测试连接
     redis_client.ping()
-    print("Redis连接成功")
+    log.info("Redis连接成功")
     USE_REDIS = True
 except Exception as e:
-    print(f"Redis连接失败: {e}")
+    log.warning("Redis连接失败: %s", e)
     redis_client = None
     USE_REDIS = False
 
-# 全局变量存储登录状态和实例
-booking_instances = {}
-qr_status_polling = {}
+session_store = SessionStore(redis_client) if USE_REDIS else None
+
+# 登录状态长轮询的最长等待时间(秒)
+LOGIN_WAIT_TIMEOUT = float(os.getenv('LOGIN_WAIT_TIMEOUT', 25))
 
 class BookingManager:
-    def __init__(self):
-        self.booking = TicketBooking()
+    def __init__(self, session_id=None):
+        # 登录 Cookies 按浏览器会话分别保存，多个用户互不覆盖
+        self.booking = TicketBooking(cookie_key=session_id)
         self.login_status = False
         self.current_qr_uuid = None
-        self.qr_status_thread = None
         self.qr_status_result = None
+        self.qr_status_cond = threading.Condition()  # 二维码状态变化时唤醒长轮询请求
         
-    def save_session(self, session_id):
-        """保存会话状态到Redis"""
-        if USE_REDIS and redis_client:
-            try:
-                session_data = {
-                    'login_status': self.login_status,
-                    'current_qr_uuid': self.current_qr_uuid,
-                    'ticket_info': self.booking.ticket_info
-                }
-                # 设置24小时过期时间（延长登录保持时间）
-                redis_client.setex(f"session:{session_id}", 86400, json.dumps(session_data))  # 24小时
-                print(f"会话状态已保存: {session_id}")
-                return True
-            except Exception as e:
-                print(f"保存会话失败: {e}")
-                return False
-        return False
+        self._persisted = {}  # 最近一次写入 Redis 的字段快照，用于判断哪些字段发生了变化
+        
+    def _snapshot(self):
+        return {
+            'login_status': self.login_status,
+            'current_qr_uuid': self.current_qr_uuid,
+            'ticket_info': self.booking.ticket_info_version,
+        }
+        
+    def save_session(self, session_id, sync=False):
+        """
+        保存会话状态到Redis：只写入自上次保存以来变化的字段，
+        无变化时仅按节流间隔刷新过期时间；写入默认由后台线程批量完成，sync=True 时立即写回
+        """
+        if not session_store:
+            return False
+        try:
+            snapshot = self._snapshot()
+            changed = {k: v for k, v in snapshot.items() if self._persisted.get(k, None) != v}
+            if changed:
+                fields = {k: snapshot[k] for k in changed if k != 'ticket_info'}
+                if 'ticket_info' in changed:
+                    # 车次记录以原始行的形式保存，恢复时重新解析
+                    fields['ticket_info'] = {train_no: record.to_row()
+                                             for train_no, record in self.booking.ticket_info.items()}
+                session_store.write(session_id, fields)
+                self._persisted = snapshot
+            else:
+                session_store.touch(session_id)
+            if sync:
+                session_store.flush(session_id)
+            return True
+        except Exception as e:
+            log.warning("保存会话失败: %s", e)
+            return False
     
     def load_session(self, session_id):
-        """从Redis加载会话状态"""
-        if USE_REDIS and redis_client:
-            try:
-                session_data = redis_client.get(f"session:{session_id}")
-                if session_data:
-                    data = json.loads(session_data)
-                    self.login_status = data.get('login_status', False)
-                    self.current_qr_uuid = data.get('current_qr_uuid')
-                    self.booking.ticket_info = data.get('ticket_info', {})
-                    # 尝试恢复登录 Cookies（用于 Web 端重启后的会话续期）
-                    if self.login_status:
-                        try:
-                            self.booking.load_cookies()
-                        except Exception:
-                            pass
-                    print(f"会话状态已恢复: {session_id}")
-                    return True
-            except Exception as e:
-                print(f"加载会话失败: {e}")
+        """从Redis加载会话状态（每个管理器只在创建时加载一次）"""
+        if not session_store:
+            return False
+        try:
+            data = session_store.load(session_id)
+            if data:
+                self.login_status = data.get('login_status', False)
+                self.current_qr_uuid = data.get('current_qr_uuid')
+                self.booking.ticket_info = {
+                    train_no: TrainRecord.from_row(row)
+                    for train_no, row in (data.get('ticket_info') or {}).items()
+                    if isinstance(row, str)
+                }
+                # 尝试恢复登录 Cookies（用于 Web 端重启后的会话续期）
+                if self.login_status:
+                    try:
+                        self.booking.load_cookies()
+                    except Exception:
+                        pass
+                self._persisted = self._snapshot()
+                log.debug("会话状态已恢复", extra={"session": session_id[:8]})
+                return True
+        except Exception as e:
+            log.warning("加载会话失败: %s", e)
         return False
     
     def clear_session(self, session_id):
         """清除会话状态"""
-        if USE_REDIS and redis_client:
+        self.booking.invalidate_passengers()
+        if session_store:
             try:
-                redis_client.delete(f"session:{session_id}")
-                print(f"会话已清除: {session_id}")
+                session_store.delete(session_id)
+                self._persisted = {}
+                log.debug("会话已清除", extra={"session": session_id[:8]})
                 return True
             except Exception as e:
-                print(f"清除会话失败: {e}")
+                log.warning("清除会话失败: %s", e)
                 return False
         return False
 
     def get_qr_code(self):
         """获取登录二维码（Web 端）"""
+        previous_uuid = self.current_qr_uuid
         result = self.booking.get_qr_code_data(show_image=False)
         if result.get("success"):
+            if previous_uuid:
+                qr_scheduler.cancel(previous_uuid)
             self.current_qr_uuid = result.get("uuid")
             self.login_status = False
             self.qr_status_result = {"status": "waiting", "message": "等待扫描..."}
         return result
 
     def start_qr_polling(self):
-        """启动二维码状态轮询线程"""
+        """把当前二维码交给集中调度器轮询"""
         if not self.current_qr_uuid:
             return
-        if self.qr_status_thread and self.qr_status_thread.is_alive():
+        qr_scheduler.register(self.current_qr_uuid, self)
+
+    def on_qr_status(self, uuid, result):
+        """调度器回调：更新二维码状态"""
+        if uuid != self.current_qr_uuid:
             return
-        
-        uuid = self.current_qr_uuid
-
-        def _poll():
-            while qr_status_polling.get(uuid):
-                result = self.booking.check_qr_status_once()
-                self.qr_status_result = result
-                
-                if result.get("status") in ["success", "failed", "expired"]:
-                    if result.get("status") == "success":
-                        self.login_status = True
-                        try:
-                            self.booking.save_cookies()
-                        except Exception:
-                            pass
-                    qr_status_polling.pop(uuid, None)
+        if result.get("status") == "success":
+            self.login_status = True
+            try:
+                self.booking.save_cookies()
+            except Exception:
+                pass
+        with self.qr_status_cond:
+            self.qr_status_result = result
+            self.qr_status_cond.notify_all()
+
+    def wait_qr_status(self, uuid, since_status, timeout):
+        """
+        长轮询：等待二维码状态不同于 since_status，或超时后返回当前状态
+        """
+        deadline = time.time() + timeout
+        with self.qr_status_cond:
+            while uuid == self.current_qr_uuid:
+                result = self.qr_status_result
+                if result and result.get("status") != since_status:
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
                     break
-                
-                time.sleep(2)
+                self.qr_status_cond.wait(remaining)
+            return self.qr_status_result
 
-        self.qr_status_thread = threading.Thread(target=_poll, daemon=True)
-        self.qr_status_thread.start()
+    def close(self):
+        """释放管理器持有的资源（停止二维码轮询、关闭连接）"""
+        if self.current_qr_uuid:
+            qr_scheduler.cancel(self.current_qr_uuid)
+        self.booking.close()
+
+def release_manager(session_id, manager):
+    """会话池淘汰回调：保存已登录会话的状态和自上次同步后轮换过的 Cookie 后释放资源，下次请求时从 Redis 恢复"""
+    if manager.login_status:
+        manager.booking.save_cookies_if_changed()
+        manager.save_session(session_id, sync=True)
+    if session_store:
+        session_store.forget(session_id)
+    manager.close()
+
+def create_manager(session_id):
+    """会话池工厂：新建或被淘汰后重建的管理器，从 Redis 恢复一次状态"""
+    manager = BookingManager(session_id)
+    manager.load_session(session_id)
+    return manager
+
+# 全局会话池：按最近使用淘汰，容量和空闲超时见 session_pool 中的配置
+booking_instances = BookingManagerPool(create_manager, on_evict=release_manager)
+
+HTTP_REQUEST_SECONDS = metrics.histogram('http_request_seconds', 'Web 接口处理耗时', ('endpoint', 'status'))
+metrics.gauge_callback('booking_live_sessions', '内存中的会话管理器数量', lambda: len(booking_instances))
+metrics.gauge_callback('qr_pending_logins', '等待扫码确认的二维码数量', qr_scheduler.pending_count)
+metrics.gauge_callback('ticket_query_cache_hit_ratio', '余票查询缓存命中率', ticket_query_cache.hit_ratio)
+metrics.gauge_callback('process_resident_memory_bytes', '进程常驻内存', current_rss_bytes)
 
 def get_manager():
     """获取当前会话对应的管理器实例"""
+    manager = g.get('booking_manager')
+    if manager is not None:
+        return manager
     session_id = session.get('session_id')
     if not session_id:
         session_id = os.urandom(24).hex()
         session['session_id'] = session_id
-    if session_id not in booking_instances:
-        booking_instances[session_id] = BookingManager()
-    return booking_instances[session_id]
+    # 管理器在本次请求结束（流式响应发送完毕）前处于使用中，不会被会话池淘汰
+    manager, created = booking_instances.get(session_id)
+    g.booking_manager = manager
+    g.booking_session_id = session_id
+    if not created and manager.login_status:
+        # 内存中的 Cookie 为准，只在其他进程更新了版本号时重新读取
+        manager.booking.sync_cookies()
+    return manager
 
 @app.before_request
-def load_user_session():
-    """在每个请求前加载用户会话"""
-    session_id = session.get('session_id')
-    if session_id:
-        manager = get_manager()
-        manager.load_session(session_id)
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    started = g.get('request_started')
+    if started is not None and request.endpoint not in ('static', 'get_metrics'):
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                     endpoint=request.endpoint or 'unknown', status=response.status_code)
+    return response
 
 @app.after_request
 def save_user_session(response):
-    """在每个请求后保存用户会话"""
+    """在每个请求后保存用户会话（只写变化的字段；静态资源和未使用会话的请求跳过）"""
     session_id = session.get('session_id')
-    if session_id:
-        manager = get_manager()
-        if manager.login_status:
+    manager = g.get('booking_manager')
+    if session_id and manager is not None and request.endpoint != 'static':
+        if manager.login_status or manager._persisted.get('login_status'):
             manager.save_session(session_id)
     return response
 
+@app.teardown_request
+def release_user_manager(exc=None):
+    """请求结束后释放管理器（stream_with_context 的流式响应在发送完毕后才会执行到这里）"""
+    manager = g.pop('booking_manager', None)
+    if manager is not None:
+        booking_instances.release(g.pop('booking_session_id', None), manager)
+
 @app.route('/')
 def index():
     # 确保每个用户都有唯一的会话ID
@@ -175,7 +265,6 @@ def get_qr_code():
         result = manager.get_qr_code()
         if result['success']:
             # 开始轮询状态
-            qr_status_polling[result['uuid']] = True
             manager.start_qr_polling()
             return jsonify({
                 'success': True,
@@ -196,6 +285,9 @@ def check_login_status(uuid):
             return jsonify({'success': False, 'message': '无效的UUID'})
             
         result = manager.qr_status_result
+        # 告知调度器前端仍在等待；若因长时间未查询已停止轮询，则重新登记
+        if not qr_scheduler.touch(uuid) and result and result.get('status') not in TERMINAL_STATUSES:
+            manager.start_qr_polling()
         if result:
             return jsonify({
                 'success': True,
@@ -213,6 +305,38 @@ def check_login_status(uuid):
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
+@app.route('/api/login/status/<uuid>/wait', methods=['GET'])
+def wait_login_status(uuid):
+    """长轮询登录状态：状态变化（与 since 参数不同）时立即返回，最长等待 timeout 秒"""
+    try:
+        manager = get_manager()
+        if uuid != manager.current_qr_uuid:
+            return jsonify({'success': False, 'message': '无效的UUID'})
+        
+        since = request.args.get('since', '')
+        timeout = min(max(request.args.get('timeout', LOGIN_WAIT_TIMEOUT, type=float), 0), LOGIN_WAIT_TIMEOUT)
+        result = manager.qr_status_result
+        if not qr_scheduler.touch(uuid) and result and result.get('status') not in TERMINAL_STATUSES:
+            manager.start_qr_polling()
+        
+        result = manager.wait_qr_status(uuid, since, timeout)
+        qr_scheduler.touch(uuid)
+        if not result:
+            return jsonify({
+                'success': True,
+                'status': 'checking',
+                'message': '正在检查登录状态...',
+                'logged_in': False
+            })
+        return jsonify({
+            'success': True,
+            'status': result['status'],
+            'message': result['message'],
+            'logged_in': manager.login_status
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
 @app.route('/api/stations/suggest', methods=['GET'])
 def get_station_suggestions():
     """获取车站名称建议"""
@@ -279,30 +403,25 @@ def query_tickets():
         if not manager.login_status:
             return jsonify({'success': False, 'message': '请先登录'})
             
-        trains = manager.booking.query_ticket(from_station, to_station, date)
-        if trains is None:
+        # 两种查询方式使用同样规范化后的日期（支持 今天/明天、yyyyMMdd、yyyy/MM/dd 等写法）
+        date = manager.booking.mcp_service.format_date(date)
+        if data.get('city'):
+            # 按城市查询：两城市所有车站组合并发查询后合并
+            records = manager.booking.query_city_records(from_station, to_station, date)
+        else:
+            # 经由登录后已预热的异步会话查询
+            records = manager.booking.query_ticket_records_async(from_station, to_station, date)
+        if records is None:
             return jsonify({'success': False, 'message': '查询失败'})
             
-        # 返回车次信息
-        tickets_data = []
-        for train_no in trains:
-            if train_no in manager.booking.ticket_info:
-                info = manager.booking.ticket_info[train_no]
-                tickets_data.append({
-                    'train_no': train_no,
-                    'secret': info.get('secret', ''),
-                    'can_book': True,
-                    'start_time': info.get('start_time', ''),
-                    'arrive_time': info.get('arrive_time', ''),
-                    'duration': info.get('duration', ''),
-                    'ze_num': info.get('ze_num', '--'),
-                    'zy_num': info.get('zy_num', '--'),
-                    'swz_num': info.get('swz_num', '--')
-                })
+        # 筛选在服务端完成，默认只返回可预订的车次
+        selected = select_records(records, TicketFilter.from_params(data.get('filters')), data.get('sort_by', ''))
+        tickets_data = [record.to_dict() for record in selected]
         
         return jsonify({
             'success': True,
-            'trains': tickets_data
+            'trains': tickets_data,
+            'total': len(records)
         })
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
@@ -317,6 +436,8 @@ def smart_query_tickets():
         date = data.get('date')
         train_types = data.get('train_types', '')  # 如 "G,D" 表示只查高铁和动车
         sort_by = data.get('sort_by', '')  # 如 "time" 按时间排序
+        city = bool(data.get('city'))  # 按城市查询所有车站组合
+        filters = TicketFilter.from_params(data.get('filters'), train_types)  # 时间窗口/历时/余票筛选
         
         if not all([from_station, to_station, date]):
             return jsonify({'success': False, 'message': '缺少必要参数'})
@@ -327,7 +448,7 @@ def smart_query_tickets():
         
         # 使用MCP集成的智能查询
         tickets = manager.booking.smart_query_tickets(
-            from_station, to_station, date, train_types, sort_by
+            from_station, to_station, date, train_types, sort_by, city=city, filters=filters
         )
         
         return jsonify({
@@ -338,6 +459,38 @@ def smart_query_tickets():
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
+@app.route('/api/tickets/transfer', methods=['POST'])
+def plan_transfer_tickets():
+    """一次换乘方案（出发站 -> 枢纽 -> 到达站），按总历时和余票排序"""
+    try:
+        data = request.json
+        from_station = data.get('from_station')
+        to_station = data.get('to_station')
+        date = data.get('date')
+        
+        if not all([from_station, to_station, date]):
+            return jsonify({'success': False, 'message': '缺少必要参数'})
+            
+        manager = get_manager()
+        if not manager.login_status:
+            return jsonify({'success': False, 'message': '请先登录'})
+        
+        itineraries = manager.booking.plan_transfers(
+            from_station, to_station, date,
+            hubs=data.get('hubs') or None,  # 候选枢纽车站名列表
+            min_layover=data.get('min_layover'),  # 最短换乘时间(分钟)
+            max_layover=data.get('max_layover'),  # 最长换乘时间(分钟)
+            limit=min(int(data.get('limit', 20)), 100)
+        )
+        
+        return jsonify({
+            'success': True,
+            'itineraries': [itinerary.to_dict() for itinerary in itineraries],
+            'count': len(itineraries)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
 @app.route('/api/tickets/batch-query', methods=['POST'])
 def batch_query_tickets():
     """批量查询多个日期的车票"""
@@ -346,6 +499,7 @@ def batch_query_tickets():
         from_station = data.get('from_station')
         to_station = data.get('to_station')
         dates = data.get('dates', [])
+        filters = TicketFilter.from_params(data.get('filters'))
         
         if not all([from_station, to_station, dates]):
             return jsonify({'success': False, 'message': '缺少必要参数'})
@@ -355,33 +509,81 @@ def batch_query_tickets():
             return jsonify({'success': False, 'message': '请先登录'})
         
         # 批量查询
-        results = manager.booking.batch_query_tickets(from_station, to_station, dates)
+        results, errors = manager.booking.batch_query_tickets(from_station, to_station, dates, filters=filters)
         
         return jsonify({
             'success': True,
-            'results': results
+            'results': results,
+            'errors': errors
         })
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
+@app.route('/api/tickets/batch-query/stream', methods=['POST'])
+def batch_query_tickets_stream():
+    """批量查询多个日期的车票（NDJSON 流式返回，每个日期查完立即下发）"""
+    try:
+        data = request.json
+        from_station = data.get('from_station')
+        to_station = data.get('to_station')
+        dates = data.get('dates', [])
+        filters = TicketFilter.from_params(data.get('filters'))
+        
+        if not all([from_station, to_station, dates]):
+            return jsonify({'success': False, 'message': '缺少必要参数'})
+            
+        manager = get_manager()
+        if not manager.login_status:
+            return jsonify({'success': False, 'message': '请先登录'})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+    
+    def generate():
+        started = time.time()
+        total_tickets = 0
+        errors = {}
+        try:
+            for date, tickets, error in manager.booking.iter_batch_query_tickets(from_station, to_station, dates,
+                                                                               filters=filters):
+                total_tickets += len(tickets)
+                if error:
+                    errors[date] = error
+                yield json.dumps({
+                    'type': 'date',
+                    'date': date,
+                    'tickets': tickets,
+                    'count': len(tickets),
+                    'error': error
+                }, ensure_ascii=False) + '\n'
+        except Exception as e:
+            errors['_'] = str(e)
+        yield json.dumps({
+            'type': 'summary',
+            'success': not errors,
+            'dates': len(dates),
+            'total_tickets': total_tickets,
+            'errors': errors,
+            'elapsed_ms': int((time.time() - started) * 1000)
+        }, ensure_ascii=False) + '\n'
+    
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # 关闭反向代理缓冲
+    return response
+
 @app.route('/api/passengers', methods=['GET'])
 def get_passengers():
     """获取乘客列表"""
     try:
-        print("收到获取乘客列表请求")
-        
         manager = get_manager()
         if not manager.login_status:
-            print("用户未登录")
             return jsonify({'success': False, 'message': '请先登录'})
             
-        print("正在调用get_passengers_direct方法...")
-        passengers = manager.booking.get_passengers_direct()
-        
-        print(f"get_passengers_direct返回结果: {len(passengers) if passengers else 0} 位乘客")
+        # 联系人按会话缓存，refresh=1 时强制重新查询
+        refresh = request.args.get('refresh') in ('1', 'true')
+        passengers = manager.booking.get_passengers(force=refresh)
         
         if not passengers:
-            print("未获取到乘客数据")
             return jsonify({
                 'success': False, 
                 'message': '未找到联系人',
@@ -404,16 +606,13 @@ def get_passengers():
                 'mobile': mobile
             })
         
-        print(f"成功处理 {len(passenger_list)} 位乘客信息")
         return jsonify({
             'success': True,
             'passengers': passenger_list,
             'count': len(passenger_list)
         })
     except Exception as e:
-        print(f"获取乘客列表异常: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("获取乘客列表异常")
         return jsonify({
             'success': False, 
             'message': f'获取乘客失败: {str(e)}',
@@ -439,15 +638,15 @@ def submit_booking():
         if not manager.login_status:
             return jsonify({'success': False, 'message': '请先登录'})
             
-        # 获取乘客信息
-        all_passengers = manager.booking.get_passengers_direct()
+        # 乘客序号与 /api/passengers 返回的列表一致，直接从会话缓存中解析
+        all_passengers = manager.booking.get_passengers()
         selected_passengers = [all_passengers[i] for i in passenger_ids if i < len(all_passengers)]
         
         if not selected_passengers:
             return jsonify({'success': False, 'message': '未选择有效的乘客'})
             
-        # 执行预订
-        success = manager.booking.execute_booking(
+        # 执行预订（在共享事件循环中进行）
+        success = manager.booking.execute_booking_async(
             from_station, to_station, date, train_no, selected_passengers, seat_type
         )
         
@@ -458,6 +657,21 @@ def submit_booking():
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
+@app.route('/api/system/sessions', methods=['GET'])
+def get_session_stats():
+    """会话池状态：在线会话数、淘汰数、进程内存"""
+    try:
+        stats = booking_instances.stats()
+        stats['pending_qr_logins'] = qr_scheduler.pending_count()
+        return jsonify({'success': True, 'stats': stats})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus 文本格式的指标：订票各阶段、上游接口、缓存命中、Redis 操作耗时"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/api/user/status', methods=['GET'])
 def check_user_status():
     """检查用户登录状态"""
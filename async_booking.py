@@ -0,0 +1,363 @@
+"""
+基于 curl_cffi AsyncSession 的异步 12306 客户端
+与 TicketBooking 共用 Cookie jar、请求头、登录租约和各类缓存，请求构造与响应解析
+直接复用 TicketBooking 的 build_* / parse_* 方法，下单流程执行 main.booking_steps 这同一份步骤定义，
+保证两条路径发出的请求和重试逻辑完全一致。Web 端的下单和批量查询接口经由这里执行，
+多个会话的请求复用同一个事件循环：
+
+    client = booking.async_client()
+    records = async_runner.run(client.query_records_by_code("BJP", "SHH", "2024-02-05"))
+
+同步代码中通过 async_runner（进程内一个后台事件循环线程）调用；
+已在事件循环中的代码直接 await 即可
+"""
+
+import asyncio
+import concurrent.futures
+import queue
+import threading
+import time
+from urllib.parse import urlsplit
+
+import metrics
+from http_pool import new_async_session
+from log_setup import get_logger
+from main import booking_steps, build_query_params, confirm_steps, query_url_cache
+from mcp_integration import BATCH_QUERY_MAX_WORKERS, BATCH_QUERY_TIMEOUT
+from test import CHECK_USER_URL, KYFW_BASE_URL
+from ticket_cache import TicketQueryError, ticket_query_cache
+from ticket_parser import parse_left_ticket_response
+
+log = get_logger("async_booking")
+
+
+async def _in_executor(func, *args):
+    """阻塞调用（车站表加载、联想索引构建等）放到线程池执行，不占用共享的事件循环"""
+    return await asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+
+class AsyncTicketBooking:
+    """TicketBooking 的异步版本（查票、联系人、下单），只持有对同步会话的引用"""
+
+    def __init__(self, booking):
+        self.booking = booking
+        self._session = None
+
+    @property
+    def session(self):
+        # AsyncSession 必须在使用它的事件循环中创建
+        if self._session is None:
+            self._session = new_async_session(cookies=self.booking.session.cookies.jar,
+                                              headers=self.booking.headers, impersonate="chrome120")
+        return self._session
+
+    async def _upstream(self, method, url, endpoint=None, **kwargs):
+        """与 Tiantiel12306Login._upstream 相同的指标、日志和登录租约处理"""
+        kwargs.setdefault("headers", self.booking.headers)
+        kwargs.setdefault("impersonate", "chrome120")
+        endpoint = endpoint or urlsplit(url).path
+        started = time.perf_counter()
+        try:
+            resp = await self.session.request(method, url, **kwargs)
+        except Exception as e:
+            self.booking.observe_upstream_error(endpoint, time.perf_counter() - started, e)
+            raise
+        self.booking.observe_upstream(endpoint, url, time.perf_counter() - started, resp)
+        return resp
+
+    async def check_user(self):
+        booking = self.booking
+        if booking.login_lease_valid():
+            metrics.cache_result("login_lease", True)
+            return True
+        metrics.cache_result("login_lease", False)
+        try:
+            resp = await self._upstream("POST", CHECK_USER_URL, data={"_json_att": ""})
+        except Exception as e:
+            log.warning("CheckUser Error: %s", e)
+            return False
+        return booking.apply_check_user(resp)
+
+    async def warm_up(self):
+        """登录后建立异步会话的连接并刷新动态查票接口，让第一次下单/查票不再承担建连耗时"""
+        try:
+            await self._upstream("HEAD", f"{KYFW_BASE_URL}/otn/", endpoint="warmup", allow_redirects=False,
+                                 timeout=5)
+        except Exception as e:
+            log.debug("异步会话连接预热失败: %s", e)
+        await self.get_dynamic_query_url(timeout=10)
+
+    # ---- 查票 ----
+
+    async def get_dynamic_query_url(self, timeout=None):
+        """同 TicketBooking.get_dynamic_query_url，与同步调用者共享同一次 init 页面刷新"""
+        return await query_url_cache.get_async(lambda: self.fetch_dynamic_query_url(timeout))
+
+    async def fetch_dynamic_query_url(self, timeout=None):
+        try:
+            resp = await self._upstream("GET", f"{KYFW_BASE_URL}/otn/leftTicket/init", timeout=timeout)
+            return self.booking.parse_dynamic_query_url(resp.text)
+        except Exception as e:
+            log.warning("获取动态 URL 失败: %s", e)
+        return None
+
+    async def _get_query_json(self, params, timeout=None):
+        """同 TicketBooking._get_query_json：被重定向或返回 c_url 时换接口重试一次"""
+        for attempt in range(2):
+            query_url = await self.get_dynamic_query_url(timeout)
+            resp = await self._upstream("GET", query_url, endpoint="/otn/leftTicket/query",
+                                        params=params, timeout=timeout)
+            resp_json = self.booking.parse_query_response(resp, query_url)
+            if resp_json is not None:
+                c_url = resp_json.get("c_url")
+                if c_url and attempt == 0:
+                    log.info("查询接口已变更", extra={"query_path": c_url})
+                    query_url_cache.set(f"{KYFW_BASE_URL}/otn/{c_url}")
+                    continue
+                return resp_json
+            log.warning("查询接口被重定向或返回非 JSON 数据，刷新动态查询接口")
+            query_url_cache.invalidate(query_url)
+        return None
+
+    async def query_records_by_code(self, from_code, to_code, date, timeout=None, store=True, use_cache=True,
+                                    raise_errors=False):
+        """参数含义同 TicketBooking.query_records_by_code，相同查询与同步调用者合并为一次上游请求"""
+        fetch = lambda: self._fetch_records(from_code, to_code, date, timeout)
+        try:
+            records = await ticket_query_cache.get_or_fetch_async((from_code, to_code, date), fetch,
+                                                                  force=not use_cache, wait_timeout=timeout)
+        except TicketQueryError:
+            if raise_errors:
+                raise
+            return None
+        if store:
+            self.booking._remember_records(records)
+        return records
+
+    async def _fetch_records(self, from_code, to_code, date, timeout=None):
+        """同 TicketBooking._fetch_records，失败抛出 TicketQueryError"""
+        try:
+            resp_json = await self._get_query_json(build_query_params(from_code, to_code, date), timeout)
+        except Exception as e:
+            log.warning("查询异常: %s", e)
+            raise TicketQueryError(f"查询异常: {e}") from e
+        records = parse_left_ticket_response(resp_json) if resp_json else None
+        if records is None:
+            log.warning("查询接口返回数据异常", extra={"from": from_code, "to": to_code, "date": date})
+            raise TicketQueryError("查询接口返回数据异常")
+        return records
+
+    async def query_ticket_records(self, from_station_name, to_station_name, date, use_cache=True):
+        get_code = self.booking.station_manager.get_code
+        from_code = await _in_executor(get_code, from_station_name)
+        to_code = await _in_executor(get_code, to_station_name)
+        if not from_code or not to_code:
+            log.warning("找不到车站", extra={"from": from_station_name, "to": to_station_name})
+            return None
+        return await self.query_records_by_code(from_code, to_code, date, use_cache=use_cache)
+
+    # ---- 联系人 ----
+
+    async def get_passengers(self, force=False):
+        """与同步 get_passengers 共用同一份会话缓存"""
+        if not force:
+            passengers = self.booking.cached_passengers()
+            if passengers is not None:
+                return passengers
+        passengers = await self.get_passengers_direct()
+        self.booking.remember_passengers(passengers)
+        return passengers
+
+    async def get_passengers_direct(self):
+        if not await self.check_user():
+            log.info("用户登录状态失效，需要重新登录")
+            return []
+        method, url, kwargs = self.booking.build_passengers_request()
+        try:
+            return self.booking.parse_passengers(await self._upstream(method, url, **kwargs))
+        except Exception as e:
+            log.warning("获取联系人失败: %s", e)
+            return []
+
+    # ---- 下单 ----
+
+    async def _call(self, request, parse, name):
+        """发送 build_* 构造的请求并用 parse 解析，异常时记录日志并返回 False"""
+        method, url, kwargs = request
+        try:
+            return parse(await self._upstream(method, url, **kwargs))
+        except Exception as e:
+            log.warning("%s Error: %s", name, e)
+            return False
+
+    async def submit_order_request(self, secret_str, train_date, from_station_name, to_station_name):
+        booking = self.booking
+        request = booking.build_submit_order_request(secret_str, train_date, from_station_name, to_station_name)
+        return await self._call(request, booking.parse_submit_order, "SubmitOrderRequest")
+
+    async def get_token_and_ticket_info(self):
+        method, url, kwargs = self.booking.build_init_dc_request()
+        try:
+            resp = await self._upstream(method, url, **kwargs)
+        except Exception as e:
+            log.warning("InitDc Error: %s", e)
+            return None, None
+        return self.booking.parse_init_dc_response(resp)
+
+    async def get_queue_count(self, train_no, from_station_name, to_station_name, date,
+                              left_ticket, train_location, seat_type, token):
+        booking = self.booking
+        request = booking.build_queue_count_request(train_no, from_station_name, to_station_name, date,
+                                                    left_ticket, train_location, seat_type, token)
+        if request is None:
+            return False
+        return await self._call(request, booking.parse_queue_count, "GetQueueCount")
+
+    @staticmethod
+    async def retry_sleep(seconds):
+        await asyncio.sleep(seconds)
+
+    async def run_steps(self, steps):
+        """在事件循环中执行 main.booking_steps/confirm_steps 定义的步骤序列（与同步 run_steps 相同）"""
+        result, error = None, None
+        while True:
+            try:
+                name, args, kwargs = steps.throw(error) if error is not None else steps.send(result)
+            except StopIteration as stop:
+                return stop.value
+            result, error = None, None
+            try:
+                result = await getattr(self, name)(*args, **kwargs)
+            except Exception as e:
+                error = e
+
+    async def confirm_queue(self, train_no, passengers, token, key_check_isChange, left_ticket, train_location,
+                            from_station_name, to_station_name, date, seat_type="O"):
+        return await self.run_steps(confirm_steps(self.booking, train_no, passengers, token, key_check_isChange,
+                                                  left_ticket, train_location, from_station_name, to_station_name,
+                                                  date, seat_type))
+
+    async def execute_booking(self, from_station, to_station, date, target_train_no, selected_passengers,
+                              seat_type):
+        """同 TicketBooking.execute_booking（同一份 booking_steps），重试前的等待不占用线程"""
+        started = time.perf_counter()
+        success = False
+        try:
+            success = await self.run_steps(booking_steps(self.booking, from_station, to_station, date,
+                                                         target_train_no, selected_passengers, seat_type))
+            return success
+        finally:
+            metrics.BOOKING_SECONDS.observe(time.perf_counter() - started,
+                                            result="success" if success else "failure")
+
+    # ---- 批量查询 ----
+
+    async def iter_batch_query(self, from_city, to_city, dates, filters=None, max_concurrency=None, timeout=None):
+        """
+        多日期查询，按完成顺序逐个产出 (日期, 车次列表, 错误信息)
+        各日期是同一事件循环中的协程，不占用线程；单个日期失败或超时只影响该日期：车次列表为空，错误信息非空
+        """
+        if not dates:
+            return
+        optimizer = self.booking.optimizer
+        from_code, to_code = await _in_executor(optimizer.resolve_route, from_city, to_city)
+        timeout = timeout or BATCH_QUERY_TIMEOUT
+        limit = asyncio.Semaphore(max(1, max_concurrency or BATCH_QUERY_MAX_WORKERS))
+
+        async def query_one(date):
+            formatted_date = optimizer.mcp_service.format_date(date)
+            async with limit:
+                try:
+                    # 每个日期最多经历 init 页面 + 两次查询
+                    records = await asyncio.wait_for(
+                        self.query_records_by_code(from_code, to_code, formatted_date, timeout=timeout,
+                                                   store=False, raise_errors=True), timeout * 3)
+                except asyncio.TimeoutError:
+                    log.warning("查询日期 %s 超时", date)
+                    return date, [], "查询超时"
+                except Exception as e:
+                    log.warning("查询日期 %s 失败: %s", date, e)
+                    return date, [], str(e)
+            return date, optimizer.filter_and_sort_trains(records, "", "", filters=filters), None
+
+        tasks = [asyncio.ensure_future(query_one(date)) for date in dates]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def close(self):
+        session, self._session = self._session, None
+        if session is not None:
+            await session.close()
+
+    def close_sync(self):
+        """在同步代码中关闭（会话只会在 async_runner 的事件循环中创建）"""
+        if self._session is not None:
+            try:
+                async_runner.run(self.close(), timeout=5)
+            except Exception:
+                pass
+
+
+class AsyncLoopRunner:
+    """
+    后台事件循环线程
+    同步代码（Flask 请求线程等）通过 run()/submit() 把协程交给同一个事件循环，
+    所有会话的上游请求在这一个线程中复用，而不是每个进行中的请求占用一个线程
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="async-booking-loop", daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def submit(self, coro):
+        """提交协程，返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """提交协程并等待结果（超时抛出 TimeoutError，协程被取消）"""
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def iterate(self, agen):
+        """在事件循环中消费异步生成器，同步地逐个产出其结果；调用方提前停止迭代时取消"""
+        items = queue.Queue()
+        done = object()
+
+        async def pump():
+            try:
+                async for item in agen:
+                    items.put(item)
+            finally:
+                items.put(done)
+
+        future = self.submit(pump())
+        try:
+            while True:
+                item = items.get()
+                if item is done:
+                    break
+                yield item
+            future.result()  # 重新抛出生成器中的异常
+        finally:
+            future.cancel()
+
+
+# 进程内共享的事件循环
+async_runner = AsyncLoopRunner()
@@ -0,0 +1,112 @@
+"""
+initDc 页面解析的微基准
+对比旧版的逐个正则（含 DOTALL 的 .*? 扫描）与 initdc_parser.parse_init_dc
+
+    python bench_initdc.py                       # 使用内置的模拟页面
+    python bench_initdc.py --pages recorded/     # 使用保存下来的 initDc 页面 (*.html)
+"""
+
+import argparse
+import glob
+import os
+import re
+import timeit
+
+from initdc_parser import parse_init_dc
+
+
+def legacy_extract(html):
+    """旧版 get_token_and_ticket_info 的提取逻辑（去掉打印）"""
+    token = ""
+    token_match = re.search(r"var globalRepeatSubmitToken = '([^']+)';", html)
+    if token_match:
+        token = token_match.group(1)
+
+    ticket_info = {}
+    patterns = [
+        r"var ticketInfoForPassengerForm = ({.*?});",
+        r"ticketInfoForPassengerForm\s*=\s*({.*?});",
+        r"var\s+ticketInfoForPassengerForm\s*=\s*({[^}]+})",
+    ]
+    for pattern in patterns:
+        ticket_info_match = re.search(pattern, html, re.DOTALL)
+        if ticket_info_match:
+            t_info_str = ticket_info_match.group(1).replace("\n", "").replace("\r", "")
+            key_patterns = {
+                'key_check_isChange': r"'key_check_isChange'\s*:\s*'([^']+)'",
+                'leftTicketStr': r"'leftTicketStr'\s*:\s*'([^']+)'",
+                'train_location': r"'train_location'\s*:\s*'([^']+)'"
+            }
+            for key, key_pattern in key_patterns.items():
+                match = re.search(key_pattern, t_info_str)
+                if match:
+                    ticket_info[key] = match.group(1)
+            if ticket_info:
+                break
+    return token, ticket_info
+
+
+def sample_page(filler_kb=80):
+    """生成与真实 initDc 页面结构、大小相近的页面（脚本前后有大段 HTML）"""
+    filler = '<div class="row"><span class="label">&nbsp;</span></div>\n'
+    half = filler * (filler_kb * 1024 // len(filler) // 2)
+    script = (
+        "<script type=\"text/javascript\">\n"
+        "var ctx = '/otn/';\n"
+        "var globalRepeatSubmitToken = '2f1c5b7a9e3d4c6b8a0f1e2d3c4b5a69';\n"
+        "var global_lang = 'zh_CN';\n"
+        "var ticketInfoForPassengerForm={'cardTypes':[{'end_station_name':null,'id':'1','value':'中国居民身份证'},"
+        "{'end_station_name':null,'id':'C','value':'港澳居民来往内地通行证'}],"
+        "'isAsync':'1',"
+        "'key_check_isChange':'7A1F3C9B2E4D6A8C0B1D3F5E7A9C2B4D6E8F0A1C3E5B7D9F1A2C4E6',"
+        "'leftTicketStr':'Xq%2BZ8aTqD1uO2cY4pRw6vN0mL3kJ5hG7fE9dC1bA3zY5xW7vU9tS',"
+        "'limitBuySeatTicketDTO':{'seat_type_codes':[{'id':'O','value':'二等座'},{'id':'M','value':'一等座'}],"
+        "'ticket_seat_codeMap':{'1':[{'id':'O','value':'二等座'}]},'ticket_type_codes':[{'id':'1','value':'成人票'}]},"
+        "'maxTicketNum':'5',"
+        "'orderRequestDTO':{'from_station_telecode':'VNP','to_station_telecode':'AOH','train_no':'240000G1010C'},"
+        "'purpose_codes':'00',"
+        "'queryLeftNewDetailDTO':{'BXRZ_num':'-1','arrive_time':'1248','from_station_name':'北京南'},"
+        "'queryLeftTicketRequestDTO':{'train_date':'20240101','train_no':'240000G1010C'},"
+        "'tour_flag':'dc',"
+        "'train_location':'P2'};\n"
+        "var orderRequestDTO={'adult_num':0,'apply_order_no':null};\n"
+        "</script>\n"
+    )
+    return "<!DOCTYPE html><html><head><meta charset=\"utf-8\">\n" + half + script + half + "</head><body></body></html>"
+
+
+def load_pages(pages_dir):
+    pages = []
+    for path in sorted(glob.glob(os.path.join(pages_dir, '*.html'))):
+        with open(path, encoding='utf-8', errors='replace') as f:
+            pages.append((os.path.basename(path), f.read()))
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description='initDc 页面解析微基准')
+    parser.add_argument('--pages', help='保存的 initDc 页面目录 (*.html)')
+    parser.add_argument('--number', type=int, default=200, help='每轮执行次数')
+    parser.add_argument('--repeat', type=int, default=5, help='轮数（取最快一轮）')
+    args = parser.parse_args()
+
+    pages = load_pages(args.pages) if args.pages else [('sample', sample_page())]
+    if not pages:
+        print(f"{args.pages} 中没有 .html 页面")
+        return
+
+    print(f"{'页面':<24} {'大小':>8} {'旧版(us)':>10} {'新版(us)':>10} {'加速':>7}  结果一致")
+    print("-" * 76)
+    for name, html in pages:
+        old = legacy_extract(html)
+        info = parse_init_dc(html)
+        same = old == (info.token, info.ticket_info())
+        legacy_us = min(timeit.repeat(lambda: legacy_extract(html), number=args.number,
+                                      repeat=args.repeat)) / args.number * 1e6
+        new_us = min(timeit.repeat(lambda: parse_init_dc(html), number=args.number,
+                                   repeat=args.repeat)) / args.number * 1e6
+        print(f"{name:<24} {len(html):>8} {legacy_us:>10.1f} {new_us:>10.1f} {legacy_us / new_us:>6.1f}x  {same}")
+
+
+if __name__ == '__main__':
+    main()
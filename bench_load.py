@@ -0,0 +1,198 @@
+"""
+Web 接口端到端压测
+模拟 N 个用户并发地走完 扫码登录 -> 车站联想 -> 查票 -> 乘客 ->（可选）下单 流程，
+统计整体吞吐量以及每个接口的 p50/p99 延迟
+
+配合本地模拟服务使用：
+    python mock_12306.py --port 8306 --latency 30 --jitter 10
+    KYFW_BASE_URL=http://127.0.0.1:8306 python app.py
+    python bench_load.py --users 50 --iterations 20 --book --mock-url http://127.0.0.1:8306
+"""
+
+import argparse
+import json
+import math
+import threading
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+import requests
+
+
+class LatencyRecorder:
+    """按接口汇总请求耗时与失败数"""
+
+    def __init__(self):
+        self._latencies: Dict[str, List[float]] = defaultdict(list)
+        self._errors: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, seconds: float, ok: bool):
+        with self._lock:
+            self._latencies[endpoint].append(seconds)
+            if not ok:
+                self._errors[endpoint] += 1
+
+    def report(self, elapsed: float) -> Dict:
+        with self._lock:
+            endpoints = {}
+            total = 0
+            for endpoint, values in sorted(self._latencies.items()):
+                values = sorted(values)
+                total += len(values)
+                endpoints[endpoint] = {
+                    'count': len(values),
+                    'errors': self._errors.get(endpoint, 0),
+                    'rps': round(len(values) / elapsed, 2) if elapsed else 0,
+                    'p50_ms': round(percentile(values, 50) * 1000, 1),
+                    'p99_ms': round(percentile(values, 99) * 1000, 1),
+                    'max_ms': round(values[-1] * 1000, 1),
+                }
+        return {
+            'elapsed_s': round(elapsed, 2),
+            'requests': total,
+            'throughput_rps': round(total / elapsed, 2) if elapsed else 0,
+            'endpoints': endpoints,
+        }
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """最近秩法百分位数，输入需已排序"""
+    if not sorted_values:
+        return 0.0
+    rank = min(len(sorted_values), max(1, math.ceil(pct / 100 * len(sorted_values)))) - 1
+    return sorted_values[rank]
+
+
+class SimulatedUser:
+    """一个浏览器会话：独立的 Cookie（Flask session_id）"""
+
+    def __init__(self, base_url: str, recorder: LatencyRecorder, args):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.args = args
+        self.http = requests.Session()
+
+    def call(self, method: str, path: str, endpoint: Optional[str] = None, **kwargs) -> Optional[Dict]:
+        """请求一个接口并记录耗时；endpoint 为统计用的接口名（默认即 path）"""
+        kwargs.setdefault('timeout', self.args.timeout)
+        started = time.perf_counter()
+        data = None
+        try:
+            resp = self.http.request(method, self.base_url + path, **kwargs)
+            if resp.headers.get('Content-Type', '').startswith('application/json'):
+                data = resp.json()
+            ok = resp.status_code == 200 and (data is None or data.get('success', True))
+        except (requests.RequestException, ValueError):
+            ok = False
+        self.recorder.record(endpoint or path, time.perf_counter() - started, ok)
+        return data
+
+    def login(self) -> bool:
+        self.call('GET', '/')
+        data = self.call('POST', '/api/login/qrcode')
+        if not data or not data.get('success'):
+            return False
+        uuid = data['uuid']
+        status = ''
+        deadline = time.time() + self.args.login_timeout
+        while time.time() < deadline:
+            data = self.call('GET', f'/api/login/status/{uuid}/wait', endpoint='/api/login/status/<uuid>/wait',
+                             params={'since': status, 'timeout': 10})
+            if not data or not data.get('success'):
+                return False
+            status = data.get('status', '')
+            if data.get('logged_in') or status == 'success':
+                return True
+            if status in ('failed', 'expired'):
+                return False
+        return False
+
+    def run(self, stop_at: Optional[float]):
+        if not self.login():
+            self.recorder.record('login', 0.0, False)
+            return
+        for _ in range(self.args.iterations):
+            if stop_at and time.time() >= stop_at:
+                break
+            self.call('GET', '/api/stations/suggest', params={'q': self.args.from_station[:1]})
+            data = self.call('POST', '/api/tickets/query', json={
+                'from_station': self.args.from_station,
+                'to_station': self.args.to_station,
+                'date': self.args.date,
+            })
+            trains = (data or {}).get('trains') or []
+            passengers = self.call('GET', '/api/passengers')
+            if self.args.book and trains and passengers and passengers.get('passengers'):
+                self.call('POST', '/api/booking/submit', json={
+                    'from_station': self.args.from_station,
+                    'to_station': self.args.to_station,
+                    'date': self.args.date,
+                    'train_no': trains[0]['train_no'],
+                    'passenger_ids': [0],
+                    'seat_type': 'O',
+                })
+            if self.args.think_time:
+                time.sleep(self.args.think_time)
+
+
+def print_report(report: Dict):
+    print(f"\n总耗时 {report['elapsed_s']}s，共 {report['requests']} 个请求，吞吐量 {report['throughput_rps']} req/s\n")
+    print(f"{'接口':<40} {'次数':>7} {'失败':>6} {'req/s':>8} {'p50(ms)':>9} {'p99(ms)':>9} {'max(ms)':>9}")
+    print("-" * 94)
+    for endpoint, row in report['endpoints'].items():
+        print(f"{endpoint:<40} {row['count']:>7} {row['errors']:>6} {row['rps']:>8} "
+              f"{row['p50_ms']:>9} {row['p99_ms']:>9} {row['max_ms']:>9}")
+    upstream = report.get('upstream')
+    if upstream:
+        print(f"\n模拟服务收到 {upstream['requests']} 个请求，新建 {upstream['connections']} 个连接")
+
+
+def mock_stats(mock_url: str) -> Dict:
+    return requests.get(f"{mock_url.rstrip('/')}/_mock/config", timeout=5).json()['stats']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Web 接口端到端压测')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5001', help='Flask 服务地址')
+    parser.add_argument('--users', type=int, default=10, help='并发用户数')
+    parser.add_argument('--iterations', type=int, default=10, help='每个用户的查询轮数')
+    parser.add_argument('--duration', type=float, default=0, help='最长运行时间(秒)，0 表示不限')
+    parser.add_argument('--from-station', default='北京')
+    parser.add_argument('--to-station', default='上海')
+    parser.add_argument('--date', default=(date.today() + timedelta(days=1)).isoformat())
+    parser.add_argument('--book', action='store_true', help='每轮查询后提交订单（仅限模拟服务！）')
+    parser.add_argument('--think-time', type=float, default=0, help='每轮之间的停顿(秒)')
+    parser.add_argument('--timeout', type=float, default=60, help='单个请求超时(秒)')
+    parser.add_argument('--login-timeout', type=float, default=60, help='扫码登录最长等待(秒)')
+    parser.add_argument('--json', action='store_true', help='以 JSON 输出结果')
+    parser.add_argument('--mock-url', default='', help='模拟服务地址，给出时统计压测期间的上游请求数和新建连接数')
+    args = parser.parse_args()
+
+    recorder = LatencyRecorder()
+    stop_at = time.time() + args.duration if args.duration else None
+    users = [SimulatedUser(args.base_url, recorder, args) for _ in range(args.users)]
+    threads = [threading.Thread(target=user.run, args=(stop_at,), daemon=True) for user in users]
+
+    before = mock_stats(args.mock_url) if args.mock_url else None
+    print(f"启动 {args.users} 个模拟用户 -> {args.base_url}")
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    report = recorder.report(time.perf_counter() - started)
+    if before is not None:
+        after = mock_stats(args.mock_url)
+        report['upstream'] = {key: after[key] - before[key] for key in ('requests', 'connections')}
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+12306 HTTP 连接策略
+所有访问 12306 的 curl_cffi Session 使用同一套 keep-alive / 连接缓存参数：
+- curl_cffi 默认每个线程一个 curl 句柄，连接缓存跟着线程走；并发查询的 Session 每次借出时
+  可能在不同线程中使用，连接几乎无法复用，每次都要重新 DNS+TCP+TLS。
+  这类一次只借给一个线程的 Session 用 new_session(pinned=True) 固定使用一个 curl 句柄（连接缓存跟着 Session 走）。
+  登录 Session 被扫码轮询、各 Web 请求同时使用，仍按线程使用各自的句柄，请求之间互不阻塞
+- 开启 TCP keep-alive，并限制空闲连接的复用时长，避免复用已被服务端关闭的连接
+- 每个响应附带 libcurl 的分阶段耗时，用 request_timing() 拆分为建连和传输两部分
+旧版 curl_cffi 不支持的参数会被忽略，退回默认行为
+"""
+
+import os
+import threading
+from typing import Dict, Optional
+
+from curl_cffi import requests
+from curl_cffi.requests import AsyncSession
+
+try:
+    from curl_cffi import CurlInfo, CurlOpt
+except ImportError:  # 旧版 curl_cffi
+    CurlInfo = CurlOpt = None
+
+HTTP_MAX_CONNECTS = int(os.getenv('HTTP_MAX_CONNECTS', 8))              # 每个 Session 缓存的连接数
+HTTP_KEEPALIVE_IDLE = int(os.getenv('HTTP_KEEPALIVE_IDLE', 30))         # 空闲多久后开始发送 TCP keep-alive 探测(秒)
+HTTP_KEEPALIVE_INTERVAL = int(os.getenv('HTTP_KEEPALIVE_INTERVAL', 15))  # keep-alive 探测间隔(秒)
+HTTP_CONN_MAX_IDLE = int(os.getenv('HTTP_CONN_MAX_IDLE', 55))           # 空闲超过此时间的连接不再复用(秒)
+HTTP_CONN_MAX_LIFETIME = int(os.getenv('HTTP_CONN_MAX_LIFETIME', 600))  # 连接最长使用时间(秒)
+
+_CURL_OPTIONS = (
+    ('TCP_KEEPALIVE', 1),
+    ('TCP_KEEPIDLE', HTTP_KEEPALIVE_IDLE),
+    ('TCP_KEEPINTVL', HTTP_KEEPALIVE_INTERVAL),
+    ('MAXCONNECTS', HTTP_MAX_CONNECTS),
+    ('MAXAGE_CONN', HTTP_CONN_MAX_IDLE),
+    ('MAXLIFETIME_CONN', HTTP_CONN_MAX_LIFETIME),
+)
+_TIMING_INFOS = ('NAMELOOKUP_TIME', 'CONNECT_TIME', 'APPCONNECT_TIME', 'PRETRANSFER_TIME',
+                 'STARTTRANSFER_TIME', 'TOTAL_TIME', 'NUM_CONNECTS')
+
+
+def _curl_options() -> Dict:
+    if CurlOpt is None:
+        return {}
+    return {getattr(CurlOpt, name): value for name, value in _CURL_OPTIONS if hasattr(CurlOpt, name)}
+
+
+def _curl_infos():
+    if CurlInfo is None:
+        return []
+    return [getattr(CurlInfo, name) for name in _TIMING_INFOS if hasattr(CurlInfo, name)]
+
+
+class KeepAliveSession(requests.Session):
+    """
+    固定使用一个 curl 句柄的 Session，跨线程复用连接
+    curl 句柄不能并发使用，请求在 Session 内串行：只用于同一时刻只有一个使用者的 Session
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._request_lock = threading.Lock()
+
+    def request(self, *args, **kwargs):
+        with self._request_lock:
+            return super().request(*args, **kwargs)
+
+
+def new_session(pinned: bool = False, **kwargs) -> requests.Session:
+    """
+    创建访问 12306 的同步 Session
+    pinned=True 时固定使用一个 curl 句柄（见 KeepAliveSession），用于借出使用的并发查询 Session；
+    默认按线程使用 curl 句柄，多个线程可以同时发起请求
+    """
+    options = dict(curl_options=_curl_options(), curl_infos=_curl_infos())
+    if pinned:
+        options['use_thread_local_curl'] = False
+    options.update(kwargs)
+    try:
+        return KeepAliveSession(**options) if pinned else requests.Session(**options)
+    except TypeError:
+        # 旧版 curl_cffi：不支持上述参数时使用默认（按线程的）curl 句柄
+        return requests.Session(**kwargs)
+
+
+def new_async_session(**kwargs) -> AsyncSession:
+    """创建访问 12306 的 AsyncSession（同一事件循环内的请求本就共享连接缓存）"""
+    options = dict(curl_options=_curl_options(), curl_infos=_curl_infos(), max_clients=HTTP_MAX_CONNECTS)
+    options.update(kwargs)
+    try:
+        return AsyncSession(**options)
+    except TypeError:
+        return AsyncSession(**kwargs)
+
+
+def request_timing(resp) -> Optional[Dict[str, float]]:
+    """
+    从响应的 libcurl 计时中拆分耗时(秒)：
+    connect  - DNS + TCP + TLS 握手，复用连接时接近 0
+    transfer - 发送请求到接收完响应
+    new_connections - 本次请求新建的连接数
+    没有计时信息（旧版 curl_cffi）时返回 None
+    """
+    infos = getattr(resp, 'infos', None)
+    if not infos or CurlInfo is None:
+        return None
+    total = infos.get(CurlInfo.TOTAL_TIME)
+    if total is None:
+        return None
+    connect = max(infos.get(CurlInfo.APPCONNECT_TIME) or 0.0, infos.get(CurlInfo.CONNECT_TIME) or 0.0)
+    num_connects = getattr(CurlInfo, 'NUM_CONNECTS', None)
+    return {
+        'connect': connect,
+        'transfer': max(total - connect, 0.0),
+        'new_connections': int(infos.get(num_connects) or 0) if num_connects is not None else 0,
+    }
@@ -0,0 +1,106 @@
+"""
+initDc 页面解析
+从 confirmPassenger/initDc 返回的 HTML 中提取下单所需的
+globalRepeatSubmitToken 和 ticketInfoForPassengerForm 中的关键字段。
+正则全部预编译；先用 str.find 定位变量，再只在其后有限长度的窗口内匹配
+（ticketInfo 的窗口截止到与之配对的右花括号），整页只顺序扫描一遍
+"""
+
+import re
+from typing import Dict, NamedTuple, Optional
+
+TOKEN_MARKER = "globalRepeatSubmitToken"
+TICKET_INFO_MARKER = "ticketInfoForPassengerForm"
+
+# 变量赋值语句和 ticketInfo 对象的最大长度（真实页面中 ticketInfo 约 3~6KB）
+TOKEN_WINDOW = 256
+TICKET_INFO_WINDOW = 32 * 1024
+
+_TOKEN_RE = re.compile(r"\s*=\s*'([^']+)'")
+_TICKET_INFO_START_RE = re.compile(r"\s*=\s*\{")
+_TICKET_FIELD_RE = re.compile(r"'(key_check_isChange|leftTicketStr|train_location)'\s*:\s*'([^']*)'")
+# 定位 ticketInfo 对象的结尾：跳过引号内的字符串，只统计其外的花括号
+_OBJECT_TOKEN_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|[{}]")
+# ticketInfo 缺失或不完整时的兜底：页面中的 URL 参数
+_URL_FIELD_RE = re.compile(r"(leftTicketStr|train_location)=([^&\"']+)")
+
+TICKET_INFO_FIELDS = ('key_check_isChange', 'leftTicketStr', 'train_location')
+
+
+class InitDcInfo(NamedTuple):
+    """initDc 页面的解析结果，缺失的字段为空串"""
+    token: str = ''
+    key_check_isChange: str = ''
+    leftTicketStr: str = ''
+    train_location: str = ''
+    found_ticket_info: bool = False  # ticketInfo 对象中解析到了全部 TICKET_INFO_FIELDS
+
+    @property
+    def complete(self) -> bool:
+        return bool(self.token and self.key_check_isChange)
+
+    def ticket_info(self) -> Dict[str, str]:
+        """只包含已提取字段的字典（与旧版 get_token_and_ticket_info 的返回格式一致）"""
+        return {field: getattr(self, field) for field in TICKET_INFO_FIELDS if getattr(self, field)}
+
+
+def _find_assignment(html: str, marker: str, pattern, start: int = 0):
+    """查找 `marker = ...` 形式的赋值，返回 (匹配对象, marker 位置)，未找到时匹配对象为 None"""
+    pos = html.find(marker, start)
+    while pos != -1:
+        match = pattern.match(html, pos + len(marker), pos + len(marker) + TOKEN_WINDOW)
+        if match:
+            return match, pos
+        pos = html.find(marker, pos + len(marker))
+    return None, -1
+
+
+def _object_end(html: str, start: int, limit: int) -> int:
+    """start 位于对象的 { 之后，返回与之配对的 } 的位置；limit 之内没有配对时返回 limit"""
+    depth = 1
+    for token in _OBJECT_TOKEN_RE.finditer(html, start, limit):
+        char = token.group()
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return token.start()
+    return limit
+
+
+def parse_init_dc(html: Optional[str]) -> InitDcInfo:
+    """解析 initDc 页面，页面为空或不含所需数据时返回各字段为空的结果"""
+    if not html:
+        return InitDcInfo()
+
+    token = ''
+    match, token_pos = _find_assignment(html, TOKEN_MARKER, _TOKEN_RE)
+    if match:
+        token = match.group(1)
+
+    # ticketInfo 在页面中位于 token 之后，从 token 处继续查找，找不到再从头查找
+    fields = {}
+    search_from = max(token_pos, 0)
+    match, info_pos = _find_assignment(html, TICKET_INFO_MARKER, _TICKET_INFO_START_RE, search_from)
+    if match is None and search_from:
+        match, info_pos = _find_assignment(html, TICKET_INFO_MARKER, _TICKET_INFO_START_RE)
+    if match is not None:
+        start = match.end()
+        end = _object_end(html, start, min(start + TICKET_INFO_WINDOW, len(html)))
+        for field_match in _TICKET_FIELD_RE.finditer(html, start, end):
+            fields.setdefault(field_match.group(1), field_match.group(2))
+            if len(fields) == len(TICKET_INFO_FIELDS):
+                break
+    found_ticket_info = len(fields) == len(TICKET_INFO_FIELDS)
+    if not found_ticket_info:
+        # 没有 ticketInfo，或其中缺少字段：缺少的字段从 URL 参数中补
+        missing = {'leftTicketStr', 'train_location'} - fields.keys()
+        for field_match in _URL_FIELD_RE.finditer(html) if missing else ():
+            if field_match.group(1) in missing:
+                fields[field_match.group(1)] = field_match.group(2)
+                missing.discard(field_match.group(1))
+                if not missing:
+                    break
+
+    return InitDcInfo(token=token, found_ticket_info=found_ticket_info, **fields)
@@ -1,166 +1,519 @@
+import os
 import time
 import sys
 import json
 import re
+import threading
+import queue
+import logging
+from contextlib import contextmanager
 from urllib.parse import unquote
-from curl_cffi import requests
 from stations import StationManager
-from test import Tiantiel12306Login
-from mcp_integration import MCP12306Service, OptimizedTicketBooking
+from ticket_parser import parse_left_ticket_response
+from initdc_parser import parse_init_dc
+from ticket_cache import Flight, TicketQueryError, ticket_query_cache
+from http_pool import new_session
+from transfer_planner import TransferPlanner
+import metrics
+from log_setup import get_logger, mask_id_no, setup_logging
+from test import Tiantiel12306Login, KYFW_BASE_URL
+from mcp_integration import MCP12306Service, OptimizedTicketBooking, collect_batch_results
+
+DEFAULT_QUERY_URL = f"{KYFW_BASE_URL}/otn/leftTicket/query"
+
+log = get_logger("booking")
+
+# 每个会话 ticket_info 中最多保留的车次数
+TICKET_INFO_MAX = 512
+# 常用联系人缓存时长(秒)
+PASSENGER_CACHE_TTL = float(os.getenv('PASSENGER_CACHE_TTL', 600))
+# 登录后预先建立连接的并发查询 Session 数
+WARMUP_WORKER_SESSIONS = int(os.getenv('WARMUP_WORKER_SESSIONS', 2))
+
+
+class DynamicQueryUrlCache:
+    """
+    进程级的动态查票 URL 缓存
+    - 解析出的 CLeftTicketUrl 在 TTL 内直接复用，不再每次抓取 init 页面
+    - 并发调用者（线程或事件循环中的协程）共享同一次刷新，只有一个请求真正去抓取 init 页面
+    """
+
+    def __init__(self, ttl=600, fallback_ttl=30, wait_timeout=15):
+        self.ttl = ttl                      # 成功解析后的缓存时长(秒)
+        self.fallback_ttl = fallback_ttl    # 解析失败使用默认接口时的缓存时长(秒)
+        self.wait_timeout = wait_timeout    # 等待其他线程刷新的最长时间(秒)
+        self._url = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = None             # 正在进行的刷新 (ticket_cache.Flight)
+
+    def get(self, fetcher):
+        """获取查票 URL，过期或未初始化时通过 fetcher() 刷新"""
+        url, flight, leader = self._join()
+        if flight is None:
+            return url
+        if not leader:
+            # 其他线程正在刷新，等待其结果
+            flight.wait(self.wait_timeout)
+            return self._url or DEFAULT_QUERY_URL
+        url = None
+        try:
+            url = fetcher()
+        finally:
+            self._land(flight, url)
+        return self._url
+
+    async def get_async(self, fetcher):
+        """get 的协程版本，fetcher 返回协程；与同步调用者共享同一次刷新"""
+        url, flight, leader = self._join()
+        if flight is None:
+            return url
+        if not leader:
+            await flight.wait_async(self.wait_timeout)
+            return self._url or DEFAULT_QUERY_URL
+        url = None
+        try:
+            url = await fetcher()
+        finally:
+            self._land(flight, url)
+        return self._url
+
+    def _join(self):
+        """缓存有效时返回 (URL, None, False)，否则加入进行中的刷新，返回 (None, 刷新, 是否由自己发起)"""
+        with self._lock:
+            if self._url and time.time() < self._expires_at:
+                metrics.cache_result("query_url", True)
+                return self._url, None, False
+            metrics.cache_result("query_url", False)
+            flight = self._refreshing
+            leader = flight is None
+            if leader:
+                flight = self._refreshing = Flight()
+        return None, flight, leader
+
+    def _land(self, flight, url):
+        with self._lock:
+            if url:
+                self._url = url
+                self._expires_at = time.time() + self.ttl
+            else:
+                self._url = DEFAULT_QUERY_URL
+                self._expires_at = time.time() + self.fallback_ttl
+            self._refreshing = None
+        flight.finish()
+
+    def set(self, url):
+        """直接写入新的查票 URL（例如接口返回 c_url 时）"""
+        with self._lock:
+            self._url = url
+            self._expires_at = time.time() + self.ttl
+
+    def invalidate(self, stale_url=None):
+        """
+        使缓存失效
+        传入 stale_url 时只有当前缓存仍是该 URL 才失效，
+        避免多个并发失败的请求触发多次刷新
+        """
+        with self._lock:
+            if stale_url is None or self._url == stale_url:
+                self._url = None
+                self._expires_at = 0.0
+
+
+# 全进程共享的查票 URL 缓存
+query_url_cache = DynamicQueryUrlCache()
+
+
+def build_query_params(from_code, to_code, date):
+    return {
+        "leftTicketDTO.train_date": date,
+        "leftTicketDTO.from_station": from_code,
+        "leftTicketDTO.to_station": to_code,
+        "purpose_codes": "ADULT"
+    }
+
+
+def format_ticket_table(records):
+    """命令行余票表（只列出可预订的车次）"""
+    lines = [
+        f"\n查询成功，共找到 {len(records)} 个车次：\n",
+        f"{'车次':<6} {'出发':<6} {'到达':<6} {'历时':<6} {'二等座':<8} {'一等座':<8} {'商务座':<8}",
+        "-" * 60,
+    ]
+    for record in records:
+        if record.can_book:
+            lines.append(f"{record.train_no:<6} {record.start_time:<6} {record.arrive_time:<6} {record.duration:<6} "
+                         f"{record.seat('ze_num'):<8} {record.seat('zy_num'):<8} {record.seat('swz_num'):<8}")
+    lines.append("-" * 60)
+    return "\n".join(lines)
+
+
+# 下单失败后的重试次数和重试前等待(秒)
+BOOKING_MAX_RETRIES = 3
+BOOKING_RETRY_DELAY = 2
+
+
+def booking_steps(booking, from_station, to_station, date, target_train_no, selected_passengers, seat_type):
+    """
+    一次完整的抢票流程 (Query -> Submit -> InitDc -> Confirm)，同步和异步客户端共用这一份步骤定义
+    生成器逐步 yield (方法名, 位置参数, 关键字参数)，由 TicketBooking / AsyncTicketBooking 的
+    run_steps 调用自身的同名方法后把结果 send 回来（方法抛出的异常会 throw 回来），最终返回是否下单成功
+    """
+    for attempt in range(BOOKING_MAX_RETRIES):
+        if attempt:
+            yield "retry_sleep", (BOOKING_RETRY_DELAY,), {}
+        log.info("尝试抢票", extra={"train": target_train_no, "attempt": attempt + 1, "max": BOOKING_MAX_RETRIES})
+
+        # 1. 查询最新 SecretStr（跳过共享缓存，必须用本会话刷新）
+        with metrics.stage("query") as stage:
+            yield "query_ticket_records", (from_station, to_station, date), {"use_cache": False}
+            stage.ok = target_train_no in booking.ticket_info
+        if not stage.ok:
+            log.info("刷新失败，车次可能已不可预订", extra={"train": target_train_no})
+            continue
+
+        info = booking.ticket_info.get(target_train_no)
+        left_ticket = info['leftTicket']
+        train_location = info['location']
+
+        # 2. 提交订单请求
+        with metrics.stage("submit_order") as stage:
+            stage.ok = yield "submit_order_request", (info['secret'], date, from_station, to_station), {}
+        if not stage.ok:
+            log.info("提交订单请求失败 (车次过期/无票/风控)", extra={"train": target_train_no})
+            continue
+
+        # 3. 获取 Token 和 关键参数 (initDc)
+        # 这一步必须在 submit 成功后进行，以获取最新的 token 和 key_check
+        with metrics.stage("init_dc") as stage:
+            token, ticket_info = yield "get_token_and_ticket_info", (), {}
+            stage.ok = bool(token and ticket_info)
+        if not token:
+            log.info("获取Token失败")
+            continue
+        if not ticket_info:
+            log.info("获取ticket_info失败")
+            continue
+
+        # 使用 initDc 返回的最新数据更新
+        left_ticket = ticket_info.get('leftTicketStr') or left_ticket
+        train_location = ticket_info.get('train_location') or train_location
+        key_check = ticket_info.get('key_check_isChange')
+        if not key_check:
+            log.info("缺少关键参数 key_check_isChange")
+            continue
+
+        # 4. 确认排队
+        if (yield from confirm_steps(booking, target_train_no, selected_passengers, token, key_check, left_ticket,
+                                     train_location, from_station, to_station, date, seat_type)):
+            log.info("下单请求已提交", extra={"train": target_train_no})
+            return True
+        log.info("下单失败", extra={"train": target_train_no, "attempt": attempt + 1})
+
+    log.info("所有重试均失败", extra={"train": target_train_no})
+    return False
+
+
+def confirm_steps(booking, train_no, passengers, token, key_check_isChange, left_ticket, train_location,
+                  from_station_name, to_station_name, date, seat_type="O"):
+    """确认出票的步骤序列 (checkOrderInfo -> getQueueCount -> confirmSingleForQueue)，约定同 booking_steps"""
+    passenger_ticket_str, old_passenger_str = booking.build_passenger_strs(passengers, seat_type)
+
+    # 4.1 checkOrderInfo
+    with metrics.stage("check_order_info") as stage:
+        request = booking.build_check_order_request(passenger_ticket_str, old_passenger_str, token)
+        stage.ok = yield "_call", (request, booking.parse_check_order, "CheckOrderInfo"), {}
+    if not stage.ok:
+        return False
+
+    # 4.15 getQueueCount
+    with metrics.stage("queue_count") as stage:
+        stage.ok = yield "get_queue_count", (train_no, from_station_name, to_station_name, date,
+                                             left_ticket, train_location, seat_type, token), {}
+    if not stage.ok:
+        log.warning("余票校验失败或队列校验失败")
+        return False
+
+    # 4.2 confirmSingleForQueue
+    with metrics.stage("confirm_queue") as stage:
+        request = booking.build_confirm_request(passenger_ticket_str, old_passenger_str, key_check_isChange,
+                                                left_ticket, train_location, token)
+        stage.ok = yield "_call", (request, booking.parse_confirm, "ConfirmQueue"), {}
+    return stage.ok
+
 
 class TicketBooking(Tiantiel12306Login):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, cookie_key=None):
+        super().__init__(cookie_key=cookie_key)
         self.station_manager = StationManager()
-        self.ticket_info = {} # 存储车次信息 {train_no: {secret: ..., leftTicket: ..., location: ...}}
+        self.ticket_info = {} # 存储车次信息 {train_no: TrainRecord}
+        self.ticket_info_version = 0  # ticket_info 每次更新加一，用于判断会话是否需要写回
+        self._worker_sessions = queue.Queue()  # 并发查询使用的空闲 Session
+        # 常用联系人缓存（只在内存中，不写入 Redis）
+        self._passengers = None
+        self._passengers_expires_at = 0.0
+        self._passengers_lock = threading.Lock()
+        self._async_client = None
         # 初始化MCP服务
         self.mcp_service = MCP12306Service()
         self.optimizer = OptimizedTicketBooking(self)
     
     def smart_query_tickets(self, from_city: str, to_city: str, date_input: str, 
-                          train_types: str = "", sort_by: str = ""):
-        """智能查询车票 - MCP集成版本"""
-        return self.optimizer.smart_query_tickets(from_city, to_city, date_input, train_types, sort_by)
+                          train_types: str = "", sort_by: str = "", city: bool = False, filters=None):
+        """智能查询车票 - MCP集成版本（city=True 时查询两城市间所有车站组合，filters 见 ticket_table）"""
+        return self.optimizer.smart_query_tickets(from_city, to_city, date_input, train_types, sort_by, city=city,
+                                                  filters=filters)
+    
+    def query_city_records(self, from_city: str, to_city: str, date: str):
+        """按城市查询车票，返回合并去重后的 TrainRecord 列表"""
+        return self.optimizer.query_city_records(from_city, to_city, date)
+    
+    def batch_query_tickets(self, from_city: str, to_city: str, dates: list, filters=None):
+        """批量查询多个日期的车票，返回 ({日期: 车次列表}, {失败的日期: 错误信息})"""
+        return collect_batch_results(dates, self.iter_batch_query_tickets(from_city, to_city, dates, filters))
+    
+    def plan_transfers(self, from_station: str, to_station: str, date_input: str, hubs=None,
+                       min_layover=None, max_layover=None, limit: int = 20):
+        """
+        一次换乘行程规划（直达无票时使用），返回按总历时排序的 Itinerary 列表
+        hubs 为候选枢纽车站名，默认使用 transfer_planner.TRANSFER_HUBS
+        """
+        from_code = self.mcp_service.get_station_code(from_station)
+        to_code = self.mcp_service.get_station_code(to_station)
+        if not from_code or not to_code:
+            raise ValueError(f"找不到车站信息: {from_station} -> {to_station}")
+        options = {}
+        if min_layover is not None:
+            options['min_layover'] = int(min_layover)
+        if max_layover is not None:
+            options['max_layover'] = int(max_layover)
+        planner = TransferPlanner(self, **options)
+        return planner.plan(from_code, to_code, self.mcp_service.format_date(date_input), hubs=hubs, limit=limit)
     
-    def batch_query_tickets(self, from_city: str, to_city: str, dates: list):
-        """批量查询多个日期的车票"""
-        return self.optimizer.batch_query_multiple_dates(from_city, to_city, dates)
+    def iter_batch_query_tickets(self, from_city: str, to_city: str, dates: list, filters=None):
+        """
+        批量查询多个日期的车票，按完成顺序逐个产出 (日期, 车次列表, 错误信息)
+        各日期在共享事件循环中以协程并发查询（见 AsyncTicketBooking.iter_batch_query），不占用查询线程
+        """
+        from async_booking import async_runner
+        return async_runner.iterate(self.async_client().iter_batch_query(from_city, to_city, dates,
+                                                                         filters=filters))
     
     def get_station_suggestions(self, partial_name: str):
-        """获取车站名称建议"""
-        suggestions = []
-        for station_name in self.mcp_service.station_cache.keys():
-            if partial_name.lower() in station_name.lower():
-                suggestions.append({
-                    'name': station_name,
-                    'code': self.mcp_service.station_cache[station_name]
-                })
-        return suggestions[:10]  # 返回前10个匹配结果
-
-    def get_dynamic_query_url(self):
+        """获取车站名称建议（完全匹配 > 前缀 > 包含，主要车站在前）"""
+        return self.mcp_service.suggest_engine.suggest(partial_name, limit=10)
+
+    @contextmanager
+    def worker_session(self):
         """
-        获取动态查票 URL
+        借出一个带有当前登录 Cookies 的独立 Session，供并发查询使用
+        用完归还，复用其连接
         """
-        init_url = "https://kyfw.12306.cn/otn/leftTicket/init"
         try:
-            print("正在获取动态查询接口...")
-            resp = self.session.get(init_url, headers=self.headers, impersonate="chrome120")
-            match = re.search(r"var CLeftTicketUrl = '([^']+)';", resp.text)
-            if match:
-                dynamic_part = match.group(1)
-                print(f"获取动态查询接口成功: {dynamic_part}")
-                return f"https://kyfw.12306.cn/otn/{dynamic_part}"
-            else:
-                print("未找到动态查询接口，使用默认接口")
-                return "https://kyfw.12306.cn/otn/leftTicket/query"
+            session = self._worker_sessions.get_nowait()
+        except queue.Empty:
+            session = new_session(pinned=True)
+        session.cookies.update(self.session.cookies.get_dict())
+        try:
+            yield session
+        finally:
+            self._worker_sessions.put(session)
+
+    def fetch_dynamic_query_url(self, session=None, timeout=None):
+        """
+        抓取 init 页面解析动态查票 URL，失败返回 None
+        """
+        init_url = f"{KYFW_BASE_URL}/otn/leftTicket/init"
+        session = session or self.session
+        try:
+            log.debug("正在获取动态查询接口")
+            resp = self._upstream("GET", init_url, session=session, timeout=timeout)
+            return self.parse_dynamic_query_url(resp.text)
         except Exception as e:
-            print(f"获取动态 URL 失败: {e}")
-            return "https://kyfw.12306.cn/otn/leftTicket/query"
+            log.warning("获取动态 URL 失败: %s", e)
+        return None
+
+    @staticmethod
+    def parse_dynamic_query_url(html):
+        match = re.search(r"var CLeftTicketUrl = '([^']+)';", html)
+        if match:
+            dynamic_part = match.group(1)
+            log.info("获取动态查询接口成功", extra={"query_path": dynamic_part})
+            return f"{KYFW_BASE_URL}/otn/{dynamic_part}"
+        log.warning("未找到动态查询接口，使用默认接口")
+        return None
+
+    def get_dynamic_query_url(self, session=None, timeout=None):
+        """
+        获取动态查票 URL（进程级缓存，过期后才重新抓取 init 页面）
+        """
+        return query_url_cache.get(lambda: self.fetch_dynamic_query_url(session, timeout))
 
-    def query_ticket(self, from_station_name, to_station_name, date):
+    def _get_query_json(self, params, session=None, timeout=None):
         """
-        查询车票
+        请求查票接口并返回 JSON
+        接口被重定向或返回非 JSON 时，使缓存的 URL 失效并重新获取一次
+        """
+        session = session or self.session
+        for attempt in range(2):
+            query_url = self.get_dynamic_query_url(session, timeout)
+            # 动态接口名 (queryA/queryZ...) 统一记为一个指标标签
+            resp = self._upstream("GET", query_url, endpoint="/otn/leftTicket/query", session=session,
+                                  params=params, timeout=timeout)
+            resp_json = self.parse_query_response(resp, query_url)
+            if resp_json is not None:
+                # 12306 在接口变更时会返回 {"c_url": "leftTicket/queryX", "status": false}
+                c_url = resp_json.get("c_url")
+                if c_url and attempt == 0:
+                    log.info("查询接口已变更", extra={"query_path": c_url})
+                    query_url_cache.set(f"{KYFW_BASE_URL}/otn/{c_url}")
+                    continue
+                return resp_json
+            log.warning("查询接口被重定向或返回非 JSON 数据，刷新动态查询接口")
+            query_url_cache.invalidate(query_url)
+        return None
+
+    @staticmethod
+    def parse_query_response(resp, query_url):
+        """查票响应的 JSON；被重定向或不是 JSON 对象时返回 None"""
+        if resp.status_code in (301, 302, 303, 307, 308) or (
+                resp.url and not str(resp.url).startswith(query_url)):
+            return None
+        try:
+            resp_json = resp.json()
+        except ValueError:
+            return None
+        return resp_json if isinstance(resp_json, dict) else None
+
+    def query_ticket_records(self, from_station_name, to_station_name, date, use_cache=True):
+        """
+        查询车票，返回解析后的 TrainRecord 列表（包含不可预订的车次）
+        有下单密钥的车次同时写入 self.ticket_info
         """
         from_code = self.station_manager.get_code(from_station_name)
         to_code = self.station_manager.get_code(to_station_name)
         
         if not from_code or not to_code:
-            print(f"错误: 找不到车站")
+            log.warning("找不到车站", extra={"from": from_station_name, "to": to_station_name})
             return None
 
-        print(f"正在查询 {date} 从 {from_station_name}({from_code}) 到 {to_station_name}({to_code}) 的车票...")
-        
-        query_url = self.get_dynamic_query_url()
-        
-        params = {
-            "leftTicketDTO.train_date": date,
-            "leftTicketDTO.from_station": from_code,
-            "leftTicketDTO.to_station": to_code,
-            "purpose_codes": "ADULT"
-        }
+        log.debug("查询车票 %s %s(%s) -> %s(%s)", date, from_station_name, from_code, to_station_name, to_code)
+        return self.query_records_by_code(from_code, to_code, date, use_cache=use_cache)
 
+    def query_records_by_code(self, from_code, to_code, date, session=None, timeout=None, store=True,
+                              use_cache=True, raise_errors=False):
+        """
+        按电报码查询车票，查询失败返回 None
+        session/timeout 供并发查询传入独立 Session 和超时；store=False 时不写入 self.ticket_info
+        use_cache=False 时跳过进程级缓存，用自己的会话重新获取最新 secretStr（下单前必须如此）
+        raise_errors=True 时失败抛出 TicketQueryError（批量查询据此区分查询失败和没有车次）
+        """
+        fetch = lambda: self._fetch_records(from_code, to_code, date, session, timeout)
         try:
-            resp = self.session.get(query_url, params=params, headers=self.headers, impersonate="chrome120")
-            
-            if "result" not in resp.json().get("data", {}):
-                 print("查询接口返回数据异常，请重试")
-                 return None
+            records = ticket_query_cache.get_or_fetch((from_code, to_code, date), fetch, force=not use_cache,
+                                                      wait_timeout=timeout)
+        except TicketQueryError:
+            if raise_errors:
+                raise
+            return None
 
-            result_list = resp.json()["data"]["result"]
-            
-            print(f"\n查询成功，共找到 {len(result_list)} 个车次：\n")
-            print(f"{'车次':<6} {'出发':<6} {'到达':<6} {'历时':<6} {'二等座':<8} {'一等座':<8} {'商务座':<8}")
-            print("-" * 60)
-
-            available_trains = []
-
-            for item_str in result_list:
-                item = item_str.split("|")
-                secret_str = item[0]      # 下单用的密钥
-                train_no = item[3]        # 车次 (G101)
-                train_no_internal = item[2] if len(item) > 2 else ""  # 内部车次编号
-                station_train_code = item[3] if len(item) > 3 else ""  # 展示车次
-                from_station_telecode = item[6] if len(item) > 6 else ""  # 出发站电报码
-                to_station_telecode = item[7] if len(item) > 7 else ""    # 到达站电报码
-                start_time = item[8]
-                arrive_time = item[9]
-                duration = item[10]
-                can_book = item[11]       # Y/N
-                left_ticket = item[12]    # leftTicket 字段
-                train_location = item[15] # train_location
-                
-                ze_num = item[30] if item[30] else "--" # 二等座
-                zy_num = item[31] if item[31] else "--" # 一等座
-                swz_num = item[32] if item[32] else "--" # 商务座
-                
-                # 存储更多信息供下单使用
-                if secret_str:
-                     self.ticket_info[train_no] = {
-                         "secret": unquote(secret_str),
-                         "leftTicket": left_ticket,
-                         "location": train_location,
-                         "start_time": start_time,
-                         "arrive_time": arrive_time,
-                         "duration": duration,
-                         "ze_num": ze_num,
-                         "zy_num": zy_num,
-                         "swz_num": swz_num,
-                         "train_no_internal": train_no_internal,
-                         "station_train_code": station_train_code,
-                         "from_station_telecode": from_station_telecode,
-                         "to_station_telecode": to_station_telecode
-                     }
-
-                if can_book == "Y":
-                    print(f"{train_no:<6} {start_time:<6} {arrive_time:<6} {duration:<6} {ze_num:<8} {zy_num:<8} {swz_num:<8}")
-                    available_trains.append(train_no)
-            
-            print("-" * 60)
-            return available_trains
+        # 存储车次记录供下单使用
+        if store:
+            self._remember_records(records)
+        return records
+
+    def _remember_records(self, records):
+        """写入 ticket_info，超过上限时丢弃最早写入的车次，避免长期运行的会话无限增长"""
+        ticket_info = self.ticket_info
+        for record in records:
+            if record.fields[0]:
+                ticket_info.pop(record.train_no, None)
+                ticket_info[record.train_no] = record
+        overflow = len(ticket_info) - TICKET_INFO_MAX
+        if overflow > 0:
+            for train_no in list(ticket_info)[:overflow]:
+                del ticket_info[train_no]
+        self.ticket_info_version += 1
+
+    def query_ticket_records_async(self, from_station_name, to_station_name, date, use_cache=True):
+        """
+        在共享事件循环中执行 query_ticket_records：使用登录后已预热的异步会话，
+        不会因为 Web 请求落在新的线程上而为线程本地的 curl 句柄重新建连
+        """
+        from async_booking import async_runner
+        return async_runner.run(self.async_client().query_ticket_records(from_station_name, to_station_name, date,
+                                                                         use_cache=use_cache))
+
+    def execute_booking_async(self, from_station, to_station, date, target_train_no, selected_passengers,
+                              seat_type):
+        """
+        在共享事件循环中执行 execute_booking（同一份 booking_steps）：
+        上游请求和重试等待都在事件循环中进行，调用线程只等待最终结果
+        """
+        from async_booking import async_runner
+        return async_runner.run(self.async_client().execute_booking(from_station, to_station, date,
+                                                                    target_train_no, selected_passengers,
+                                                                    seat_type))
+
+    def async_client(self):
+        """共享本会话 Cookie 的异步客户端（见 async_booking）"""
+        if self._async_client is None:
+            from async_booking import AsyncTicketBooking
+            self._async_client = AsyncTicketBooking(self)
+        return self._async_client
+
+    def close(self):
+        """关闭登录 Session、并发查询 Session 和异步客户端"""
+        if self._async_client is not None:
+            self._async_client.close_sync()
+        while True:
+            try:
+                self._worker_sessions.get_nowait().close()
+            except queue.Empty:
+                break
+            except Exception:
+                pass
+        try:
+            self.session.close()
+        except Exception:
+            pass
 
+    def _fetch_records(self, from_code, to_code, date, session=None, timeout=None):
+        """请求上游查票接口并解析，失败抛出 TicketQueryError"""
+        try:
+            resp_json = self._get_query_json(build_query_params(from_code, to_code, date), session, timeout)
         except Exception as e:
-            print(f"查询异常: {e}")
+            log.warning("查询异常: %s", e)
+            raise TicketQueryError(f"查询异常: {e}") from e
+        records = parse_left_ticket_response(resp_json) if resp_json else None
+        if records is None:
+            log.warning("查询接口返回数据异常", extra={"from": from_code, "to": to_code, "date": date})
+            raise TicketQueryError("查询接口返回数据异常")
+        return records
+
+    def query_ticket(self, from_station_name, to_station_name, date):
+        """
+        查询车票，打印余票表并返回可预订的车次号列表
+        """
+        records = self.query_ticket_records(from_station_name, to_station_name, date)
+        if records is None:
             return None
+        print(format_ticket_table(records))
+        return [record.train_no for record in records if record.can_book]
 
     def check_user(self):
-        """1. 校验用户状态"""
-        url = "https://kyfw.12306.cn/otn/login/checkUser"
-        data = {"_json_att": ""}
-        try:
-            resp = self.session.post(url, data=data, headers=self.headers, impersonate="chrome120")
-            print(f"CheckUser: {resp.json()}")
-            return resp.json().get("data", {}).get("flag") == True
-        except Exception as e:
-            print(f"CheckUser Error: {e}")
-            return False
+        """1. 校验用户状态（登录租约有效期内不请求 checkUser）"""
+        return self.is_login_valid()
 
-    def submit_order_request(self, secret_str, train_date, from_station_name, to_station_name):
-        """2. 提交下单请求"""
-        url = "https://kyfw.12306.cn/otn/leftTicket/submitOrderRequest"
+    # 下单各步骤的请求构造 (build_*) 和响应解析 (parse_*)，同步方法与 async_booking 共用
+    # build_* 返回 (method, url, 请求参数)
+
+    def build_submit_order_request(self, secret_str, train_date, from_station_name, to_station_name):
+        url = f"{KYFW_BASE_URL}/otn/leftTicket/submitOrderRequest"
         
         # 设置 Referer
         headers = self.headers.copy()
-        headers["Referer"] = "https://kyfw.12306.cn/otn/leftTicket/init"
+        headers["Referer"] = f"{KYFW_BASE_URL}/otn/leftTicket/init"
         
         data = {
             "secretStr": secret_str,
@@ -172,166 +525,198 @@ class TicketBooking(Tiantiel12306Login):
             "query_to_station_name": to_station_name,
             "undefined": ""
         }
+        return "POST", url, {"data": data, "headers": headers}
+
+    @staticmethod
+    def parse_submit_order(resp):
+        resp_json = resp.json()
+        ok = resp_json.get("status") == True
+        if not ok:
+            log.warning("SubmitOrderRequest 失败", extra={"messages": resp_json.get("messages")})
+        log.debug("SubmitOrderRequest: %s", resp_json)
+        return ok
+
+    def submit_order_request(self, secret_str, train_date, from_station_name, to_station_name):
+        """2. 提交下单请求"""
+        request = self.build_submit_order_request(secret_str, train_date, from_station_name, to_station_name)
+        return self._call(request, self.parse_submit_order, "SubmitOrderRequest")
+
+    def get_passengers(self, force=False):
+        """
+        获取常用联系人（按会话缓存）
+        TTL 内直接返回缓存；force=True 或缓存过期时重新查询，查询失败的结果不缓存
+        同一会话的并发请求共享同一次查询
+        """
+        with self._passengers_lock:
+            if not force and self._passengers is not None and time.time() < self._passengers_expires_at:
+                metrics.cache_result("passengers", True)
+                return self._passengers
+            metrics.cache_result("passengers", False)
+            passengers = self.get_passengers_direct()
+            if passengers:
+                self._passengers = passengers
+                self._passengers_expires_at = time.time() + PASSENGER_CACHE_TTL
+            else:
+                self._passengers = None
+            return passengers
+
+    def cached_passengers(self):
+        """TTL 内的联系人缓存，没有时返回 None（不发起查询）"""
+        with self._passengers_lock:
+            if self._passengers is not None and time.time() < self._passengers_expires_at:
+                metrics.cache_result("passengers", True)
+                return self._passengers
+        metrics.cache_result("passengers", False)
+        return None
+
+    def remember_passengers(self, passengers):
+        with self._passengers_lock:
+            if passengers:
+                self._passengers = passengers
+                self._passengers_expires_at = time.time() + PASSENGER_CACHE_TTL
+            else:
+                self._passengers = None
+
+    def invalidate_passengers(self):
+        """清除联系人缓存（重新登录、切换账号或用户要求刷新时）"""
+        with self._passengers_lock:
+            self._passengers = None
+            self._passengers_expires_at = 0.0
+
+    def cookie_auth(self):
+        authed = super().cookie_auth()
+        if authed:
+            self.invalidate_passengers()
+            self.warm_up()
+        return authed
+
+    def warm_up(self, workers=WARMUP_WORKER_SESSIONS):
+        """
+        登录后在后台预热连接，让随后的查票/下单请求不再承担建连耗时
+        登录 Session 刚完成 uamauthclient，连接已经建立；这里为并发查询 Session 和
+        Web 查票/下单使用的异步会话（在共享事件循环中）建立连接，并顺带刷新动态查票接口
+        """
+        threading.Thread(target=self._warm_up, args=(workers,), name="http-warmup", daemon=True).start()
+
+    def _warm_up(self, workers):
+        from async_booking import async_runner
+        started = time.perf_counter()
+        warming = async_runner.submit(self.async_client().warm_up())
+        sessions = []
+        for _ in range(workers):
+            try:
+                session = self._worker_sessions.get_nowait()
+            except queue.Empty:
+                session = new_session(pinned=True)
+            sessions.append(session)
+            try:
+                self._upstream("HEAD", f"{KYFW_BASE_URL}/otn/", endpoint="warmup", session=session,
+                               allow_redirects=False, timeout=5)
+            except Exception as e:
+                log.debug("连接预热失败: %s", e)
+        if sessions:
+            self.get_dynamic_query_url(session=sessions[0], timeout=10)
+        for session in sessions:
+            self._worker_sessions.put(session)
         try:
-            resp = self.session.post(url, data=data, headers=headers, impersonate="chrome120")
-            print(f"SubmitOrderRequest: {resp.json()}")
-            return resp.json().get("status") == True
+            warming.result(15)
         except Exception as e:
-            print(f"SubmitOrderRequest Error: {e}")
-            return False
-
-    def get_passengers_direct(self):
-        """查询常用联系人（使用 confirmPassenger/getPassengerDTOs）"""
-        # 先检查登录状态
-        if not self.check_user():
-            print("用户登录状态失效，需要重新登录")
-            return []
-            
-        url = "https://kyfw.12306.cn/otn/confirmPassenger/getPassengerDTOs"
+            warming.cancel()
+            log.debug("异步会话预热失败: %s", e)
+        log.info("连接预热完成", extra={"workers": workers, "ms": round((time.perf_counter() - started) * 1000, 1)})
+
+    def load_cookies(self):
+        loaded = super().load_cookies()
+        if loaded:
+            # 可能换成了其他进程登录的账号
+            self.invalidate_passengers()
+        return loaded
+
+    def build_passengers_request(self):
+        url = f"{KYFW_BASE_URL}/otn/confirmPassenger/getPassengerDTOs"
         
         # 添加更详细的headers
         headers = self.headers.copy()
         headers.update({
-            "Referer": "https://kyfw.12306.cn/otn/confirmPassenger/initDc",
+            "Referer": f"{KYFW_BASE_URL}/otn/confirmPassenger/initDc",
             "X-Requested-With": "XMLHttpRequest",
             "Accept": "application/json, text/javascript, */*; q=0.01",
             "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8"
         })
-        
+        return "POST", url, {"headers": headers}
+
+    @staticmethod
+    def parse_passengers(resp):
+        """解析联系人列表，失败时返回 []（响应中含证件号，不记录原始数据）"""
+        # 检查是否被重定向到登录页面
+        if resp.status_code == 200 and '<!DOCTYPE html>' in resp.text[:100]:
+            log.info("查询联系人时被重定向到登录页面，登录状态已失效")
+            return []
         try:
-            print("正在查询常用联系人...")
-            resp = self.session.post(url, headers=headers, impersonate="chrome120")
-            
-            print(f"联系人查询响应状态: {resp.status_code}")
-            print(f"响应Headers: {dict(resp.headers)}")
-            
-            # 检查是否被重定向到登录页面
-            if resp.status_code == 200 and '<!DOCTYPE html>' in resp.text[:100]:
-                print("检测到重定向到登录页面，登录状态已失效")
-                return []
-            
-            # 检查响应内容
-            try:
-                resp_json = resp.json()
-                print(f"联系人查询响应: {resp_json}")
-                
-                # 检查是否有错误信息
-                if "messages" in resp_json and resp_json["messages"]:
-                    print(f"接口返回错误信息: {resp_json['messages']}")
-                
-                # confirmPassenger/getPassengerDTOs 的数据结构
-                datas = None
-                if resp_json.get("data", {}).get("normal_passengers"):
-                    datas = resp_json["data"]["normal_passengers"]
-                
-                if datas:
-                    print(f"成功获取到 {len(datas)} 位联系人")
-                    for i, passenger in enumerate(datas[:3]):  # 显示前3个
-                        name = passenger.get('passenger_name', passenger.get('name', '未知'))
-                        id_no = passenger.get('passenger_id_no', passenger.get('id_no', '未知'))
-                        print(f"  {i+1}. {name} ({id_no})")
-                    return datas
-                else:
-                    print("响应中未找到联系人数据")
-                    print(f"完整的响应数据: {resp_json}")
-                    return []
-                    
-            except ValueError as ve:
-                print(f"JSON解析失败: {ve}")
-                print(f"响应内容: {resp.text[:500]}")
-                return []
-                
+            resp_json = resp.json()
+        except ValueError as ve:
+            log.warning("联系人响应 JSON 解析失败: %s", ve, extra={"status": resp.status_code, "length": len(resp.text)})
+            return []
+
+        if resp_json.get("messages"):
+            log.warning("联系人接口返回错误信息", extra={"messages": resp_json["messages"]})
+
+        # confirmPassenger/getPassengerDTOs 的数据结构
+        datas = (resp_json.get("data") or {}).get("normal_passengers")
+        if not datas:
+            log.info("响应中未找到联系人数据", extra={"status": resp_json.get("status")})
+            return []
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("联系人: %s", ", ".join(
+                f"{p.get('passenger_name', '')}({mask_id_no(p.get('passenger_id_no'))})" for p in datas))
+        return datas
+
+    def get_passengers_direct(self):
+        """查询常用联系人（使用 confirmPassenger/getPassengerDTOs）"""
+        # 先检查登录状态
+        if not self.check_user():
+            log.info("用户登录状态失效，需要重新登录")
+            return []
+        method, url, kwargs = self.build_passengers_request()
+        try:
+            return self.parse_passengers(self._upstream(method, url, **kwargs))
         except Exception as e:
-            print(f"获取联系人失败: {e}")
-            import traceback
-            traceback.print_exc()
+            log.warning("获取联系人失败: %s", e, exc_info=log.isEnabledFor(logging.DEBUG))
             return []
 
-    def get_token_and_ticket_info(self):
-        """3. 获取 Token 和 关键参数 (initDc)"""
-        init_dc_url = "https://kyfw.12306.cn/otn/confirmPassenger/initDc"
-        data = {"_json_att": ""}
+    def build_init_dc_request(self):
+        url = f"{KYFW_BASE_URL}/otn/confirmPassenger/initDc"
         
         # 设置 Referer
         headers = self.headers.copy()
-        headers["Referer"] = "https://kyfw.12306.cn/otn/leftTicket/init"
+        headers["Referer"] = f"{KYFW_BASE_URL}/otn/leftTicket/init"
+        return "POST", url, {"data": {"_json_att": ""}, "headers": headers}
+
+    @staticmethod
+    def parse_init_dc_response(resp):
+        """返回 (token, ticket_info)"""
+        html = resp.text
+        info = parse_init_dc(html)
+        if not info.token:
+            log.warning("InitDc Token 未找到", extra={"length": len(html)})
+        if not info.found_ticket_info:
+            log.warning("InitDc TicketInfo 未找到，使用页面参数兜底", extra={"length": len(html)})
+        return info.token, info.ticket_info()
 
+    def get_token_and_ticket_info(self):
+        """3. 获取 Token 和 关键参数 (initDc)"""
+        method, url, kwargs = self.build_init_dc_request()
         try:
-            resp = self.session.post(init_dc_url, data=data, headers=headers, impersonate="chrome120")
-            html = resp.text
-            token = ""
-            token_match = re.search(r"var globalRepeatSubmitToken = '([^']+)';", html)
-            if token_match:
-                token = token_match.group(1)
-            else:
-                print(f"InitDc Token 未找到。响应前500字符: {html[:500]}")
-            
-            ticket_info = {}
-            # 尝试多种方式提取ticketInfo
-            patterns = [
-                r"var ticketInfoForPassengerForm = ({.*?});",
-                r"ticketInfoForPassengerForm\s*=\s*({.*?});",
-                r"var\s+ticketInfoForPassengerForm\s*=\s*({[^}]+})",
-            ]
-            
-            ticket_info_found = False
-            for pattern in patterns:
-                ticket_info_match = re.search(pattern, html, re.DOTALL)
-                if ticket_info_match:
-                    try:
-                        t_info_str = ticket_info_match.group(1).replace("\n", "").replace("\r", "")
-                        print(f"找到ticketInfo，使用模式: {pattern[:50]}...")
-                        
-                        # 提取关键字段
-                        key_patterns = {
-                            'key_check_isChange': r"'key_check_isChange'\s*:\s*'([^']+)'",
-                            'leftTicketStr': r"'leftTicketStr'\s*:\s*'([^']+)'",
-                            'train_location': r"'train_location'\s*:\s*'([^']+)'"
-                        }
-                        
-                        for key, pattern in key_patterns.items():
-                            match = re.search(pattern, t_info_str)
-                            if match:
-                                ticket_info[key] = match.group(1)
-                                print(f"提取 {key}: {match.group(1)[:30]}...")
-                        
-                        if ticket_info:
-                            ticket_info_found = True
-                            break
-                    except Exception as e:
-                        print(f"解析ticketInfo失败: {e}")
-                        continue
-            
-            if not ticket_info_found:
-                print("InitDc TicketInfo 未找到。")
-                print(f"HTML响应长度: {len(html)} 字符")
-                print("响应前1000字符:")
-                print(html[:1000])
-                # 尝试从其他地方提取必要信息
-                try:
-                    # 从URL参数或其他地方提取
-                    left_ticket_match = re.search(r"leftTicketStr=([^&\"]+)", html)
-                    if left_ticket_match:
-                        ticket_info['leftTicketStr'] = left_ticket_match.group(1)
-                        print(f"从URL参数提取leftTicketStr: {left_ticket_match.group(1)[:30]}...")
-                    
-                    location_match = re.search(r"train_location=([^&\"]+)", html)
-                    if location_match:
-                        ticket_info['train_location'] = location_match.group(1)
-                        print(f"从URL参数提取train_location: {location_match.group(1)[:30]}...")
-                except Exception as e:
-                    print(f"备用提取方法也失败: {e}")
-            
-            return token, ticket_info
-            
+            resp = self._upstream(method, url, **kwargs)
         except Exception as e:
-            print(f"InitDc Error: {e}")
+            log.warning("InitDc Error: %s", e)
             return None, None
+        return self.parse_init_dc_response(resp)
 
-    def get_queue_count(self, train_no, from_station_name, to_station_name, date,
-                        left_ticket, train_location, seat_type, token):
-        """校验余票是否足够（confirmPassenger/getQueueCount）"""
-        url = "https://kyfw.12306.cn/otn/confirmPassenger/getQueueCount"
+    def build_queue_count_request(self, train_no, from_station_name, to_station_name, date,
+                                  left_ticket, train_location, seat_type, token):
+        """缺少出发/到达站电报码时返回 None"""
+        url = f"{KYFW_BASE_URL}/otn/confirmPassenger/getQueueCount"
         
         info = self.ticket_info.get(train_no, {})
         train_no_internal = info.get("train_no_internal", "")
@@ -339,12 +724,12 @@ class TicketBooking(Tiantiel12306Login):
         from_station_telecode = info.get("from_station_telecode") or self.station_manager.get_code(from_station_name)
         to_station_telecode = info.get("to_station_telecode") or self.station_manager.get_code(to_station_name)
         
-        headers = self.headers.copy()
-        headers["Referer"] = "https://kyfw.12306.cn/otn/confirmPassenger/initDc"
-        
         if not from_station_telecode or not to_station_telecode:
-            print("缺少出发/到达站电报码，无法进行队列校验")
-            return False
+            log.warning("缺少出发/到达站电报码，无法进行队列校验")
+            return None
+        
+        headers = self.headers.copy()
+        headers["Referer"] = f"{KYFW_BASE_URL}/otn/confirmPassenger/initDc"
         
         data = {
             "train_date": date,
@@ -359,27 +744,29 @@ class TicketBooking(Tiantiel12306Login):
             "_json_att": "",
             "REPEAT_SUBMIT_TOKEN": token
         }
-        
-        try:
-            resp = self.session.post(url, data=data, headers=headers, impersonate="chrome120")
-            resp_json = resp.json()
-            print(f"GetQueueCount: {resp_json}")
-            # 以 status 或 data 字段判断成功
-            if resp_json.get("status") == True:
-                return True
-            if resp_json.get("httpstatus") == 200 and resp_json.get("data") is not None:
-                return True
-            return False
-        except Exception as e:
-            print(f"GetQueueCount Error: {e}")
+        return "POST", url, {"data": data, "headers": headers}
+
+    @staticmethod
+    def parse_queue_count(resp):
+        resp_json = resp.json()
+        log.debug("GetQueueCount: %s", resp_json)
+        # 以 status 或 data 字段判断成功
+        if resp_json.get("status") == True:
+            return True
+        return resp_json.get("httpstatus") == 200 and resp_json.get("data") is not None
+
+    def get_queue_count(self, train_no, from_station_name, to_station_name, date,
+                        left_ticket, train_location, seat_type, token):
+        """校验余票是否足够（confirmPassenger/getQueueCount）"""
+        request = self.build_queue_count_request(train_no, from_station_name, to_station_name, date,
+                                                 left_ticket, train_location, seat_type, token)
+        if request is None:
             return False
+        return self._call(request, self.parse_queue_count, "GetQueueCount")
 
-    def confirm_queue(self, train_no, passengers, token, key_check_isChange, left_ticket, train_location,
-                      from_station_name, to_station_name, date, seat_type="O"):
-        """
-        4. 确认出票
-        新增参数 seat_type: 接受外部传入的席别代码 (O=二等座, M=一等座, 9=商务座)
-        """
+    @staticmethod
+    def build_passenger_strs(passengers, seat_type):
+        """返回 (passengerTicketStr, oldPassengerStr)"""
         passenger_ticket_str_list = []
         old_passenger_str_list = []
 
@@ -393,16 +780,16 @@ class TicketBooking(Tiantiel12306Login):
             o_str = f"{passenger['passenger_name']},{passenger['passenger_id_type_code']},{passenger['passenger_id_no']},1_"
             old_passenger_str_list.append(o_str)
 
-        passenger_ticket_str = "_".join(passenger_ticket_str_list)
-        old_passenger_str = "".join(old_passenger_str_list)
-        
-        # 设置 Referer
+        return "_".join(passenger_ticket_str_list), "".join(old_passenger_str_list)
+
+    def _confirm_headers(self):
         headers = self.headers.copy()
-        headers["Referer"] = "https://kyfw.12306.cn/otn/confirmPassenger/initDc"
+        headers["Referer"] = f"{KYFW_BASE_URL}/otn/confirmPassenger/initDc"
+        return headers
 
-        # 4.1 checkOrderInfo
-        check_url = "https://kyfw.12306.cn/otn/confirmPassenger/checkOrderInfo"
-        check_data = {
+    def build_check_order_request(self, passenger_ticket_str, old_passenger_str, token):
+        url = f"{KYFW_BASE_URL}/otn/confirmPassenger/checkOrderInfo"
+        data = {
             "cancel_flag": "2",
             "bed_level_order_num": "000000000000000000000000000000",
             "passengerTicketStr": passenger_ticket_str,
@@ -416,129 +803,92 @@ class TicketBooking(Tiantiel12306Login):
             "_json_att": "",
             "REPEAT_SUBMIT_TOKEN": token
         }
-        
-        try:
-            resp = self.session.post(check_url, data=check_data, headers=headers, impersonate="chrome120")
-            print(f"CheckOrderInfo: {resp.json()}")
-            if not resp.json().get("data", {}).get("submitStatus"):
-                 print(f"校验订单失败: {resp.json().get('data', {}).get('errMsg')}")
-                 return False
-        except Exception as e:
-            print(f"CheckOrderInfo Error: {e}")
-            return False
-        
-        # 4.15 getQueueCount
-        if not self.get_queue_count(train_no, from_station_name, to_station_name, date,
-                                    left_ticket, train_location, seat_type, token):
-            print("余票校验失败或队列校验失败")
+        return "POST", url, {"data": data, "headers": self._confirm_headers()}
+
+    @staticmethod
+    def parse_check_order(resp):
+        resp_json = resp.json()
+        log.debug("CheckOrderInfo: %s", resp_json)
+        if not (resp_json.get("data") or {}).get("submitStatus"):
+            log.warning("校验订单失败", extra={"err": (resp_json.get("data") or {}).get("errMsg")})
             return False
+        return True
 
-        # 4.2 confirmSingleForQueue
-        confirm_url = "https://kyfw.12306.cn/otn/confirmPassenger/confirmSingleForQueue"
-        try:
+    def build_confirm_request(self, passenger_ticket_str, old_passenger_str, key_check_isChange,
+                              left_ticket, train_location, token):
+        url = f"{KYFW_BASE_URL}/otn/confirmPassenger/confirmSingleForQueue"
+        data = {
+            "passengerTicketStr": passenger_ticket_str,
+            "oldPassengerStr": old_passenger_str,
+            "randCode": "",
+            "purpose_codes": "00",
+            "key_check_isChange": key_check_isChange,
             # 必须对 leftTicketStr 进行解码
-            decoded_left_ticket = unquote(left_ticket)
-            confirm_data = {
-                "passengerTicketStr": passenger_ticket_str,
-                "oldPassengerStr": old_passenger_str,
-                "randCode": "",
-                "purpose_codes": "00",
-                "key_check_isChange": key_check_isChange,
-                "leftTicketStr": decoded_left_ticket,
-                "train_location": train_location,
-                "choose_seats": "", 
-                "seatDetailType": "000",
-                "whatsSelect": "1",
-                "roomType": "00",
-                "dwAll": "N",
-                "_json_att": "",
-                "REPEAT_SUBMIT_TOKEN": token
-            }
-            
-            resp = self.session.post(confirm_url, data=confirm_data, headers=headers, impersonate="chrome120")
-            print(f"ConfirmQueue: {resp.json()}")
-            return resp.json().get("data", {}).get("submitStatus") == True
+            "leftTicketStr": unquote(left_ticket),
+            "train_location": train_location,
+            "choose_seats": "", 
+            "seatDetailType": "000",
+            "whatsSelect": "1",
+            "roomType": "00",
+            "dwAll": "N",
+            "_json_att": "",
+            "REPEAT_SUBMIT_TOKEN": token
+        }
+        return "POST", url, {"data": data, "headers": self._confirm_headers()}
+
+    @staticmethod
+    def parse_confirm(resp):
+        resp_json = resp.json()
+        log.debug("ConfirmQueue: %s", resp_json)
+        return (resp_json.get("data") or {}).get("submitStatus") == True
+
+    def _call(self, request, parse, name):
+        """发送 build_* 构造的请求并用 parse 解析，异常时记录日志并返回 False"""
+        method, url, kwargs = request
+        try:
+            return parse(self._upstream(method, url, **kwargs))
         except Exception as e:
-            print(f"ConfirmQueue Error: {e}")
+            log.warning("%s Error: %s", name, e)
             return False
 
-    def execute_booking(self, from_station, to_station, date, target_train_no, selected_passengers, seat_type):
-        """执行一次完整的抢票流程 (Query -> Submit -> InitDc -> Confirm)"""
-        
-        max_retries = 3
-        for attempt in range(max_retries):
-            print(f"\n>>> 尝试抢票第 {attempt + 1}/{max_retries} 次...")
-            
-            # 1. 查询最新 SecretStr
-            print(f"正在获取最新票务信息 ({target_train_no})...")
-            trains = self.query_ticket(from_station, to_station, date)
-            if target_train_no not in self.ticket_info:
-                print("刷新失败，车次可能已不可预订")
-                if attempt < max_retries - 1:
-                    time.sleep(2)
-                    continue
-                return False
-                
-            info = self.ticket_info.get(target_train_no)
-            fresh_secret_str = info['secret']
-            left_ticket = info['leftTicket']
-            train_location = info['location']
-
-            # 2. 提交订单请求
-            if not self.submit_order_request(fresh_secret_str, date, from_station, to_station):
-                print("提交订单请求失败 (车次过期/无票/风控)")
-                if attempt < max_retries - 1:
-                    time.sleep(2)
-                    continue
-                return False
-
-            # 3. 获取 Token 和 关键参数 (initDc)
-            # 这一步必须在 submit 成功后进行，以获取最新的 token 和 key_check
-            token, ticket_info = self.get_token_and_ticket_info()
-            if not token:
-                print("获取Token失败")
-                if attempt < max_retries - 1:
-                    time.sleep(2)
-                    continue
-                return False
-                
-            if not ticket_info:
-                print("获取ticket_info失败")
-                if attempt < max_retries - 1:
-                    time.sleep(2)
-                    continue
-                return False
-                
-            # 使用 initDc 返回的最新数据更新
-            if ticket_info.get('leftTicketStr'):
-                left_ticket = ticket_info.get('leftTicketStr')
-            if ticket_info.get('train_location'):
-                train_location = ticket_info.get('train_location')
-            key_check = ticket_info.get('key_check_isChange')
-            
-            if not key_check:
-                print("缺少关键参数 key_check_isChange")
-                if attempt < max_retries - 1:
-                    time.sleep(2)
-                    continue
-                return False
+    @staticmethod
+    def retry_sleep(seconds):
+        time.sleep(seconds)
 
-            # 4. 确认排队
-            if self.confirm_queue(target_train_no, selected_passengers, token, key_check,
-                                  left_ticket, train_location, from_station, to_station, date, seat_type=seat_type):
-                print("\n✅ 下单请求已提交！请立即打开 12306 APP 查看未完成订单并付款！")
-                return True
-            else:
-                print(f"\n❌ 第 {attempt + 1} 次下单失败")
-                if attempt < max_retries - 1:
-                    print("等待2秒后重试...")
-                    time.sleep(2)
-                    continue
-                else:
-                    print("\n❌ 所有重试均失败")
-                    return False
-        
-        return False
+    def run_steps(self, steps):
+        """同步执行 booking_steps/confirm_steps 定义的步骤序列，返回其结果"""
+        result, error = None, None
+        while True:
+            try:
+                name, args, kwargs = steps.throw(error) if error is not None else steps.send(result)
+            except StopIteration as stop:
+                return stop.value
+            result, error = None, None
+            try:
+                result = getattr(self, name)(*args, **kwargs)
+            except Exception as e:
+                error = e
+
+    def confirm_queue(self, train_no, passengers, token, key_check_isChange, left_ticket, train_location,
+                      from_station_name, to_station_name, date, seat_type="O"):
+        """
+        4. 确认出票
+        新增参数 seat_type: 接受外部传入的席别代码 (O=二等座, M=一等座, 9=商务座)
+        """
+        return self.run_steps(confirm_steps(self, train_no, passengers, token, key_check_isChange, left_ticket,
+                                            train_location, from_station_name, to_station_name, date, seat_type))
+
+    def execute_booking(self, from_station, to_station, date, target_train_no, selected_passengers, seat_type):
+        """执行一次完整的抢票流程 (Query -> Submit -> InitDc -> Confirm)，步骤见 booking_steps"""
+        started = time.perf_counter()
+        success = False
+        try:
+            success = self.run_steps(booking_steps(self, from_station, to_station, date, target_train_no,
+                                                   selected_passengers, seat_type))
+            return success
+        finally:
+            metrics.BOOKING_SECONDS.observe(time.perf_counter() - started,
+                                            result="success" if success else "failure")
 
     def run_interactive_loop(self):
         """主交互循环"""
@@ -574,14 +924,14 @@ class TicketBooking(Tiantiel12306Login):
                     return
 
             print("正在获取联系人列表...")
-            passengers = self.get_passengers_direct()
+            passengers = self.get_passengers()
             if not passengers:
                 print("未找到联系人，请检查登录状态或是否已添加联系人")
                 continue
                 
             print(f"\n发现 {len(passengers)} 位乘车人:")
             for idx, p in enumerate(passengers):
-                print(f"{idx}: {p['passenger_name']} ({p['passenger_id_no']})")
+                print(f"{idx}: {p['passenger_name']} ({mask_id_no(p['passenger_id_no'])})")
                 
             # 选择乘车人
             selected_passengers = []
@@ -621,7 +971,7 @@ class TicketBooking(Tiantiel12306Login):
                 success = self.execute_booking(from_station, to_station, date, target_train_no, selected_passengers, target_seat_type)
                 
                 if success:
-                    print("抢票流程结束。")
+                    print("\n✅ 下单请求已提交！请立即打开 12306 APP 查看未完成订单并付款！")
                     return # 成功后退出
                 
                 # 失败交互
@@ -635,6 +985,7 @@ class TicketBooking(Tiantiel12306Login):
                     break # 跳出内层循环，回到最外层
 
 if __name__ == "__main__":
+    setup_logging()
     ticket_booking = TicketBooking()
     
     # 扫码登录 (支持 Redis 缓存)
@@ -5,49 +5,107 @@
 """
 
 import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from itertools import product
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Set, Tuple
+from stations import StationRecord, StationRegistry, get_station_registry
+from station_search import StationSuggestEngine, get_suggest_engine
+from ticket_cache import TicketQueryError
+from ticket_parser import TrainRecord
+from ticket_table import TicketFilter, select_records
+from log_setup import get_logger
+
+log = get_logger("mcp")
+
+# 批量查询的并发数和单个请求超时(秒)
+BATCH_QUERY_MAX_WORKERS = int(os.getenv('BATCH_QUERY_MAX_WORKERS', 4))
+BATCH_QUERY_TIMEOUT = float(os.getenv('BATCH_QUERY_TIMEOUT', 10))
+# 按城市查询时每个城市最多参与组合的车站数、一次最多查询的车站组合数和并发数
+# （组合数不超过并发数时所有组合同时发出，约为一次往返）
+CITY_QUERY_MAX_STATIONS = int(os.getenv('CITY_QUERY_MAX_STATIONS', 4))
+CITY_QUERY_MAX_PAIRS = int(os.getenv('CITY_QUERY_MAX_PAIRS', 9))
+CITY_QUERY_MAX_WORKERS = int(os.getenv('CITY_QUERY_MAX_WORKERS', 9))
+
+
+class StationTraffic:
+    """
+    进程级的车站繁忙程度：各车站在查询结果中出现过的不同车次数
+    按城市查询时据此决定哪些车站参与组合查询（车次越多越靠前）
+    """
+
+    def __init__(self, max_trains: int = 256):
+        self.max_trains = max_trains  # 每个车站最多记录的车次数
+        self._trains: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, records: Iterable[TrainRecord]):
+        with self._lock:
+            for record in records:
+                for code in (record.from_station_telecode, record.to_station_telecode):
+                    trains = self._trains.setdefault(code, set())
+                    if len(trains) < self.max_trains:
+                        trains.add(record.train_no)
+
+    def count(self, code: str) -> int:
+        trains = self._trains.get(code)
+        return len(trains) if trains else 0
+
+
+station_traffic = StationTraffic()
+
+
+def station_rank(record: StationRecord, city: str, traffic: StationTraffic = station_traffic) -> Tuple:
+    """
+    城市内车站的排序键（越小越主要）：
+    1. 查询结果中出现过的车次数（多的在前）
+    2. 与城市同名的车站 (北京)，其次是 城市名+方位 的车站 (北京南)，最后是其他车站 (北京通州)
+    3. 车站数据中的顺序
+    """
+    if record.name == city:
+        tier = 0
+    elif len(record.name) == len(city) + 1 and record.name[-1] in '东南西北':
+        tier = 1
+    else:
+        tier = 2
+    return -traffic.count(record.code), tier, record.index
 
 class MCP12306Service:
     """12306 MCP服务封装类"""
     
-    def __init__(self):
-        self.station_cache = {}
+    def __init__(self, station_file: str = 'stations.json'):
+        self.station_file = station_file
         self.load_station_data()
     
     def load_station_data(self):
-        """加载车站数据到缓存"""
-        try:
-            with open('stations.json', 'r', encoding='utf-8') as f:
-                self.station_cache = json.load(f)
-            print(f"已加载 {len(self.station_cache)} 个车站数据")
-        except Exception as e:
-            print(f"加载车站数据失败: {e}")
-            self.station_cache = {}
+        """确保进程级共享的车站数据已加载"""
+        get_station_registry(self.station_file)
+    
+    @property
+    def registry(self) -> StationRegistry:
+        return get_station_registry(self.station_file)
+    
+    @property
+    def station_cache(self) -> Mapping[str, str]:
+        """name -> code"""
+        return self.registry.codes
+    
+    @property
+    def suggest_engine(self) -> StationSuggestEngine:
+        return get_suggest_engine(self.station_file)
     
     def get_station_code(self, city_name: str) -> Optional[str]:
-        """获取城市对应的车站编码"""
-        # 直接查询缓存
-        if city_name in self.station_cache:
-            return self.station_cache[city_name]
-        
-        # 如果缓存中没有，尝试模糊匹配
-        for station_name, code in self.station_cache.items():
-            if city_name in station_name or station_name.startswith(city_name):
-                return code
-        
-        return None
+        """获取城市对应的车站编码（车站名/电报码/拼音/城市名，最后按补全排名取最佳匹配）"""
+        record = self.registry.resolve(city_name) or self.suggest_engine.best_match(city_name)
+        return record.code if record else None
     
     def get_stations_in_city(self, city_name: str) -> List[Dict]:
         """获取城市内的所有车站"""
-        result = []
-        for station_name, code in self.station_cache.items():
-            if city_name in station_name:
-                result.append({
-                    'name': station_name,
-                    'code': code
-                })
-        return result
+        return [{'name': r.name, 'code': r.code}
+                for r in self.registry.stations_in_city(city_name)]
     
     def format_date(self, date_input: str) -> str:
         """格式化日期为 yyyy-MM-dd 格式"""
@@ -82,10 +140,13 @@ class OptimizedTicketBooking:
     
     def __init__(self, booking_instance):
         self.booking = booking_instance
-        self.mcp_service = MCP12306Service()
+        # 复用订票实例上的 MCP 服务（车站数据为进程级共享）
+        self.mcp_service = booking_instance.mcp_service
     
     def smart_query_tickets(self, from_city: str, to_city: str, date_input: str, 
-                          train_types: str = "", sort_by: str = "") -> List[Dict]:
+                          train_types: str = "", sort_by: str = "",
+                          session=None, timeout: Optional[float] = None, store: bool = True,
+                          city: bool = False, filters: Optional[TicketFilter] = None) -> List[Dict]:
         """
         智能查询车票
         
@@ -94,9 +155,45 @@ class OptimizedTicketBooking:
             to_city: 到达城市  
             date_input: 日期（支持"今天"、"明天"等相对日期）
             train_types: 车次类型筛选（如"G"高铁，"D"动车等）
-            sort_by: 排序方式（"time"按时间，"price"按价格等）
+            sort_by: 排序方式（"time" 出发时间, "arrive" 到达时间, "duration" 历时, "seats" 余票；
+                     余票接口不返回票价，不支持按价格排序）
+            session: 并发查询时使用的独立 Session（默认使用登录 Session）
+            timeout: 单次请求超时（秒）
+            store: 是否把查询结果写入订票实例的 ticket_info
+            city: 按城市查询（出发/到达城市的所有车站两两组合，合并结果）
+            filters: 出发/到达时间窗口、最长历时、最少余票等筛选条件（给出时忽略 train_types）
+        
+        查询失败（网络错误、超时、上游数据异常）时抛出 TicketQueryError，没有车次时返回 []
         """
+        formatted_date = self.mcp_service.format_date(date_input)
+        if city:
+            records = self.query_city_records(from_city, to_city, formatted_date, timeout=timeout, store=store)
+            if records is None:
+                raise TicketQueryError("按城市查询失败")
+            return self.filter_and_sort_trains(records, train_types, sort_by, with_station_names=True,
+                                                filters=filters)
+        
         # 1. 智能车站编码查询
+        from_code, to_code = self.resolve_route(from_city, to_city)
+        
+        # 2. 执行查询
+        log.debug("查询车票 %s(%s) -> %s(%s) %s", from_city, from_code, to_city, to_code, formatted_date)
+        
+        # 直接按解析出的电报码查询，避免按名称再解析一次
+        records = self.booking.query_records_by_code(from_code, to_code, formatted_date, session=session,
+                                                     timeout=timeout, store=store, raise_errors=True)
+        
+        if not records:
+            return []
+        station_traffic.observe(records)
+        
+        # 3. 处理筛选和排序
+        filtered_trains = self.filter_and_sort_trains(records, train_types, sort_by, filters=filters)
+        
+        return filtered_trains
+    
+    def resolve_route(self, from_city: str, to_city: str):
+        """解析出发/到达车站编码"""
         from_code = self.mcp_service.get_station_code(from_city)
         to_code = self.mcp_service.get_station_code(to_city)
         
@@ -111,97 +208,165 @@ class OptimizedTicketBooking:
             # 默认使用第一个车站
             from_code = from_stations[0]['code']
             to_code = to_stations[0]['code']
-            print(f"使用车站: {from_stations[0]['name']} -> {to_stations[0]['name']}")
-        
-        # 2. 智能日期格式化
-        formatted_date = self.mcp_service.format_date(date_input)
-        
-        # 3. 执行查询
-        print(f"查询车票: {from_city}({from_code}) -> {to_city}({to_code}), 日期: {formatted_date}")
-        
-        # 这里调用原始的查询方法
-        trains = self.booking.query_ticket(from_city, to_city, formatted_date)
-        
-        if not trains:
-            return []
-        
-        # 4. 处理筛选和排序
-        filtered_trains = self._filter_and_sort_trains(trains, train_types, sort_by)
-        
-        return filtered_trains
+            log.debug("使用车站 %s -> %s", from_stations[0]['name'], to_stations[0]['name'])
+        return from_code, to_code
     
-    def _filter_and_sort_trains(self, trains: List[str], train_types: str, sort_by: str) -> List[Dict]:
-        """过滤和排序车次"""
-        result = []
-        train_type_set = set()
-        if train_types:
-            for t in train_types.replace("，", ",").split(","):
-                t = t.strip()
-                if t:
-                    train_type_set.add(t)
+    def _city_stations(self, keyword: str) -> Tuple[Optional[str], List[str]]:
+        """
+        返回 (城市编码, 参与查询的车站编码，按 station_rank 排序)
+        城市编码是与城市同名车站的编码（如 北京 -> BJP），没有时为 None；
+        输入的是具体车站（如 北京南）时只用该车站
+        """
+        stations = self.mcp_service.registry.stations_in_city(keyword)
+        if stations:
+            city_code = next((record.code for record in stations if record.name == keyword), None)
+            ranked = sorted(stations, key=lambda record: station_rank(record, keyword))
+            return city_code, [record.code for record in ranked[:CITY_QUERY_MAX_STATIONS]]
+        code = self.mcp_service.get_station_code(keyword)
+        return None, [code] if code else []
+    
+    @staticmethod
+    def _rank_pairs(from_codes: List[str], to_codes: List[str], max_pairs: int) -> List[Tuple[str, str]]:
+        """两端车站两两组合，两端排名之和小的组合优先，最多 max_pairs 个"""
+        pairs = sorted(((i + j, i), (f, t)) for (i, f), (j, t) in product(enumerate(from_codes), enumerate(to_codes))
+                       if f != t)
+        return [pair for _, pair in pairs[:max_pairs]]
+    
+    def _query_pairs(self, pairs: List[Tuple[str, str]], date: str, max_workers: int,
+                     timeout: float, deadline: Optional[float] = None) -> List[List[TrainRecord]]:
+        """
+        并发查询多个车站组合（各组合走进程级查询缓存），返回成功组合的结果
+        deadline 为 time.monotonic() 时刻，到时仍未完成的组合不再等待
+        """
+        def query_pair(pair):
+            with self.booking.worker_session() as session:
+                return self.booking.query_records_by_code(pair[0], pair[1], date, session=session,
+                                                          timeout=timeout, store=False)
         
-        for train_info in trains:
-            # 解析车次信息
-            if isinstance(train_info, str):
-                if "|" in train_info:
-                    parts = train_info.split('|')
-                    if len(parts) >= 33:
-                        train_dict = {
-                            'train_no': parts[3],           # 车次
-                            'start_time': parts[8],         # 出发时间
-                            'arrive_time': parts[9],        # 到达时间
-                            'duration': parts[10],          # 历时
-                            'ze_num': parts[30] or '--',    # 二等座
-                            'zy_num': parts[31] or '--',    # 一等座
-                            'swz_num': parts[32] or '--',   # 商务座
-                            'train_type': parts[3][0] if len(parts) > 3 else ''  # 车次类型(G/D/Z等)
-                        }
-                    else:
+        results = []
+        max_workers = max(1, min(max_workers, len(pairs)))
+        pool = ThreadPoolExecutor(max_workers=max_workers)
+        futures = {pool.submit(query_pair, pair): pair for pair in pairs}
+        try:
+            wait = timeout if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                for future in as_completed(futures, timeout=wait):
+                    try:
+                        records = future.result()
+                    except Exception as e:
+                        log.warning("查询 %s -> %s 失败: %s", *futures[future], e)
                         continue
-                else:
-                    # 兼容 query_ticket 返回的车次号列表
-                    train_no = train_info
-                    info = self.booking.ticket_info.get(train_no, {})
-                    train_dict = {
-                        'train_no': train_no,
-                        'start_time': info.get('start_time', '--'),
-                        'arrive_time': info.get('arrive_time', '--'),
-                        'duration': info.get('duration', '--'),
-                        'ze_num': info.get('ze_num', '--'),
-                        'zy_num': info.get('zy_num', '--'),
-                        'swz_num': info.get('swz_num', '--'),
-                        'train_type': train_no[0] if train_no else ''
-                    }
-                
-                # 车次类型筛选
-                if train_type_set and train_dict['train_type'] not in train_type_set:
-                    continue
-                
-                result.append(train_dict)
+                    if records is not None:
+                        results.append(records)
+            except FutureTimeoutError:
+                log.warning("部分车站组合查询超时", extra={"pairs": len(pairs), "date": date})
+        finally:
+            for future in futures:
+                future.cancel()
+            pool.shutdown(wait=False)
+        return results
+    
+    def query_city_records(self, from_city: str, to_city: str, date: str,
+                           max_workers: Optional[int] = None, timeout: Optional[float] = None,
+                           store: bool = True) -> Optional[List[TrainRecord]]:
+        """
+        按城市查询，合并出发城市和到达城市所有车站间的车次
+        1. 两端都有城市编码时先用城市编码查询一次：12306 会把城市编码展开为全市车站，
+           结果中出现其他车站即说明已覆盖全城，一次往返即可返回
+        2. 否则把两城市的主要车站（见 station_rank）两两组合，最多 CITY_QUERY_MAX_PAIRS 个组合并发查询
+        整个过程最多等待约一个请求超时；结果按 (车次, 出发站, 到达站) 去重后按出发时间排序，
+        全部查询都失败时返回 None
+        """
+        from_city_code, from_codes = self._city_stations(from_city)
+        to_city_code, to_codes = self._city_stations(to_city)
+        if not from_codes or not to_codes:
+            raise ValueError(f"找不到车站信息: {from_city} -> {to_city}")
+        max_workers = max_workers or CITY_QUERY_MAX_WORKERS
+        timeout = timeout or BATCH_QUERY_TIMEOUT
+        deadline = time.monotonic() + timeout
         
-        # 排序
-        if sort_by == "time":
-            result.sort(key=lambda x: x['start_time'])
-        elif sort_by == "duration":
-            result.sort(key=lambda x: x['duration'])
+        results = []
+        city_pair = (from_city_code, to_city_code)
+        if from_city_code and to_city_code:
+            results = self._query_pairs([city_pair], date, 1, timeout, deadline)
+            # 城市编码的结果计入车站车次数，下面据此选择参与组合的车站
+            for records in results:
+                station_traffic.observe(records)
+        if results and any(record.from_station_telecode != from_city_code
+                           or record.to_station_telecode != to_city_code for record in results[0]):
+            pairs = []
+        else:
+            if results:
+                from_codes, to_codes = self._city_stations(from_city)[1], self._city_stations(to_city)[1]
+            pairs = [pair for pair in self._rank_pairs(from_codes, to_codes, CITY_QUERY_MAX_PAIRS)
+                     if pair != city_pair]
+        if pairs and time.monotonic() < deadline:
+            fanned_out = self._query_pairs(pairs, date, max_workers, timeout, deadline)
+            for records in fanned_out:
+                station_traffic.observe(records)
+            results += fanned_out
         
+        if not results:
+            return None
+        merged = {}
+        for records in results:
+            for record in records:
+                merged.setdefault((record.train_no, record.from_station_telecode, record.to_station_telecode), record)
+        records = sorted(merged.values(), key=lambda r: (r.start_time, r.arrive_time))
+        log.debug("按城市查询 %s -> %s: 合并后 %d 趟车次", from_city, to_city, len(records),
+                  extra={"pairs": len(pairs) + bool(from_city_code and to_city_code)})
+        if store:
+            self.booking._remember_records(records)
+        return records
+    
+    def filter_and_sort_trains(self, records: List[TrainRecord], train_types: str, sort_by: str,
+                                with_station_names: bool = False,
+                                filters: Optional[TicketFilter] = None) -> List[Dict]:
+        """
+        过滤和排序车次（默认只保留可预订的车次）
+        filters 未给出时只按 train_types 筛选；排序见 ticket_table.SORT_KEYS
+        """
+        if filters is None:
+            filters = TicketFilter.from_params(None, train_types)
+        result = []
+        for record in select_records(records, filters, sort_by):
+            item = record.to_dict()
+            if with_station_names:
+                item['from_station_name'] = self._station_name(record.from_station_telecode)
+                item['to_station_name'] = self._station_name(record.to_station_telecode)
+            result.append(item)
         return result
     
+    def _station_name(self, code: str) -> str:
+        record = self.mcp_service.registry.get_by_code(code)
+        return record.name if record else code
+    
     def batch_query_multiple_dates(self, from_city: str, to_city: str, 
-                                 dates: List[str]) -> Dict[str, List[Dict]]:
-        """批量查询多个日期的车票"""
-        results = {}
-        
-        for date in dates:
-            try:
-                tickets = self.smart_query_tickets(from_city, to_city, date)
-                results[date] = tickets
-                print(f"日期 {date}: 找到 {len(tickets)} 趟车次")
-            except Exception as e:
-                print(f"查询日期 {date} 失败: {e}")
-                results[date] = []
-        
-        return results
+                                 dates: List[str], max_workers: Optional[int] = None,
+                                 timeout: Optional[float] = None,
+                                 filters: Optional[TicketFilter] = None
+                                 ) -> Tuple[Dict[str, List[Dict]], Dict[str, str]]:
+        """
+        批量查询多个日期的车票，返回 ({日期: 车次列表}, {失败的日期: 错误信息})
+        与 Web 批量查询接口是同一个实现（AsyncTicketBooking.iter_batch_query）：各日期在共享事件循环中
+        以协程并发查询；失败或超时的日期车次列表为空，错误随结果返回，并发的批量查询互不影响
+        """
+        from async_booking import async_runner
+        batch = self.booking.async_client().iter_batch_query(from_city, to_city, dates, filters=filters,
+                                                            max_concurrency=max_workers, timeout=timeout)
+        return collect_batch_results(dates, async_runner.iterate(batch))
+
+
+def collect_batch_results(dates: List[str], items: Iterator[Tuple[str, List[Dict], Optional[str]]]
+                          ) -> Tuple[Dict[str, List[Dict]], Dict[str, str]]:
+    """把逐日期产出的 (日期, 车次列表, 错误信息) 汇总为 ({日期: 车次列表}, {失败的日期: 错误信息})"""
+    results = {date: [] for date in dates}
+    errors = {}
+    for date, tickets, error in items:
+        results[date] = tickets
+        if error:
+            errors[date] = error
+    return results, errors
 
 # 使用示例
 def demo_usage():
@@ -215,7 +380,7 @@ def demo_usage():
     
     # 示例2: 批量查询
     # dates = ["今天", "明天", "后天"]
-    # batch_results = optimizer.batch_query_multiple_dates("北京", "上海", dates)
+    # batch_results, errors = optimizer.batch_query_multiple_dates("北京", "上海", dates)
     
     print("MCP集成模块已准备就绪")
 
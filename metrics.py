@@ -0,0 +1,217 @@
+"""
+轻量的进程内指标收集，输出 Prometheus 文本格式
+提供计数器、直方图和回调型仪表，以及订票流程各阶段的计时工具
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# 默认的延迟分桶(秒)，覆盖从本地缓存到 12306 慢响应的范围
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {value}' for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [各分桶计数..., 总数, 总和]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+                    break
+            data[-2] += 1
+            data[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, list(data)) for key, data in self._values.items()]
+        lines = []
+        for key, data in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f'{self.name}_bucket{labels} {data[-2]}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {data[-2]}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {data[-1]}')
+        return lines
+
+
+class GaugeCallback(_Metric):
+    """渲染时调用回调取值的仪表"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, callback: Callable[[], Optional[float]]):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def _samples(self):
+        try:
+            value = self.callback()
+        except Exception:
+            return []
+        return [] if value is None else [f'{self.name} {value}']
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def gauge_callback(name, documentation, callback) -> GaugeCallback:
+    return REGISTRY.register(GaugeCallback(name, documentation, callback))
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+# --- 订票流程及上游调用的公共指标 ---
+BOOKING_STAGE_SECONDS = histogram(
+    'booking_stage_seconds', '订票流程各阶段耗时', ('stage',))
+BOOKING_STAGE_TOTAL = counter(
+    'booking_stage_total', '订票流程各阶段执行次数', ('stage', 'result'))
+BOOKING_SECONDS = histogram(
+    'booking_seconds', '一次完整抢票（含重试）的耗时', ('result',))
+UPSTREAM_SECONDS = histogram(
+    'upstream_request_seconds', '12306 上游请求耗时', ('endpoint',))
+UPSTREAM_TOTAL = counter(
+    'upstream_requests_total', '12306 上游请求次数', ('endpoint', 'status'))
+UPSTREAM_PHASE_SECONDS = histogram(
+    'upstream_phase_seconds', '12306 上游请求分阶段耗时 (connect=DNS+TCP+TLS, transfer=请求到响应完成)',
+    ('endpoint', 'phase'))
+UPSTREAM_NEW_CONNECTIONS = counter(
+    'upstream_new_connections_total', '12306 上游请求新建的连接数（越少说明连接复用越好）', ('endpoint',))
+CACHE_TOTAL = counter(
+    'cache_requests_total', '缓存访问次数', ('cache', 'result'))
+REDIS_SECONDS = histogram(
+    'redis_op_seconds', 'Redis 操作耗时', ('op',),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1))
+
+
+class _StageOutcome:
+    __slots__ = ('ok',)
+
+    def __init__(self):
+        self.ok = True
+
+
+@contextmanager
+def stage(name: str):
+    """
+    记录订票流程某个阶段的耗时和结果
+    块内把 outcome.ok 置为 False 或抛出异常都视为失败
+    """
+    outcome = _StageOutcome()
+    started = time.perf_counter()
+    try:
+        yield outcome
+    except Exception:
+        outcome.ok = False
+        raise
+    finally:
+        BOOKING_STAGE_SECONDS.observe(time.perf_counter() - started, stage=name)
+        BOOKING_STAGE_TOTAL.inc(stage=name, result='success' if outcome.ok else 'failure')
+
+
+def cache_result(cache: str, hit: bool):
+    CACHE_TOTAL.inc(cache=cache, result='hit' if hit else 'miss')
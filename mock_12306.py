@@ -0,0 +1,358 @@
+"""
+本地 12306 模拟服务
+实现 TicketBooking / Tiantiel12306Login 用到的全部接口，用于离线调试和压测：
+
+    python mock_12306.py --port 8306 --latency 50 --jitter 20 --error-rate 0.01
+    KYFW_BASE_URL=http://127.0.0.1:8306 python app.py
+
+延迟和错误注入可在启动参数中设置，也可运行时通过 POST /_mock/config 修改
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import uuid as uuid_lib
+
+from flask import Flask, Response, jsonify, request
+
+try:
+    from waitress.channel import HTTPChannel
+    from waitress.server import create_server
+except ImportError:  # 可选：没有 waitress 时退回 Flask 开发服务器
+    HTTPChannel = create_server = None
+
+app = Flask(__name__)
+
+# 运行参数：平均延迟/抖动(毫秒)、错误率、按接口覆盖的延迟、扫码确认所需的轮询次数、每次查询返回的车次数
+CONFIG = {
+    'latency_ms': float(os.getenv('MOCK_LATENCY_MS', 0)),
+    'jitter_ms': float(os.getenv('MOCK_JITTER_MS', 0)),
+    'error_rate': float(os.getenv('MOCK_ERROR_RATE', 0)),
+    'endpoint_latency_ms': {},
+    'qr_confirm_after': int(os.getenv('MOCK_QR_CONFIRM_AFTER', 2)),
+    'trains': int(os.getenv('MOCK_TRAINS', 30)),
+    'query_path': os.getenv('MOCK_QUERY_PATH', 'leftTicket/queryZ'),
+}
+
+# 1x1 透明 PNG，作为二维码图片
+QR_IMAGE = base64.b64encode(bytes.fromhex(
+    '89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+    '1f15c4890000000b49444154789c6360000200000500017a5eab3f0000000049454e44ae426082'
+)).decode()
+
+PASSENGERS = [
+    {'passenger_name': '张三', 'passenger_id_type_code': '1', 'passenger_id_no': '110101199001011234',
+     'mobile_no': '13800000001', 'passenger_type': '1'},
+    {'passenger_name': '李四', 'passenger_id_type_code': '1', 'passenger_id_no': '310101199202022345',
+     'mobile_no': '13800000002', 'passenger_type': '1'},
+]
+
+_qr_polls = {}  # uuid -> 已轮询次数
+_qr_lock = threading.Lock()
+_stats = {'requests': 0, 'errors_injected': 0, 'connections': 0}
+
+
+def _json(data):
+    return Response(json.dumps(data, ensure_ascii=False), mimetype='application/json;charset=UTF-8')
+
+
+def _logged_in():
+    return bool(request.cookies.get('tk'))
+
+
+def _login_redirect():
+    # 未登录时 12306 会把 otn 接口重定向到登录页，这里直接返回登录页 HTML
+    return Response('<!DOCTYPE html><html><head><title>登录</title></head><body>login</body></html>',
+                    mimetype='text/html')
+
+
+@app.before_request
+def inject_latency_and_errors():
+    if request.path.startswith('/_mock'):
+        return None
+    _stats['requests'] += 1
+    latency = CONFIG['endpoint_latency_ms'].get(request.path, CONFIG['latency_ms'])
+    if CONFIG['jitter_ms']:
+        latency = max(0.0, random.gauss(latency, CONFIG['jitter_ms']))
+    if latency:
+        time.sleep(latency / 1000)
+    if CONFIG['error_rate'] and random.random() < CONFIG['error_rate']:
+        _stats['errors_injected'] += 1
+        if random.random() < 0.5:
+            return Response('Service Unavailable', status=503)
+        return Response('<html><body>网络可能存在问题，请您重试一下！</body></html>', mimetype='text/html')
+    return None
+
+
+# --- 扫码登录 ---
+
+@app.route('/passport/web/create-qr64', methods=['POST'])
+def create_qr64():
+    qr_uuid = uuid_lib.uuid4().hex
+    with _qr_lock:
+        _qr_polls[qr_uuid] = 0
+    return _json({'result_code': '0', 'result_message': '生成二维码成功', 'uuid': qr_uuid, 'image': QR_IMAGE})
+
+
+@app.route('/passport/web/checkqr', methods=['POST'])
+def checkqr():
+    qr_uuid = request.form.get('uuid', '')
+    with _qr_lock:
+        if qr_uuid not in _qr_polls:
+            return _json({'result_code': '3', 'result_message': '二维码已过期'})
+        _qr_polls[qr_uuid] += 1
+        polls = _qr_polls[qr_uuid]
+    confirm_after = CONFIG['qr_confirm_after']
+    if polls < confirm_after:
+        return _json({'result_code': '0' if polls < confirm_after - 1 else '1', 'result_message': ''})
+    with _qr_lock:
+        _qr_polls.pop(qr_uuid, None)
+    resp = _json({'result_code': '2', 'result_message': '扫码登录成功'})
+    resp.set_cookie('uamtk', uuid_lib.uuid4().hex, path='/passport')
+    return resp
+
+
+@app.route('/passport/web/auth/uamtk', methods=['POST'])
+def uamtk():
+    if not request.cookies.get('uamtk'):
+        return _json({'result_code': 1, 'result_message': '用户未登录'})
+    return _json({'result_code': 0, 'result_message': '验证通过', 'newapptk': uuid_lib.uuid4().hex})
+
+
+@app.route('/otn/uamauthclient', methods=['POST'])
+def uamauthclient():
+    tk = request.form.get('tk')
+    if not tk:
+        return _json({'result_code': 2, 'result_message': '验证不通过'})
+    resp = _json({'result_code': 0, 'result_message': '验证通过', 'username': '模拟用户', 'apptk': tk})
+    resp.set_cookie('tk', tk, path='/')
+    return resp
+
+
+@app.route('/otn/login/checkUser', methods=['POST'])
+def check_user():
+    return _json({'validateMessagesShowId': '_validatorMessage', 'status': True, 'httpstatus': 200,
+                  'data': {'flag': _logged_in()}, 'messages': []})
+
+
+# --- 车站与余票查询 ---
+
+@app.route('/otn/resources/js/framework/station_name.js', methods=['GET'])
+def station_name_js():
+    from stations import get_station_registry
+    registry = get_station_registry()
+    parts = [f"@{s.abbr}|{s.name}|{s.code}|{s.pinyin}|{s.short_pinyin}|{s.index}|{s.city_code}|{s.city}|||"
+             for s in sorted(registry.by_name.values(), key=lambda s: s.index)]
+    return Response("var station_names ='" + ''.join(parts) + "';", mimetype='application/javascript')
+
+
+@app.route('/otn/leftTicket/init', methods=['GET'])
+def left_ticket_init():
+    html = ("<!DOCTYPE html><html><head><script>\n"
+            f"var CLeftTicketUrl = '{CONFIG['query_path']}';\n"
+            "</script></head><body></body></html>")
+    return Response(html, mimetype='text/html')
+
+
+def _minutes(value):
+    return f"{value // 60 % 24:02d}:{value % 60:02d}"
+
+
+def _build_rows(from_code, to_code, date):
+    """按 (出发, 到达, 日期) 生成确定的车次列表"""
+    seed = int(hashlib.md5(f"{from_code}{to_code}{date}".encode()).hexdigest()[:8], 16)
+    rng = random.Random(seed)
+    compact_date = date.replace('-', '')
+    rows = []
+    for i in range(CONFIG['trains']):
+        prefix = rng.choice('GDGKZT')
+        code = f"{prefix}{rng.randint(1, 9999)}"
+        start = rng.randint(300, 1380)
+        duration = rng.randint(60, 900)
+        seats = []
+        for _ in range(14):
+            seats.append(rng.choice(['有', '无', '--', '', str(rng.randint(1, 20))]))
+        bookable = any(s not in ('无', '--', '') for s in seats)
+        secret = base64.b64encode(f"{code}|{date}|{from_code}|{to_code}|{i}".encode()).decode()
+        fields = [''] * 34
+        fields[0] = secret if bookable else ''
+        fields[1] = '预订'
+        fields[2] = f"{rng.randint(10, 99)}0000{code}0{i}"
+        fields[3] = code
+        fields[4] = from_code
+        fields[5] = to_code
+        fields[6] = from_code
+        fields[7] = to_code
+        fields[8] = _minutes(start)
+        fields[9] = _minutes(start + duration)
+        fields[10] = f"{duration // 60:02d}:{duration % 60:02d}"
+        fields[11] = 'Y' if bookable else 'N'
+        fields[12] = hashlib.md5(secret.encode()).hexdigest()
+        fields[13] = compact_date
+        fields[15] = f"P{rng.randint(1, 9)}"
+        fields[16] = '01'
+        fields[17] = f"{rng.randint(2, 20):02d}"
+        fields[20:34] = seats
+        rows.append('|'.join(fields))
+    return rows
+
+
+def _query():
+    date = request.args.get('leftTicketDTO.train_date', '')
+    from_code = request.args.get('leftTicketDTO.from_station', '')
+    to_code = request.args.get('leftTicketDTO.to_station', '')
+    if not (date and from_code and to_code):
+        return _json({'status': False, 'httpstatus': 200, 'messages': ['参数错误']})
+    return _json({'httpstatus': 200, 'status': True, 'messages': '',
+                  'data': {'flag': '1', 'map': {from_code: from_code, to_code: to_code},
+                           'result': _build_rows(from_code, to_code, date)}})
+
+
+@app.route('/otn/<path:query_path>', methods=['GET'])
+def left_ticket_query(query_path):
+    if query_path == CONFIG['query_path']:
+        return _query()
+    if query_path.startswith('leftTicket/query'):
+        # 旧接口名：与 12306 一样返回 c_url 提示新的接口
+        return _json({'status': False, 'c_url': CONFIG['query_path']})
+    return Response('Not Found', status=404)
+
+
+# --- 下单流程 ---
+
+@app.route('/otn/leftTicket/submitOrderRequest', methods=['POST'])
+def submit_order_request():
+    if not _logged_in():
+        return _login_redirect()
+    if not request.form.get('secretStr'):
+        return _json({'status': False, 'httpstatus': 200, 'messages': ['车票信息已过期，请重新查询']})
+    return _json({'validateMessagesShowId': '_validatorMessage', 'status': True, 'httpstatus': 200,
+                  'data': 'N', 'messages': []})
+
+
+@app.route('/otn/confirmPassenger/initDc', methods=['POST'])
+def init_dc():
+    if not _logged_in():
+        return _login_redirect()
+    token = uuid_lib.uuid4().hex
+    key_check = hashlib.sha1(token.encode()).hexdigest().upper()
+    left_ticket = hashlib.md5(token.encode()).hexdigest()
+    # 与真实页面一样，关键数据嵌在大段 HTML/脚本中
+    filler = '<div class="filler">' + '&nbsp;' * 2000 + '</div>\n'
+    html = ("<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>订单信息</title>\n"
+            + filler * 20 +
+            "<script type=\"text/javascript\">\n"
+            f"var globalRepeatSubmitToken = '{token}';\n"
+            "var global_lang = 'zh_CN';\n"
+            "var ticketInfoForPassengerForm={'cardTypes':[{'end_station_name':null,'id':'1','value':'中国居民身份证'}],"
+            "'isAsync':'1',"
+            f"'key_check_isChange':'{key_check}',"
+            f"'leftTicketStr':'{left_ticket}',"
+            "'limitBuySeatTicketDTO':{'seat_type_codes':[{'id':'O','value':'二等座'}]},"
+            "'purpose_codes':'00',"
+            "'queryLeftTicketRequestDTO':{'train_date':'20240101','train_no':'240000G1010C'},"
+            "'tour_flag':'dc',"
+            "'train_location':'P2'};\n"
+            "var orderRequestDTO={'adult_num':0,'apply_order_no':null};\n"
+            "</script>\n" + filler * 20 + "</head><body></body></html>")
+    return Response(html, mimetype='text/html')
+
+
+@app.route('/otn/confirmPassenger/getPassengerDTOs', methods=['POST'])
+def get_passenger_dtos():
+    if not _logged_in():
+        return _login_redirect()
+    return _json({'validateMessagesShowId': '_validatorMessage', 'status': True, 'httpstatus': 200,
+                  'data': {'isExist': True, 'exMsg': '', 'normal_passengers': PASSENGERS, 'dj_passengers': []},
+                  'messages': []})
+
+
+@app.route('/otn/confirmPassenger/checkOrderInfo', methods=['POST'])
+def check_order_info():
+    if not _logged_in():
+        return _login_redirect()
+    ok = bool(request.form.get('passengerTicketStr') and request.form.get('REPEAT_SUBMIT_TOKEN'))
+    return _json({'status': True, 'httpstatus': 200,
+                  'data': {'submitStatus': ok, 'errMsg': '' if ok else '乘车人信息有误'}, 'messages': []})
+
+
+@app.route('/otn/confirmPassenger/getQueueCount', methods=['POST'])
+def get_queue_count():
+    if not _logged_in():
+        return _login_redirect()
+    return _json({'status': True, 'httpstatus': 200,
+                  'data': {'count': '0', 'ticket': '12,0', 'op_2': 'false', 'countT': '0', 'op_1': 'true'},
+                  'messages': []})
+
+
+@app.route('/otn/confirmPassenger/confirmSingleForQueue', methods=['POST'])
+def confirm_single_for_queue():
+    if not _logged_in():
+        return _login_redirect()
+    ok = bool(request.form.get('key_check_isChange') and request.form.get('leftTicketStr'))
+    return _json({'status': True, 'httpstatus': 200,
+                  'data': {'submitStatus': ok, 'isAsync': '1'}, 'messages': []})
+
+
+# --- 运行时配置 ---
+
+@app.route('/_mock/config', methods=['GET', 'POST'])
+def mock_config():
+    """GET 查看、POST 修改延迟和错误注入配置"""
+    if request.method == 'POST':
+        for key, value in (request.json or {}).items():
+            if key in CONFIG:
+                CONFIG[key] = value
+    return jsonify({'config': CONFIG, 'stats': _stats})
+
+
+def serve_keepalive(host, port, threads):
+    """
+    用 waitress 提供 HTTP/1.1 长连接：Flask 自带的开发服务器对每个响应都发送 Connection: close，
+    客户端每个请求都要重新建连，连接复用和预热的效果无法在压测中体现。
+    stats.connections 为客户端新建的连接数
+    """
+    class CountingChannel(HTTPChannel):
+        def __init__(self, *args, **kwargs):
+            _stats['connections'] += 1
+            super().__init__(*args, **kwargs)
+
+    server = create_server(app, host=host, port=port, threads=threads)
+    server.channel_class = CountingChannel
+    server.run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地 12306 模拟服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8306)
+    parser.add_argument('--latency', type=float, default=CONFIG['latency_ms'], help='平均延迟(毫秒)')
+    parser.add_argument('--jitter', type=float, default=CONFIG['jitter_ms'], help='延迟标准差(毫秒)')
+    parser.add_argument('--error-rate', type=float, default=CONFIG['error_rate'], help='注入错误的比例 0~1')
+    parser.add_argument('--trains', type=int, default=CONFIG['trains'], help='每次查询返回的车次数')
+    parser.add_argument('--threads', type=int, default=64, help='处理请求的线程数（waitress）')
+    parser.add_argument('--endpoint-latency', action='append', default=[], metavar='PATH=MS',
+                        help='单独设置某个接口的延迟，例如 /otn/confirmPassenger/initDc=200')
+    args = parser.parse_args()
+
+    CONFIG.update(latency_ms=args.latency, jitter_ms=args.jitter, error_rate=args.error_rate,
+                  trains=args.trains)
+    for item in args.endpoint_latency:
+        path, _, ms = item.partition('=')
+        CONFIG['endpoint_latency_ms'][path] = float(ms)
+
+    print(f"12306 模拟服务: http://{args.host}:{args.port}  (KYFW_BASE_URL=http://{args.host}:{args.port})")
+    if create_server is None:
+        print("未安装 waitress，使用 Flask 开发服务器（每个请求新建连接）；压测连接复用请先 pip install waitress")
+        app.run(host=args.host, port=args.port, threaded=True)
+        return
+    serve_keepalive(args.host, args.port, args.threads)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+扫码登录状态的集中轮询调度器
+所有待确认的二维码由一个调度线程按各自的时间表轮询，
+到期的检查成批交给有限大小的线程池执行，
+登录成功/失败、二维码过期或前端不再关注时自动移除
+"""
+
+import heapq
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from log_setup import get_logger
+
+QR_POLL_INTERVAL = float(os.getenv('QR_POLL_INTERVAL', 2))         # 每个二维码的轮询间隔(秒)
+QR_POLL_EXPIRY = float(os.getenv('QR_POLL_EXPIRY', 300))           # 二维码最长轮询时间(秒)
+QR_POLL_ABANDON_AFTER = float(os.getenv('QR_POLL_ABANDON_AFTER', 60))  # 前端多久未查询视为放弃(秒)
+QR_POLL_WORKERS = int(os.getenv('QR_POLL_WORKERS', 8))             # 执行上游检查的线程数
+
+TERMINAL_STATUSES = ("success", "failed", "expired")
+
+log = get_logger("qr")
+
+
+class _PollEntry:
+    __slots__ = ('uuid', 'manager', 'expires_at', 'last_seen', 'in_flight')
+
+    def __init__(self, uuid, manager, expires_at):
+        self.uuid = uuid
+        self.manager = manager
+        self.expires_at = expires_at
+        self.last_seen = time.time()
+        self.in_flight = False
+
+
+class QRPollScheduler:
+    """
+    集中轮询调度器
+    manager 需提供 booking.check_qr_status_once() 和 on_qr_status(uuid, result)
+    """
+
+    def __init__(self, interval=QR_POLL_INTERVAL, expiry=QR_POLL_EXPIRY,
+                 abandon_after=QR_POLL_ABANDON_AFTER, max_workers=QR_POLL_WORKERS):
+        self.interval = interval
+        self.expiry = expiry
+        self.abandon_after = abandon_after
+        self.max_workers = max_workers
+        self._entries: Dict[str, _PollEntry] = {}
+        self._heap = []  # (下次检查时间, uuid)
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def register(self, uuid, manager):
+        """登记一个待轮询的二维码，首次检查在一个间隔之后"""
+        now = time.time()
+        with self._cond:
+            self._entries[uuid] = _PollEntry(uuid, manager, now + self.expiry)
+            heapq.heappush(self._heap, (now + self.interval, uuid))
+            self._ensure_started()
+            self._cond.notify()
+
+    def touch(self, uuid) -> bool:
+        """前端仍在关注该二维码，返回是否仍在轮询中"""
+        with self._cond:
+            entry = self._entries.get(uuid)
+            if entry:
+                entry.last_seen = time.time()
+                return True
+            return False
+
+    def cancel(self, uuid):
+        """停止轮询（例如用户重新获取了二维码）"""
+        with self._cond:
+            self._entries.pop(uuid, None)
+
+    def pending_count(self) -> int:
+        with self._cond:
+            return len(self._entries)
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="qr-check")
+            self._thread = threading.Thread(target=self._run, name="qr-scheduler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                due_at = self._heap[0][0]
+                now = time.time()
+                if due_at > now:
+                    self._cond.wait(due_at - now)
+                    continue
+                batch = []
+                expired = []
+                while self._heap and self._heap[0][0] <= now:
+                    _, uuid = heapq.heappop(self._heap)
+                    entry = self._entries.get(uuid)
+                    if entry is None or entry.in_flight:
+                        continue
+                    if now >= entry.expires_at:
+                        self._entries.pop(uuid, None)
+                        expired.append(entry)
+                        continue
+                    if now - entry.last_seen >= self.abandon_after:
+                        # 前端已不再查询状态，停止轮询
+                        self._entries.pop(uuid, None)
+                        continue
+                    entry.in_flight = True
+                    batch.append(entry)
+            for entry in expired:
+                self._notify(entry, {"status": "expired", "message": "二维码已过期，请重新获取"})
+            for entry in batch:
+                self._pool.submit(self._check, entry)
+
+    def _check(self, entry):
+        try:
+            result = entry.manager.booking.check_qr_status_once()
+        except Exception as e:
+            result = {"status": "failed", "message": f"检查失败: {e}"}
+        with self._cond:
+            entry.in_flight = False
+            current = self._entries.get(entry.uuid)
+            if current is not entry:
+                return  # 已被取消或替换
+            if result.get("status") in TERMINAL_STATUSES:
+                self._entries.pop(entry.uuid, None)
+            else:
+                heapq.heappush(self._heap, (time.time() + self.interval, entry.uuid))
+                self._cond.notify()
+        self._notify(entry, result)
+
+    @staticmethod
+    def _notify(entry, result):
+        try:
+            entry.manager.on_qr_status(entry.uuid, result)
+        except Exception as e:
+            log.warning("处理二维码状态失败: %s", e)
+
+
+# 全进程共享的扫码登录调度器
+qr_scheduler = QRPollScheduler()
@@ -0,0 +1,40 @@
+"""
+进程级共享的 Redis 连接池
+Web 会话、登录 Cookies 等所有 Redis 访问都复用同一个有界连接池
+"""
+
+import os
+import threading
+from typing import Optional
+
+import redis
+
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 50))
+REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', 5))  # 连接池耗尽时等待空闲连接的时间(秒)
+
+_pool: Optional[redis.ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_redis_pool() -> redis.ConnectionPool:
+    """获取共享连接池（首次调用时创建）"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = redis.BlockingConnectionPool(
+                    host=os.getenv('REDIS_HOST', 'localhost'),
+                    port=int(os.getenv('REDIS_PORT', 6379)),
+                    password=os.getenv('REDIS_PASSWORD', 'xiaodun'),
+                    db=int(os.getenv('REDIS_DB', 0)),
+                    decode_responses=True,
+                    socket_connect_timeout=5,
+                    max_connections=REDIS_MAX_CONNECTIONS,
+                    timeout=REDIS_POOL_TIMEOUT
+                )
+    return _pool
+
+
+def get_redis_client() -> redis.Redis:
+    """返回使用共享连接池的客户端（客户端本身很轻，连接由连接池管理）"""
+    return redis.Redis(connection_pool=get_redis_pool())
@@ -0,0 +1,194 @@
+"""
+有界的 BookingManager 会话池
+按最近使用顺序 (LRU) 保存各浏览器会话的管理器，
+超过容量或空闲超时的管理器会被淘汰并释放其连接，
+下次请求时由调用方重新创建并从 Redis 恢复状态
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from log_setup import get_logger
+
+SESSION_POOL_MAX = int(os.getenv('SESSION_POOL_MAX', 500))              # 同时保留的管理器数量上限
+SESSION_IDLE_TIMEOUT = float(os.getenv('SESSION_IDLE_TIMEOUT', 1800))   # 空闲多久后淘汰(秒)
+SESSION_SWEEP_INTERVAL = float(os.getenv('SESSION_SWEEP_INTERVAL', 60))  # 空闲检查的最小间隔(秒)
+
+log = get_logger("sessions")
+
+
+def current_rss_bytes() -> Optional[int]:
+    """当前进程常驻内存（字节），无法获取时返回 None"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        # ru_maxrss 为峰值，macOS 上单位是字节，Linux 上是 KB
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except Exception:
+        return None
+
+
+class _PoolEntry:
+    """池中的一项；manager 为 None 表示正在创建（其他请求等待 ready）"""
+
+    __slots__ = ('manager', 'last_access', 'refs', 'ready')
+
+    def __init__(self, now: float):
+        self.manager = None
+        self.last_access = now
+        self.refs = 1  # 正在使用该管理器的请求数
+        self.ready = threading.Event()
+
+
+class BookingManagerPool:
+    """
+    LRU + 空闲超时淘汰的管理器池
+    get() 返回的管理器在 release() 之前处于使用中：使用中的管理器不会被淘汰，
+    淘汰（及 on_evict 中的 close）推迟到最后一个使用者释放之后；全部在用时池可以暂时超过容量
+    """
+
+    def __init__(self, factory: Callable[[str], object], max_size: int = SESSION_POOL_MAX,
+                 idle_timeout: float = SESSION_IDLE_TIMEOUT,
+                 on_evict: Optional[Callable[[str, object], None]] = None,
+                 sweep_interval: float = SESSION_SWEEP_INTERVAL):
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.on_evict = on_evict
+        self.sweep_interval = sweep_interval
+        self._managers: "OrderedDict[str, _PoolEntry]" = OrderedDict()  # 按最近访问排序
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+        self.created_total = 0
+        self.evicted_total = 0
+
+    def get(self, session_id: str) -> Tuple[object, bool]:
+        """
+        获取会话对应的管理器并标记为使用中，返回 (manager, 是否新建)；用完后必须调用 release()
+        管理器在锁外创建，同一会话的并发请求等待同一个创建结果，不同会话的创建互不阻塞
+        """
+        while True:
+            with self._lock:
+                entry = self._managers.get(session_id)
+                if entry is None:
+                    entry = self._managers[session_id] = _PoolEntry(time.time())
+                    break
+                entry.refs += 1
+                entry.last_access = time.time()
+                self._managers.move_to_end(session_id)
+            entry.ready.wait()
+            if entry.manager is not None:
+                return entry.manager, False
+            # 创建失败，占位项已移除，重新尝试
+
+        try:
+            manager = self.factory(session_id)
+        except BaseException:
+            with self._lock:
+                if self._managers.get(session_id) is entry:
+                    del self._managers[session_id]
+            entry.ready.set()
+            raise
+        entry.manager = manager
+        with self._lock:
+            self.created_total += 1
+            evicted = self._collect(time.time())
+        entry.ready.set()
+        self._evict(evicted)
+        return manager, True
+
+    def release(self, session_id: str, manager):
+        """
+        结束一次使用；超出容量的管理器在这里才真正被淘汰，
+        并按 sweep_interval 顺带淘汰其他空闲超时的管理器（只访问已有会话的稳定流量下也能回收）
+        """
+        with self._lock:
+            entry = self._managers.get(session_id)
+            if entry is None or entry.manager is not manager:
+                return
+            entry.refs = max(entry.refs - 1, 0)
+            entry.last_access = time.time()
+            self._managers.move_to_end(session_id)
+            evicted = self._collect(entry.last_access)
+        self._evict(evicted)
+
+    def peek(self, session_id: str):
+        """不更新访问时间地获取管理器，不存在时返回 None"""
+        with self._lock:
+            entry = self._managers.get(session_id)
+            return entry.manager if entry else None
+
+    @staticmethod
+    def _evictable(entry: _PoolEntry) -> bool:
+        return entry.refs == 0 and entry.manager is not None
+
+    def _collect(self, now):
+        """在锁内选出需要淘汰的管理器：空闲超时的，以及超出容量时最久未使用的（都跳过使用中的）"""
+        evicted = []
+        if now - self._last_sweep >= self.sweep_interval:
+            self._last_sweep = now
+            evicted.extend(self._pop_idle(now))
+        excess = len(self._managers) - self.max_size
+        if excess > 0:
+            victims = []
+            for session_id, entry in self._managers.items():
+                if len(victims) >= excess:
+                    break
+                if self._evictable(entry):
+                    victims.append(session_id)
+            evicted.extend((session_id, self._managers.pop(session_id)) for session_id in victims)
+        return evicted
+
+    def _pop_idle(self, now):
+        idle = []
+        # OrderedDict 按访问顺序排列，遇到未超时的即可停止
+        for session_id, entry in self._managers.items():
+            if now - entry.last_access < self.idle_timeout:
+                break
+            if self._evictable(entry):
+                idle.append(session_id)
+        return [(session_id, self._managers.pop(session_id)) for session_id in idle]
+
+    def evict_idle(self):
+        """立即淘汰所有空闲超时（且未在使用）的管理器"""
+        with self._lock:
+            self._last_sweep = time.time()
+            evicted = self._pop_idle(self._last_sweep)
+        self._evict(evicted)
+
+    def _evict(self, evicted):
+        for session_id, entry in evicted:
+            self.evicted_total += 1
+            if self.on_evict:
+                try:
+                    self.on_evict(session_id, entry.manager)
+                except Exception as e:
+                    log.warning("释放会话失败: %s", e)
+
+    def __len__(self):
+        return len(self._managers)
+
+    def __contains__(self, session_id):
+        return session_id in self._managers
+
+    def in_use(self) -> int:
+        with self._lock:
+            return sum(1 for entry in self._managers.values() if entry.refs)
+
+    def stats(self) -> Dict:
+        return {
+            'live_sessions': len(self._managers),
+            'in_use_sessions': self.in_use(),
+            'max_sessions': self.max_size,
+            'idle_timeout': self.idle_timeout,
+            'created_total': self.created_total,
+            'evicted_total': self.evicted_total,
+            'rss_bytes': current_rss_bytes(),
+        }
@@ -0,0 +1,125 @@
+"""
+Web 会话状态的 Redis 持久化
+每个会话保存为一个 Redis Hash，只写入发生变化的字段；
+写入先进入内存队列，由后台线程按批次通过 pipeline 写回 (write-behind)，
+过期时间的刷新也做了节流
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import metrics
+from log_setup import get_logger
+
+SESSION_TTL = int(os.getenv('SESSION_TTL', 86400))                          # 会话过期时间(秒)
+SESSION_TTL_REFRESH_INTERVAL = float(os.getenv('SESSION_TTL_REFRESH_INTERVAL', 300))  # 过期时间最短刷新间隔(秒)
+SESSION_FLUSH_INTERVAL = float(os.getenv('SESSION_FLUSH_INTERVAL', 0.5))    # 后台批量写回间隔(秒)
+
+log = get_logger("session_store")
+
+
+class SessionStore:
+    """基于 Redis Hash 的会话存储，字段值为 JSON"""
+
+    KEY = "session_state:{}"
+    LEGACY_KEY = "session:{}"  # 旧版整段 JSON 的会话键，只读兼容
+
+    def __init__(self, client, ttl=SESSION_TTL, ttl_refresh_interval=SESSION_TTL_REFRESH_INTERVAL,
+                 flush_interval=SESSION_FLUSH_INTERVAL):
+        self.client = client
+        self.ttl = ttl
+        self.ttl_refresh_interval = ttl_refresh_interval
+        self.flush_interval = flush_interval
+        self._pending: Dict[str, Dict[str, str]] = {}  # session_id -> 待写入字段
+        self._touched: Dict[str, float] = {}           # session_id -> 最近一次刷新过期时间
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="session-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def load(self, session_id) -> Optional[Dict]:
+        """读取会话的所有字段，不存在时返回 None"""
+        with metrics.REDIS_SECONDS.time(op="session_load"):
+            raw = self.client.hgetall(self.KEY.format(session_id))
+        if raw:
+            self._touched[session_id] = time.time()
+            return {field: json.loads(value) for field, value in raw.items()}
+        with metrics.REDIS_SECONDS.time(op="session_load_legacy"):
+            legacy = self.client.get(self.LEGACY_KEY.format(session_id))
+        return json.loads(legacy) if legacy else None
+
+    def write(self, session_id, fields: Dict):
+        """登记变化的字段，由后台线程批量写回"""
+        encoded = {field: json.dumps(value, ensure_ascii=False) for field, value in fields.items()}
+        with self._lock:
+            self._pending.setdefault(session_id, {}).update(encoded)
+        self._wakeup.set()
+
+    def touch(self, session_id):
+        """刷新会话过期时间（节流：间隔内只刷新一次）"""
+        now = time.time()
+        if now - self._touched.get(session_id, 0) < self.ttl_refresh_interval:
+            return
+        with self._lock:
+            self._pending.setdefault(session_id, {})
+        self._wakeup.set()
+
+    def flush(self, session_id=None):
+        """立即写回待写入的数据（指定 session_id 时只写该会话）"""
+        with self._lock:
+            if session_id is None:
+                batch, self._pending = self._pending, {}
+            elif session_id in self._pending:
+                batch = {session_id: self._pending.pop(session_id)}
+            else:
+                return
+        if not batch:
+            return
+        now = time.time()
+        pipe = self.client.pipeline(transaction=False)
+        for sid, fields in batch.items():
+            key = self.KEY.format(sid)
+            if fields:
+                pipe.hset(key, mapping=fields)
+            pipe.expire(key, self.ttl)
+        try:
+            with metrics.REDIS_SECONDS.time(op="session_flush"):
+                pipe.execute()
+        except Exception:
+            # 写回失败时放回队列，下个周期重试（不覆盖期间产生的新值）
+            with self._lock:
+                for sid, fields in batch.items():
+                    merged = dict(fields)
+                    merged.update(self._pending.get(sid, {}))
+                    self._pending[sid] = merged
+            raise
+        for sid in batch:
+            self._touched[sid] = now
+
+    def delete(self, session_id):
+        with self._lock:
+            self._pending.pop(session_id, None)
+        self._touched.pop(session_id, None)
+        with metrics.REDIS_SECONDS.time(op="session_delete"):
+            self.client.delete(self.KEY.format(session_id), self.LEGACY_KEY.format(session_id))
+
+    def forget(self, session_id):
+        """会话已从内存淘汰，丢弃其节流记录"""
+        self._touched.pop(session_id, None)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            time.sleep(self.flush_interval)  # 攒批
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                log.warning("会话写回失败: %s", e)
+                time.sleep(5)
+                self._wakeup.set()
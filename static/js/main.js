@@ -145,13 +145,21 @@ class TrainBookingApp {
     
     async pollLoginStatus() {
         const statusText = document.getElementById('loginModalStatusText');
-        
-        const checkStatus = async () => {
+        const uuid = this.qrUuid;
+        let lastStatus = 'waiting';
+        
+        // 长轮询：服务端在状态变化时立即返回，否则最多保持约25秒
+        const waitStatus = async () => {
+            // 已重新生成二维码，停止旧的轮询
+            if (uuid !== this.qrUuid) {
+                return;
+            }
             try {
-                const response = await fetch(`/api/login/status/${this.qrUuid}`);
+                const response = await fetch(`/api/login/status/${uuid}/wait?since=${encodeURIComponent(lastStatus)}`);
                 const data = await response.json();
                 
                 if (data.success) {
+                    lastStatus = data.status;
                     switch (data.status) {
                         case 'waiting':
                             statusText.innerHTML = '<div class="login-status-text text-info"><i class="fas fa-clock me-2"></i>等待扫描...</div>';
@@ -175,17 +183,17 @@ class TrainBookingApp {
                             return;
                     }
                     
-                    // 继续轮询
-                    setTimeout(checkStatus, 2000);
+                    // 立即发起下一次长轮询
+                    waitStatus();
                 }
             } catch (error) {
                 console.error('检查登录状态失败:', error);
-                setTimeout(checkStatus, 2000);
+                setTimeout(waitStatus, 2000);
             }
         };
         
         // 开始轮询
-        checkStatus();
+        waitStatus();
     }
     
     async loadStations() {
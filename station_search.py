@@ -0,0 +1,125 @@
+"""
+车站自动补全引擎
+在 StationRegistry 之上预先构建前缀索引（中文名、全拼、拼音首字母、电报码）
+和中文名的字/双字索引，查询时只做字典查找，返回排好序的结果：
+完全匹配 > 前缀匹配 > 包含匹配，同级中主要车站在前
+"""
+
+import os
+import threading
+from typing import Dict, List, Optional, Set
+
+from stations import StationRecord, StationRegistry, get_station_registry
+
+# 前缀索引的最大长度，更长的输入先按此长度取候选再逐个校验
+MAX_PREFIX = 8
+
+
+class StationSuggestEngine:
+    """基于预建索引的车站补全/模糊解析"""
+
+    def __init__(self, registry: StationRegistry):
+        self.registry = registry
+        # 按重要程度排序：与城市同名的车站（北京、上海）优先，其次按 station_name.js 中的顺序
+        self.records: List[StationRecord] = sorted(
+            registry.records, key=lambda r: (r.name != r.city, r.index))
+        self._keys: List[tuple] = []
+        self._exact: Dict[str, List[int]] = {}
+        self._prefix: Dict[str, List[int]] = {}
+        self._chars: Dict[str, List[int]] = {}
+        self._bigrams: Dict[str, Set[int]] = {}
+        self._build()
+
+    def _build(self):
+        for rank, record in enumerate(self.records):
+            keys = tuple({k for k in (record.name, record.pinyin, record.short_pinyin,
+                                      record.abbr, record.code.lower()) if k})
+            self._keys.append(keys)
+            prefixes = set()
+            for key in keys:
+                self._exact.setdefault(key, []).append(rank)
+                for end in range(1, min(len(key), MAX_PREFIX) + 1):
+                    prefixes.add(key[:end])
+            # rank 递增遍历，各列表天然有序
+            for prefix in prefixes:
+                self._prefix.setdefault(prefix, []).append(rank)
+            name = record.name
+            for ch in set(name):
+                self._chars.setdefault(ch, []).append(rank)
+            for i in range(len(name) - 1):
+                self._bigrams.setdefault(name[i:i + 2], set()).add(rank)
+
+    def _infix_candidates(self, query: str) -> List[int]:
+        if len(query) == 1:
+            return self._chars.get(query, [])
+        candidates: Optional[Set[int]] = None
+        for i in range(len(query) - 1):
+            ranks = self._bigrams.get(query[i:i + 2])
+            if not ranks:
+                return []
+            candidates = set(ranks) if candidates is None else candidates & ranks
+        return sorted(r for r in candidates if query in self.records[r].name)
+
+    def search(self, query: str, limit: int = 10) -> List[StationRecord]:
+        """返回排序后的匹配车站"""
+        query = query.strip().lower()
+        if not query or limit <= 0:
+            return []
+
+        seen = set()
+        result = []
+
+        def take(ranks):
+            for rank in ranks:
+                if rank not in seen:
+                    seen.add(rank)
+                    result.append(self.records[rank])
+                    if len(result) >= limit:
+                        return True
+            return False
+
+        if take(self._exact.get(query, [])):
+            return result
+
+        prefix_ranks = self._prefix.get(query[:MAX_PREFIX], [])
+        if len(query) > MAX_PREFIX:
+            prefix_ranks = [r for r in prefix_ranks
+                            if any(k.startswith(query) for k in self._keys[r])]
+        if take(prefix_ranks):
+            return result
+
+        take(self._infix_candidates(query))
+        return result
+
+    def suggest(self, query: str, limit: int = 10) -> List[Dict]:
+        """供 /api/stations/suggest 使用的字典格式结果"""
+        return [{
+            'name': r.name,
+            'code': r.code,
+            'city': r.city,
+            'pinyin': r.pinyin,
+        } for r in self.search(query, limit)]
+
+    def best_match(self, query: str) -> Optional[StationRecord]:
+        """排名第一的车站，没有匹配时返回 None"""
+        matches = self.search(query, 1)
+        return matches[0] if matches else None
+
+
+# 进程级共享的补全引擎 {车站文件路径: StationSuggestEngine}，注册表重新加载后自动重建
+_engines: Dict[str, StationSuggestEngine] = {}
+_engine_lock = threading.Lock()
+
+
+def get_suggest_engine(station_file='stations.json') -> StationSuggestEngine:
+    """获取与该车站文件当前共享注册表对应的补全引擎"""
+    key = os.path.abspath(station_file)
+    registry = get_station_registry(station_file)
+    engine = _engines.get(key)
+    if engine is None or engine.registry is not registry:
+        with _engine_lock:
+            engine = _engines.get(key)
+            if engine is None or engine.registry is not registry:
+                engine = StationSuggestEngine(registry)
+                _engines[key] = engine
+    return engine
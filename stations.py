@@ -1,66 +1,305 @@
 import re
 import json
 import os
+import threading
 import requests
+from log_setup import get_logger
+from types import MappingProxyType
+from typing import Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+try:
+    from pypinyin import Style, lazy_pinyin
+except ImportError:  # 可选依赖：只用于给没有拼音的旧版车站文件补全拼音
+    lazy_pinyin = None
+
+log = get_logger("stations")
+
+
+class StationRecord(NamedTuple):
+    """station_name.js 中的一条完整车站记录"""
+    name: str               # 车站名 (北京南)
+    code: str               # 电报码 (VNP)
+    pinyin: str = ''        # 全拼 (beijingnan)
+    short_pinyin: str = ''  # 拼音首字母 (bjn)
+    abbr: str = ''          # 简码 (bjn)
+    index: int = 0          # 在 station_name.js 中的序号，越小越是主要车站
+    city_code: str = ''     # 所属城市编码
+    city: str = ''          # 所属城市 (北京)
+
+
+def parse_station_js(content: str) -> List[StationRecord]:
+    """
+    解析 station_name.js
+    格式: var station_names ='@bjb|北京北|VAP|beijingbei|bjb|0|0357|北京|||@...'
+    """
+    start_index = content.find("'") + 1
+    end_index = content.rfind("'")
+    data = content[start_index:end_index]
+
+    records = []
+    for part in data.split('@'):
+        if not part:
+            continue
+        fields = part.split('|')
+        if len(fields) < 3:
+            continue
+        fields.extend([''] * (8 - len(fields)))
+        try:
+            index = int(fields[5])
+        except ValueError:
+            index = len(records)
+        records.append(StationRecord(
+            name=fields[1], code=fields[2], pinyin=fields[3], short_pinyin=fields[4],
+            abbr=fields[0], index=index, city_code=fields[6], city=fields[7] or fields[1]
+        ))
+    return records
+
+
+class StationRegistry:
+    """
+    车站注册表：保存完整车站记录，
+    按车站名、电报码、全拼、拼音首字母、城市建立 O(1) 索引
+    构建后只读，可在线程和会话之间共享
+    """
+
+    def __init__(self, records: List[StationRecord]):
+        self.records: Tuple[StationRecord, ...] = tuple(records)
+        self.legacy = False  # 由旧版 {name: code} 文件构建
+        by_name: Dict[str, StationRecord] = {}
+        by_code: Dict[str, StationRecord] = {}
+        by_pinyin: Dict[str, List[StationRecord]] = {}
+        by_short_pinyin: Dict[str, List[StationRecord]] = {}
+        by_city: Dict[str, List[StationRecord]] = {}
+        for record in self.records:
+            by_name.setdefault(record.name, record)
+            by_code.setdefault(record.code, record)
+            if record.pinyin:
+                by_pinyin.setdefault(record.pinyin, []).append(record)
+            if record.short_pinyin:
+                by_short_pinyin.setdefault(record.short_pinyin, []).append(record)
+            if record.city:
+                by_city.setdefault(record.city, []).append(record)
+        self.by_name: Mapping[str, StationRecord] = MappingProxyType(by_name)
+        self.by_code: Mapping[str, StationRecord] = MappingProxyType(by_code)
+        self.by_pinyin = _freeze_groups(by_pinyin)
+        self.by_short_pinyin = _freeze_groups(by_short_pinyin)
+        self.by_city = _freeze_groups(by_city, sort=True)
+        # 兼容旧接口的 name -> code 映射
+        self.codes: Mapping[str, str] = MappingProxyType({r.name: r.code for r in self.records})
+
+    @classmethod
+    def from_name_code_map(cls, stations: Dict[str, str]) -> 'StationRegistry':
+        """
+        从旧版 stations.json ({name: code}) 构建
+        旧数据没有城市字段，取本身也是车站名的最长前缀作为城市 (上海虹桥 -> 上海)；
+        也没有拼音，安装了 pypinyin 时在本地生成全拼和首字母
+        """
+        records = []
+        for index, (name, code) in enumerate(stations.items()):
+            city = name
+            for end in range(len(name) - 1, 1, -1):
+                if name[:end] in stations:
+                    city = name[:end]
+                    break
+            pinyin, short_pinyin = station_pinyin(name)
+            records.append(StationRecord(name=name, code=code, pinyin=pinyin, short_pinyin=short_pinyin,
+                                         index=index, city=city))
+        registry = cls(records)
+        registry.legacy = True
+        return registry
+
+    @classmethod
+    def load_file(cls, station_file: str) -> 'StationRegistry':
+        """加载 stations.json，兼容旧版 {name: code} 和新版完整记录两种格式"""
+        with open(station_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict) and isinstance(data.get('stations'), list):
+            return cls([StationRecord(*fields) for fields in data['stations']])
+        return cls.from_name_code_map(data)
+
+    def dump_file(self, station_file: str):
+        """以完整记录格式写入 stations.json（每个车站一行，便于比较数据更新）"""
+        lines = ',\n'.join(json.dumps(list(r), ensure_ascii=False) for r in self.records)
+        with open(station_file, 'w', encoding='utf-8') as f:
+            f.write(f'{{"version": 2, "stations": [\n{lines}\n]}}\n')
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def has_pinyin(self) -> bool:
+        return any(r.pinyin for r in self.records)
+
+    def get(self, name: str) -> Optional[StationRecord]:
+        return self.by_name.get(name)
+
+    def get_by_code(self, code: str) -> Optional[StationRecord]:
+        return self.by_code.get(code)
+
+    def find_by_pinyin(self, pinyin: str) -> Tuple[StationRecord, ...]:
+        return self.by_pinyin.get(pinyin.lower(), ())
+
+    def find_by_short_pinyin(self, short_pinyin: str) -> Tuple[StationRecord, ...]:
+        return self.by_short_pinyin.get(short_pinyin.lower(), ())
+
+    def stations_in_city(self, city: str) -> Tuple[StationRecord, ...]:
+        """城市内的所有车站，主要车站在前"""
+        return self.by_city.get(city, ())
+
+    def resolve(self, keyword: str) -> Optional[StationRecord]:
+        """
+        按 车站名 > 电报码 > 全拼 > 拼音首字母 > 城市 的顺序精确解析车站
+        """
+        record = self.by_name.get(keyword) or self.by_code.get(keyword.upper())
+        if record:
+            return record
+        for matches in (self.find_by_pinyin(keyword), self.find_by_short_pinyin(keyword),
+                        self.stations_in_city(keyword)):
+            if matches:
+                return min(matches, key=lambda r: r.index)
+        return None
+
+
+def station_pinyin(name: str) -> Tuple[str, str]:
+    """车站名的 (全拼, 拼音首字母)，没有安装 pypinyin 时为空"""
+    if lazy_pinyin is None:
+        return '', ''
+    return ''.join(lazy_pinyin(name)), ''.join(lazy_pinyin(name, style=Style.FIRST_LETTER))
+
+
+def _freeze_groups(groups: Dict[str, List[StationRecord]], sort=False) -> Mapping[str, Tuple[StationRecord, ...]]:
+    if sort:
+        return MappingProxyType({k: tuple(sorted(v, key=lambda r: r.index)) for k, v in groups.items()})
+    return MappingProxyType({k: tuple(v) for k, v in groups.items()})
+
+
+STATION_JS_URL = os.getenv('KYFW_BASE_URL', 'https://kyfw.12306.cn').rstrip('/') + "/otn/resources/js/framework/station_name.js"
+STATION_DOWNLOAD_TIMEOUT = float(os.getenv('STATION_DOWNLOAD_TIMEOUT', 10))
+
+# 进程级共享的车站注册表 {车站文件路径: StationRegistry}
+_registries: Dict[str, StationRegistry] = {}
+_registry_lock = threading.RLock()
+
+
+def download_station_registry(station_file='stations.json') -> StationRegistry:
+    """
+    下载最新 station_name.js，写入车站文件并替换共享注册表
+    只在显式更新时调用（python stations.py --download 或 StationManager.download_stations），服务运行中不会自动下载
+    """
+    log.info("正在下载最新车站信息")
+    resp = requests.get(STATION_JS_URL, timeout=STATION_DOWNLOAD_TIMEOUT)
+    resp.encoding = 'utf-8'
+    registry = StationRegistry(parse_station_js(resp.text))
+    if not len(registry):
+        raise ValueError("车站数据为空")
+    registry.dump_file(station_file)
+    with _registry_lock:
+        _registries[os.path.abspath(station_file)] = registry
+    log.info("车站信息已更新", extra={"stations": len(registry)})
+    return registry
+
+
+def _load_registry(station_file: str) -> StationRegistry:
+    """只读取车站文件（不访问网络），文件不存在、格式错误或为空时抛出异常"""
+    try:
+        registry = StationRegistry.load_file(station_file)
+        if not len(registry):
+            raise ValueError("车站数据为空")
+    except Exception as e:
+        log.warning("加载车站数据失败: %s", e)
+        raise
+    if registry.legacy and not registry.has_pinyin:
+        log.warning("车站文件为旧版格式且没有拼音，拼音补全不可用（python stations.py --convert 或 --download 升级）")
+    log.info("已加载车站数据", extra={"stations": len(registry)})
+    return registry
+
+
+def get_station_registry(station_file='stations.json') -> StationRegistry:
+    """获取进程级共享的车站注册表，首次调用时加载"""
+    key = os.path.abspath(station_file)
+    registry = _registries.get(key)
+    if registry is None:
+        with _registry_lock:
+            registry = _registries.get(key)
+            if registry is None:
+                try:
+                    registry = _load_registry(station_file)
+                except Exception:
+                    # 没有任何可用的车站数据：先用空注册表，之后可通过 reload_station_registry 重新加载
+                    log.error("没有可用的车站数据（可运行 python stations.py --download 下载）")
+                    registry = StationRegistry([])
+                _registries[key] = registry
+    return registry
+
+
+def reload_station_registry(station_file='stations.json') -> StationRegistry:
+    """
+    重新加载车站文件（例如用 --download 更新文件之后），已有的 StationManager 等使用者会在下次访问时看到新数据
+    加载失败时保留当前注册表并抛出异常
+    """
+    try:
+        registry = _load_registry(station_file)
+    except Exception as e:
+        log.error("重新加载车站数据失败，继续使用当前数据: %s", e)
+        raise
+    with _registry_lock:
+        _registries[os.path.abspath(station_file)] = registry
+    return registry
+
 
 class StationManager:
     def __init__(self, station_file='stations.json'):
         self.station_file = station_file
-        self.stations = {} # name -> code
         self.load_stations()
 
+    @property
+    def registry(self) -> StationRegistry:
+        return get_station_registry(self.station_file)
+
+    @property
+    def stations(self) -> Mapping[str, str]:
+        """name -> code"""
+        return self.registry.codes
+
     def download_stations(self):
-        url = "https://kyfw.12306.cn/otn/resources/js/framework/station_name.js"
         try:
-            print("正在下载最新车站信息...")
-            resp = requests.get(url)
-            resp.encoding = 'utf-8'
-            content = resp.text
-            # content format: var station_names ='@bjb|北京北|VAP|beijingbei|bjb|0|0357|北京|||...'
-            # remove "var station_names ='" and last "'"
-            start_index = content.find("'") + 1
-            end_index = content.rfind("'")
-            data = content[start_index:end_index]
-            
-            parts = data.split('@')
-            station_dict = {}
-            for part in parts:
-                if not part:
-                    continue
-                fields = part.split('|')
-                if len(fields) > 2:
-                    name = fields[1]
-                    code = fields[2]
-                    station_dict[name] = code
-            
-            self.stations = station_dict
-            with open(self.station_file, 'w', encoding='utf-8') as f:
-                json.dump(self.stations, f, ensure_ascii=False, indent=2)
-            print(f"车站信息已更新，共 {len(self.stations)} 个车站")
-            
+            download_station_registry(self.station_file)
         except Exception as e:
-            print(f"下载车站信息失败: {e}")
+            log.warning("下载车站信息失败: %s", e)
 
     def load_stations(self):
-        if os.path.exists(self.station_file):
-            try:
-                with open(self.station_file, 'r', encoding='utf-8') as f:
-                    self.stations = json.load(f)
-            except Exception:
-                self.download_stations()
-        else:
-            self.download_stations()
+        get_station_registry(self.station_file)
 
     def get_code(self, name):
         return self.stations.get(name)
 
     def get_name(self, code):
-        for name, c in self.stations.items():
-            if c == code:
-                return name
-        return None
+        record = self.registry.get_by_code(code)
+        return record.name if record else None
+
+def convert_legacy_file(station_file='stations.json') -> StationRegistry:
+    """把旧版 {name: code} 车站文件转换为完整记录格式，拼音由 pypinyin 在本地生成"""
+    if lazy_pinyin is None:
+        raise RuntimeError("转换旧版车站文件需要 pypinyin: pip install pypinyin")
+    registry = StationRegistry.load_file(station_file)
+    if not registry.legacy:
+        return registry
+    registry.dump_file(station_file)
+    return registry
+
 
 if __name__ == "__main__":
-    sm = StationManager()
-    print(f"杭州的代码: {sm.get_code('杭州')}")
-    print(f"武汉的代码: {sm.get_code('武汉')}")
+    import argparse
+    parser = argparse.ArgumentParser(description='车站数据')
+    parser.add_argument('--file', default='stations.json')
+    parser.add_argument('--convert', action='store_true', help='把旧版 {name: code} 文件转换为带拼音的完整格式')
+    parser.add_argument('--download', action='store_true', help='从 12306 下载最新 station_name.js 并写入车站文件')
+    args = parser.parse_args()
+    if args.download:
+        print(f"已下载 {len(download_station_registry(args.file))} 个车站")
+    elif args.convert:
+        print(f"已转换 {len(convert_legacy_file(args.file))} 个车站")
+    else:
+        sm = StationManager(args.file)
+        print(f"杭州的代码: {sm.get_code('杭州')}")
+        print(f"武汉的代码: {sm.get_code('武汉')}")
@@ -1,84 +1,249 @@
 import time
 import base64
 import io
-import pickle
-import redis
+import json
+import os
+from urllib.parse import urlsplit
 from PIL import Image
-from curl_cffi import requests
+from http_pool import new_session, request_timing
+from redis_pool import get_redis_client
+import metrics
+from log_setup import get_logger, setup_logging
+
+log = get_logger("login")
+http_log = get_logger("http")
+
+# 12306 服务地址，压测或离线调试时可指向本地模拟服务 (mock_12306.py)
+KYFW_BASE_URL = os.getenv('KYFW_BASE_URL', 'https://kyfw.12306.cn').rstrip('/')
+CHECK_USER_URL = f"{KYFW_BASE_URL}/otn/login/checkUser"
+
+# 登录 Cookies 在 Redis 中的键前缀及保存时间(秒)
+COOKIE_KEY_PREFIX = "12306_cookies:"
+COOKIE_TTL = 7 * 86400
+# 检查其他进程是否更新了 Cookies 的最短间隔(秒)
+COOKIE_SYNC_INTERVAL = 5
+# 登录有效租约(秒)：校验通过或需登录的接口正常返回后，期间内不再请求 checkUser
+LOGIN_LEASE_SECONDS = float(os.getenv('LOGIN_LEASE_SECONDS', 120))
+
+# 需要登录的接口：正常返回 JSON 说明登录有效，被重定向到登录页说明登录已失效
+AUTH_PATH_PREFIXES = ("/otn/confirmPassenger/", "/otn/leftTicket/submitOrderRequest")
+# initDc 正常返回 HTML，不能用内容类型判断
+AUTH_HTML_PATHS = ("/otn/confirmPassenger/initDc",)
+LOGIN_PAGE_MARKERS = ("/otn/resources/login.html", "/otn/login/init", "/otn/view/index.html")
 
 class Tiantiel12306Login:
-    def __init__(self):
+    def __init__(self, cookie_key=None):
         # 初始化一个 Session，它会自动维持 Cookie (这是核心)
-        self.session = requests.Session()
+        self.session = new_session()
         
         # 伪装成 Chrome 浏览器
         self.headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            "Referer": "https://kyfw.12306.cn/",
-            "Origin": "https://kyfw.12306.cn"
+            "Referer": KYFW_BASE_URL + "/",
+            "Origin": KYFW_BASE_URL
         }
         self.uuid = ""
         self._last_qr_base64 = ""  # 存储最后生成的二维码base64数据
         
-        # 初始化 Redis
+        # Cookies 按账号/会话分别保存（命令行默认使用 "default"）
+        self.cookie_key = cookie_key or "default"
+        # 内存中的 Cookie 为准；_cookie_version 记录其对应的 Redis 版本号，
+        # 只有 Redis 中的版本号变化（其他进程重新登录）时才重新读取
+        self._cookie_version = None
+        self._cookie_checked_at = 0.0
+        self._saved_cookies = None  # 最近一次保存或加载时的 Cookie 序列化结果
+        # 登录有效租约的到期时间（0 表示未知，需要重新校验）
+        self._login_valid_until = 0.0
+        
+        # 初始化 Redis（使用进程共享的连接池）
         try:
-            self.redis_client = redis.Redis(host='127.0.0.1', port=6379, password='xiaodun', decode_responses=False)
+            self.redis_client = get_redis_client()
         except Exception as e:
-            print(f"Redis 连接失败: {e}")
+            log.warning("Redis 连接失败: %s", e)
             self.redis_client = None
 
+    def _upstream(self, method, url, endpoint=None, session=None, **kwargs):
+        """
+        发起一次 12306 请求并按接口记录耗时和状态码
+        endpoint 默认取 URL 路径；session 默认使用登录 Session
+        """
+        session = session or self.session
+        kwargs.setdefault("headers", self.headers)
+        kwargs.setdefault("impersonate", "chrome120")
+        endpoint = endpoint or urlsplit(url).path
+        started = time.perf_counter()
+        try:
+            resp = session.request(method, url, **kwargs)
+        except Exception as e:
+            self.observe_upstream_error(endpoint, time.perf_counter() - started, e)
+            raise
+        self.observe_upstream(endpoint, url, time.perf_counter() - started, resp)
+        return resp
+
+    def observe_upstream(self, endpoint, url, elapsed, resp):
+        """记录一次上游响应的指标和日志，并更新登录租约（同步与异步请求共用）"""
+        metrics.UPSTREAM_SECONDS.observe(elapsed, endpoint=endpoint)
+        metrics.UPSTREAM_TOTAL.inc(endpoint=endpoint, status=str(resp.status_code))
+        extra = {"endpoint": endpoint, "status": resp.status_code, "ms": round(elapsed * 1000, 1)}
+        timing = request_timing(resp)
+        if timing:
+            metrics.UPSTREAM_PHASE_SECONDS.observe(timing["connect"], endpoint=endpoint, phase="connect")
+            metrics.UPSTREAM_PHASE_SECONDS.observe(timing["transfer"], endpoint=endpoint, phase="transfer")
+            if timing["new_connections"]:
+                metrics.UPSTREAM_NEW_CONNECTIONS.inc(timing["new_connections"], endpoint=endpoint)
+            extra["connect_ms"] = round(timing["connect"] * 1000, 1)
+            extra["transfer_ms"] = round(timing["transfer"] * 1000, 1)
+        # 每次调用只记录一条紧凑记录
+        http_log.info("upstream", extra=extra)
+        self._update_login_lease(urlsplit(url).path, resp)
+
+    def observe_upstream_error(self, endpoint, elapsed, error):
+        metrics.UPSTREAM_SECONDS.observe(elapsed, endpoint=endpoint)
+        metrics.UPSTREAM_TOTAL.inc(endpoint=endpoint, status="error")
+        http_log.warning("upstream", extra={"endpoint": endpoint, "status": "error",
+                                            "ms": round(elapsed * 1000, 1), "error": type(error).__name__})
+
+    def extend_login_lease(self):
+        self._login_valid_until = time.time() + LOGIN_LEASE_SECONDS
+
+    def revoke_login_lease(self):
+        self._login_valid_until = 0.0
+
+    def login_lease_valid(self):
+        return time.time() < self._login_valid_until
+
+    def _update_login_lease(self, path, resp):
+        """根据需要登录的接口的响应续期或撤销登录租约"""
+        if not path.startswith(AUTH_PATH_PREFIXES):
+            return
+        final_url = str(resp.url or "")
+        if resp.status_code in (301, 302, 303, 307, 308) or any(m in final_url for m in LOGIN_PAGE_MARKERS):
+            self.revoke_login_lease()
+            return
+        if resp.status_code != 200 or path in AUTH_HTML_PATHS:
+            return
+        if "json" in resp.headers.get("Content-Type", ""):
+            self.extend_login_lease()
+        elif resp.text[:100].lstrip().startswith("<!DOCTYPE"):
+            # JSON 接口返回了登录页
+            self.revoke_login_lease()
+
+    def _dump_cookies(self):
+        """把 Cookie 序列化为紧凑的 JSON: [[name, value, domain, path], ...]"""
+        return json.dumps([[c.name, c.value, c.domain, c.path] for c in self.session.cookies.jar],
+                          separators=(",", ":"), ensure_ascii=False)
+
+    def _restore_cookies(self, data):
+        for name, value, domain, path in json.loads(data):
+            self.session.cookies.set(name, value, domain=domain, path=path)
+
     def save_cookies(self):
-        """保存 Cookies 到 Redis"""
+        """保存 Cookies 到 Redis，并递增版本号"""
         if self.redis_client:
             try:
-                cookies = self.session.cookies.get_dict()
-                self.redis_client.set('12306_cookies', pickle.dumps(cookies))
-                print(">>> 登录状态已保存到 Redis")
+                key = COOKIE_KEY_PREFIX + self.cookie_key
+                data = self._dump_cookies()
+                pipe = self.redis_client.pipeline(transaction=True)
+                pipe.set(key, data, ex=COOKIE_TTL)
+                pipe.incr(key + ":ver")
+                pipe.expire(key + ":ver", COOKIE_TTL)
+                with metrics.REDIS_SECONDS.time(op="cookies_save"):
+                    _, version, _ = pipe.execute()
+                self._cookie_version = str(version)
+                self._cookie_checked_at = time.time()
+                self._saved_cookies = data
+                log.info("登录状态已保存到 Redis", extra={"cookie_key": self.cookie_key})
             except Exception as e:
-                print(f"保存 Cookies 失败: {e}")
+                log.warning("保存 Cookies 失败: %s", e)
 
     def load_cookies(self):
         """从 Redis 加载 Cookies"""
         if self.redis_client:
             try:
-                data = self.redis_client.get('12306_cookies')
+                key = COOKIE_KEY_PREFIX + self.cookie_key
+                with metrics.REDIS_SECONDS.time(op="cookies_load"):
+                    data, version = self.redis_client.mget(key, key + ":ver")
                 if data:
-                    cookies = pickle.loads(data)
-                    self.session.cookies.update(cookies)
-                    print(">>> 已从 Redis 加载历史登录状态")
+                    self._restore_cookies(data)
+                    self.revoke_login_lease()  # 换了 Cookie，需要重新校验
+                    self._cookie_version = version
+                    self._cookie_checked_at = time.time()
+                    self._saved_cookies = self._dump_cookies()
+                    log.info("已从 Redis 加载历史登录状态", extra={"cookie_key": self.cookie_key})
                     return True
             except Exception as e:
-                print(f"加载 Cookies 失败: {e}")
+                log.warning("加载 Cookies 失败: %s", e)
         return False
 
+    def save_cookies_if_changed(self):
+        """Cookie 自上次保存/加载后有变化（例如被 12306 轮换）时才写回 Redis"""
+        if self._dump_cookies() != self._saved_cookies:
+            self.save_cookies()
+
+    def sync_cookies(self):
+        """
+        同步其他进程写入的 Cookies：按间隔只读取版本号，版本变化时才读取并恢复 Cookie
+        返回是否发生了恢复
+        """
+        if not self.redis_client:
+            return False
+        now = time.time()
+        if now - self._cookie_checked_at < COOKIE_SYNC_INTERVAL:
+            return False
+        self._cookie_checked_at = now
+        try:
+            with metrics.REDIS_SECONDS.time(op="cookies_version"):
+                version = self.redis_client.get(COOKIE_KEY_PREFIX + self.cookie_key + ":ver")
+        except Exception as e:
+            log.warning("检查 Cookies 版本失败: %s", e)
+            return False
+        if version is None or version == self._cookie_version:
+            return False
+        return self.load_cookies()
+
     def is_login_valid(self):
-        """验证当前 Session 是否有效"""
-        url = "https://kyfw.12306.cn/otn/login/checkUser"
-        data = {"_json_att": ""}
+        """验证当前 Session 是否有效（登录租约有效期内直接返回，不请求 checkUser）"""
+        if self.login_lease_valid():
+            metrics.cache_result("login_lease", True)
+            return True
+        metrics.cache_result("login_lease", False)
         try:
-            resp = self.session.post(url, data=data, headers=self.headers, impersonate="chrome120")
-            return resp.json().get("data", {}).get("flag") == True
-        except:
+            resp = self._upstream("POST", CHECK_USER_URL, data={"_json_att": ""})
+        except Exception as e:
+            log.warning("CheckUser Error: %s", e)
+            return False
+        return self.apply_check_user(resp)
+
+    def apply_check_user(self, resp):
+        """根据 checkUser 响应续期或撤销登录租约，返回是否已登录"""
+        try:
+            valid = resp.json().get("data", {}).get("flag") == True
+        except Exception as e:
+            log.warning("CheckUser Error: %s", e)
             return False
+        if valid:
+            self.extend_login_lease()
+        else:
+            self.revoke_login_lease()
+        return valid
 
     def get_qr_code_data(self, show_image=False):
         """步骤 1: 获取登录二维码 (返回数据给 Web 层)"""
-        url = "https://kyfw.12306.cn/passport/web/create-qr64"
+        url = f"{KYFW_BASE_URL}/passport/web/create-qr64"
         data = {
             "appid": "otn"
         }
         
-        print("正在获取二维码...")
         try:
-            # 使用 impersonate="chrome120" 模拟浏览器指纹
-            resp = self.session.post(url, data=data, headers=self.headers, impersonate="chrome120")
+            # _upstream 默认使用 impersonate="chrome120" 模拟浏览器指纹
+            resp = self._upstream("POST", url, data=data)
             resp_json = resp.json()
             
             if resp_json.get("result_code") == "0":
                 self.uuid = resp_json.get("uuid")
                 image_b64 = resp_json.get("image")
                 self._last_qr_base64 = image_b64  # 存储base64数据
-                print(f"二维码获取成功! UUID: {self.uuid}")
+                log.info("二维码获取成功", extra={"uuid": self.uuid})
                 if show_image:
                     self._show_image(image_b64)
                 return {
@@ -87,14 +252,14 @@ class Tiantiel12306Login:
                     "qr_image": image_b64
                 }
             else:
-                print(f"获取二维码失败: {resp_json}")
+                log.warning("获取二维码失败: %s", resp_json)
                 return {
                     "success": False,
                     "message": str(resp_json)
                 }
                 
         except Exception as e:
-            print(f"请求异常: {e}")
+            log.warning("获取二维码请求异常: %s", e)
             return {
                 "success": False,
                 "message": str(e)
@@ -117,7 +282,7 @@ class Tiantiel12306Login:
 
     def check_qr_status(self):
         """步骤 2: 轮询二维码状态"""
-        url = "https://kyfw.12306.cn/passport/web/checkqr"
+        url = f"{KYFW_BASE_URL}/passport/web/checkqr"
         data = {
             "uuid": self.uuid,
             "appid": "otn"
@@ -125,7 +290,7 @@ class Tiantiel12306Login:
 
         while True:
             try:
-                resp = self.session.post(url, data=data, headers=self.headers, impersonate="chrome120")
+                resp = self._upstream("POST", url, data=data)
                 resp_json = resp.json()
                 
                 code = resp_json.get("result_code")
@@ -138,7 +303,6 @@ class Tiantiel12306Login:
                     print("\n扫码成功，正在验证登录信息...")
                     if self.cookie_auth():
                         print("登录验证完成！")
-                        print("当前 Session Cookies:", self.session.cookies.get_dict())
                         return True
                     else:
                         print("登录验证失败")
@@ -160,14 +324,14 @@ class Tiantiel12306Login:
         if not self.uuid:
             return {"status": "failed", "message": "二维码UUID无效"}
         
-        url = "https://kyfw.12306.cn/passport/web/checkqr"
+        url = f"{KYFW_BASE_URL}/passport/web/checkqr"
         data = {
             "uuid": self.uuid,
             "appid": "otn"
         }
         
         try:
-            resp = self.session.post(url, data=data, headers=self.headers, impersonate="chrome120")
+            resp = self._upstream("POST", url, data=data)
             resp_json = resp.json()
             
             code = resp_json.get("result_code")
@@ -190,38 +354,39 @@ class Tiantiel12306Login:
     def cookie_auth(self):
         """步骤 3: 验证 uamtk 和 uamauthclient，完成 Session 激活"""
         # 3.1 uamtk
-        uamtk_url = "https://kyfw.12306.cn/passport/web/auth/uamtk"
+        uamtk_url = f"{KYFW_BASE_URL}/passport/web/auth/uamtk"
         data = {"appid": "otn"}
         
         try:
-            resp = self.session.post(uamtk_url, data=data, headers=self.headers, impersonate="chrome120")
+            resp = self._upstream("POST", uamtk_url, data=data)
             result = resp.json()
             newapptk = result.get("newapptk")
             
             if not newapptk:
-                print("uamtk 获取失败")
+                log.warning("uamtk 获取失败", extra={"result_code": result.get("result_code")})
                 return False
                 
         except Exception as e:
-            print(f"uamtk 请求异常: {e}")
+            log.warning("uamtk 请求异常: %s", e)
             return False
 
         # 3.2 uamauthclient
-        uamauth_url = "https://kyfw.12306.cn/otn/uamauthclient"
+        uamauth_url = f"{KYFW_BASE_URL}/otn/uamauthclient"
         data = {"tk": newapptk}
         
         try:
-            resp = self.session.post(uamauth_url, data=data, headers=self.headers, impersonate="chrome120")
+            resp = self._upstream("POST", uamauth_url, data=data)
             result = resp.json()
             
             if result.get("result_code") == 0:
-                print(f"欢迎您，{result.get('username')}")
+                log.info("uamauthclient 验证通过")
+                self.extend_login_lease()
                 return True
             else:
-                print(f"uamauthclient 验证失败: {result}")
+                log.warning("uamauthclient 验证失败", extra={"result_code": result.get("result_code")})
                 return False
         except Exception as e:
-            print(f"uamauthclient 请求异常: {e}")
+            log.warning("uamauthclient 请求异常: %s", e)
             return False
 
     def run(self):
@@ -242,5 +407,6 @@ class Tiantiel12306Login:
         return False
 
 if __name__ == "__main__":
+    setup_logging()
     bot = Tiantiel12306Login()
     bot.run()
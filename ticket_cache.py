@@ -0,0 +1,222 @@
+"""
+进程级余票查询缓存
+同一 (出发站, 到达站, 日期) 的余票对所有用户相同，
+短 TTL 内直接复用解析后的 TrainRecord 列表，并发的相同查询合并为一次上游请求
+"""
+
+import asyncio
+import os
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from ticket_parser import TrainRecord
+from log_setup import get_logger
+import metrics
+
+TICKET_CACHE_TTL = float(os.getenv('TICKET_CACHE_TTL', 5))
+TICKET_CACHE_MAX_ENTRIES = int(os.getenv('TICKET_CACHE_MAX_ENTRIES', 2048))
+# 等待同一查询的其他请求最多等待多久(秒)，超时后自己直接请求上游
+TICKET_CACHE_WAIT_TIMEOUT = float(os.getenv('TICKET_CACHE_WAIT_TIMEOUT', 15))
+
+log = get_logger("cache")
+
+
+class TicketQueryError(Exception):
+    """余票查询失败（网络错误、超时或上游返回异常数据），与"没有车次"区分"""
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class Flight:
+    """
+    一次进行中的上游请求，等待者共享其结果（或异常）
+    同步调用者在线程中 wait()，事件循环中的协程 await wait_async()，两者等待的是同一次请求
+    """
+
+    __slots__ = ('event', 'result', 'error', '_waiters', '_lock')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self._waiters = []  # [(事件循环, asyncio.Future)]
+        self._lock = threading.Lock()
+
+    def wait(self, timeout: Optional[float]) -> bool:
+        return self.event.wait(timeout)
+
+    async def wait_async(self, timeout: Optional[float]) -> bool:
+        """不阻塞事件循环地等待请求结束，超时返回 False"""
+        loop = asyncio.get_event_loop()
+        waiter = loop.create_future()
+        with self._lock:
+            if self.event.is_set():
+                return True
+            self._waiters.append((loop, waiter))
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def finish(self):
+        """发起者写好 result/error 后调用，唤醒所有等待者"""
+        with self._lock:
+            self.event.set()
+            waiters, self._waiters = self._waiters, []
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, waiter)
+            except RuntimeError:
+                pass  # 事件循环已关闭
+
+    def outcome(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class TicketQueryCache:
+    """带 TTL 的查询结果缓存，相同 key 的并发请求只触发一次 fetcher"""
+
+    def __init__(self, ttl: float = TICKET_CACHE_TTL, max_entries: int = TICKET_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: Dict[Hashable, Tuple[float, List[TrainRecord]]] = {}
+        self._flights: Dict[Hashable, Flight] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_fetch(self, key: Hashable, fetcher: Callable[[], Optional[List[TrainRecord]]],
+                     force: bool = False, wait_timeout: Optional[float] = None) -> Optional[List[TrainRecord]]:
+        """
+        返回 key 对应的查询结果
+        force=True 时跳过缓存直接请求上游，结果不写回缓存：下单前的刷新带有本会话的 secretStr，不能给其他用户复用
+        fetcher 返回 None 或抛出异常表示查询失败，失败结果不缓存；
+        fetcher 的异常会同样抛给等待同一查询的其他请求；
+        等待超过 wait_timeout（默认 TICKET_CACHE_WAIT_TIMEOUT）仍无结果时不再等待，自己调用 fetcher
+        """
+        if force:
+            return fetcher()
+
+        records, flight, leader = self._join(key)
+        if flight is None:
+            return records
+
+        if not leader:
+            # 相同查询正在进行，等待其结果；发起者卡住时不跟着一直等
+            wait_timeout = TICKET_CACHE_WAIT_TIMEOUT if wait_timeout is None else wait_timeout
+            if flight.wait(wait_timeout):
+                return flight.outcome()
+            log.warning("等待相同查询超时，直接请求上游", extra={"key": key, "wait": wait_timeout})
+            records = fetcher()
+            if records is not None:
+                self._store(key, records)
+            return records
+
+        try:
+            flight.result = fetcher()
+            if flight.result is not None:
+                self._store(key, flight.result)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            self._land(key, flight)
+        return flight.result
+
+    async def get_or_fetch_async(self, key: Hashable, fetcher: Callable[[], Awaitable[Optional[List[TrainRecord]]]],
+                                 force: bool = False,
+                                 wait_timeout: Optional[float] = None) -> Optional[List[TrainRecord]]:
+        """
+        get_or_fetch 的协程版本，fetcher 返回协程；
+        与同步调用者共用同一份缓存和进行中的查询，等待时不阻塞事件循环
+        """
+        if force:
+            return await fetcher()
+
+        records, flight, leader = self._join(key)
+        if flight is None:
+            return records
+
+        if not leader:
+            wait_timeout = TICKET_CACHE_WAIT_TIMEOUT if wait_timeout is None else wait_timeout
+            if await flight.wait_async(wait_timeout):
+                return flight.outcome()
+            log.warning("等待相同查询超时，直接请求上游", extra={"key": key, "wait": wait_timeout})
+            records = await fetcher()
+            if records is not None:
+                self._store(key, records)
+            return records
+
+        try:
+            flight.result = await fetcher()
+            if flight.result is not None:
+                self._store(key, flight.result)
+        except asyncio.CancelledError:
+            # 发起者被取消（如批量查询超时），等待者不能拿到 None 当作"没有车次"
+            flight.error = TicketQueryError("查询已取消")
+            raise
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            self._land(key, flight)
+        return flight.result
+
+    def _join(self, key: Hashable) -> Tuple[Optional[List[TrainRecord]], Optional[Flight], bool]:
+        """
+        命中缓存时返回 (结果, None, False)；
+        否则加入进行中的查询，返回 (None, 查询, 是否由自己发起)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.time():
+                self.hits += 1
+                metrics.cache_result("ticket_query", True)
+                return entry[1], None, False
+            self.misses += 1
+            metrics.cache_result("ticket_query", False)
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = Flight()
+                self._flights[key] = flight
+        return None, flight, leader
+
+    def _land(self, key: Hashable, flight: Flight):
+        with self._lock:
+            self._flights.pop(key, None)
+        flight.finish()
+
+    def _store(self, key: Hashable, records: List[TrainRecord]):
+        now = time.time()
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                # 先清理过期项，仍然满时丢弃最早写入的一半
+                self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+                if len(self._entries) >= self.max_entries:
+                    keep = list(self._entries.items())[self.max_entries // 2:]
+                    self._entries = dict(keep)
+            self._entries[key] = (now + self.ttl, records)
+
+    def hit_ratio(self) -> Optional[float]:
+        total = self.hits + self.misses
+        return self.hits / total if total else None
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        """清除指定 key 或全部缓存"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+# 全进程共享的余票查询缓存
+ticket_query_cache = TicketQueryCache()
@@ -0,0 +1,235 @@
+"""
+12306 余票查询结果解析
+leftTicket/query 返回的每个车次是一行以 | 分隔的字符串，
+这里一次性解析为紧凑的 TrainRecord（基于元组，使用 __slots__），
+查询、智能查询和 Web 接口共用同一份解析结果
+"""
+
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote
+
+# 行内各字段下标（与 12306 前端 queryLeftNewDTO 的字段顺序一致）
+SECRET = 0
+TRAIN_NO_INTERNAL = 2
+STATION_TRAIN_CODE = 3
+START_STATION_TELECODE = 4
+END_STATION_TELECODE = 5
+FROM_STATION_TELECODE = 6
+TO_STATION_TELECODE = 7
+START_TIME = 8
+ARRIVE_TIME = 9
+DURATION = 10
+CAN_WEB_BUY = 11
+LEFT_TICKET = 12
+START_TRAIN_DATE = 13
+LOCATION_CODE = 15
+FROM_STATION_NO = 16
+TO_STATION_NO = 17
+
+# 席别余票列: (字段名, 下标, 中文名, 下单席别代码)
+SEAT_COLUMNS = (
+    ('gg_num', 20, '观光座', ''),
+    ('gr_num', 21, '高级软卧', '6'),
+    ('qt_num', 22, '其他', ''),
+    ('rw_num', 23, '软卧', '4'),
+    ('rz_num', 24, '软座', '2'),
+    ('tz_num', 25, '特等座', 'P'),
+    ('wz_num', 26, '无座', '1'),
+    ('yb_num', 27, '硬卧(包)', ''),
+    ('yw_num', 28, '硬卧', '3'),
+    ('yz_num', 29, '硬座', '1'),
+    ('ze_num', 30, '二等座', 'O'),
+    ('zy_num', 31, '一等座', 'M'),
+    ('swz_num', 32, '商务座', '9'),
+    ('srrb_num', 33, '动卧', 'F'),
+)
+SEAT_INDEX = {key: index for key, index, _, _ in SEAT_COLUMNS}
+
+# 余票不少于此数时 12306 只显示 "有"
+SEAT_PLENTY = 20
+
+# 行的最小字段数，短于此长度的行用空串补齐，避免访问时越界
+ROW_WIDTH = 34
+
+
+def seat_count(value: str) -> int:
+    """余票文字转为数量："有" 按 SEAT_PLENTY 计，"无"/"--"/空/"*" 为 0"""
+    if value == '有':
+        return SEAT_PLENTY
+    return int(value) if value.isdigit() else 0
+
+
+def hhmm_to_minutes(value: str) -> int:
+    """"08:30" -> 510；历时可超过 24 小时 ("26:05")；格式不对时返回 -1"""
+    hours, sep, minutes = value.partition(':')
+    if not (sep and hours.isdigit() and minutes.isdigit()):
+        return -1
+    return int(hours) * 60 + int(minutes)
+
+
+class TrainRecord:
+    """单个车次的解析结果，底层只保存一个字符串元组"""
+
+    __slots__ = ('fields',)
+
+    def __init__(self, fields: Tuple[str, ...]):
+        self.fields = fields
+
+    @classmethod
+    def from_row(cls, row: str) -> 'TrainRecord':
+        fields = row.split('|')
+        if len(fields) < ROW_WIDTH:
+            fields.extend([''] * (ROW_WIDTH - len(fields)))
+        return cls(tuple(fields))
+
+    def to_row(self) -> str:
+        """还原为 | 分隔的原始行（用于会话持久化）"""
+        return '|'.join(self.fields)
+
+    # --- 常用字段 ---
+    @property
+    def secret(self) -> str:
+        return unquote(self.fields[SECRET])
+
+    @property
+    def train_no(self) -> str:
+        """展示车次 (G101)"""
+        return self.fields[STATION_TRAIN_CODE]
+
+    @property
+    def train_no_internal(self) -> str:
+        return self.fields[TRAIN_NO_INTERNAL]
+
+    @property
+    def train_type(self) -> str:
+        code = self.fields[STATION_TRAIN_CODE]
+        return code[0] if code else ''
+
+    @property
+    def from_station_telecode(self) -> str:
+        return self.fields[FROM_STATION_TELECODE]
+
+    @property
+    def to_station_telecode(self) -> str:
+        return self.fields[TO_STATION_TELECODE]
+
+    @property
+    def start_time(self) -> str:
+        return self.fields[START_TIME]
+
+    @property
+    def arrive_time(self) -> str:
+        return self.fields[ARRIVE_TIME]
+
+    @property
+    def duration(self) -> str:
+        return self.fields[DURATION]
+
+    @property
+    def start_minutes(self) -> int:
+        return hhmm_to_minutes(self.fields[START_TIME])
+
+    @property
+    def duration_minutes(self) -> int:
+        return hhmm_to_minutes(self.fields[DURATION])
+
+    @property
+    def arrive_minutes(self) -> int:
+        """到达时刻，从出发当天 0 点起算的分钟数（次日到达时超过 1440）；无法解析时为 -1"""
+        start, duration = self.start_minutes, self.duration_minutes
+        return start + duration if start >= 0 and duration >= 0 else -1
+
+    @property
+    def can_book(self) -> bool:
+        return self.fields[CAN_WEB_BUY] == 'Y'
+
+    @property
+    def left_ticket(self) -> str:
+        return self.fields[LEFT_TICKET]
+
+    @property
+    def location(self) -> str:
+        return self.fields[LOCATION_CODE]
+
+    @property
+    def start_train_date(self) -> str:
+        return self.fields[START_TRAIN_DATE]
+
+    def seat(self, key: str) -> str:
+        """席别余票（"有"/"无"/数字），缺失时返回 "--" """
+        return self.fields[SEAT_INDEX[key]] or '--'
+
+    def seats(self) -> Dict[str, str]:
+        """所有席别的余票"""
+        fields = self.fields
+        return {key: fields[index] or '--' for key, index, _, _ in SEAT_COLUMNS}
+
+    def total_seats(self) -> int:
+        """各席别余票数之和（"有" 按 SEAT_PLENTY 计）"""
+        fields = self.fields
+        return sum(seat_count(fields[index]) for _, index, _, _ in SEAT_COLUMNS)
+
+    # --- 兼容旧的 ticket_info 字典访问方式 ---
+    def __getitem__(self, key):
+        getter = _KEY_GETTERS.get(key)
+        if getter is not None:
+            return getter(self)
+        if key in SEAT_INDEX:
+            return self.seat(key)
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        return value if value != '' else default
+
+    def to_dict(self) -> Dict:
+        """转换为 Web 接口返回的字典（不含 secretStr：下单只使用服务端 ticket_info 中本会话的记录）"""
+        data = {
+            'train_no': self.train_no,
+            'train_type': self.train_type,
+            'can_book': self.can_book,
+            'from_station_telecode': self.from_station_telecode,
+            'to_station_telecode': self.to_station_telecode,
+            'start_time': self.start_time,
+            'arrive_time': self.arrive_time,
+            'duration': self.duration,
+        }
+        data.update(self.seats())
+        return data
+
+    def __repr__(self):
+        return f"TrainRecord({self.train_no} {self.start_time}-{self.arrive_time})"
+
+
+_KEY_GETTERS = {
+    'secret': lambda r: r.secret,
+    'leftTicket': lambda r: r.left_ticket,
+    'location': lambda r: r.location,
+    'start_time': lambda r: r.start_time,
+    'arrive_time': lambda r: r.arrive_time,
+    'duration': lambda r: r.duration,
+    'train_no': lambda r: r.train_no,
+    'train_no_internal': lambda r: r.train_no_internal,
+    'station_train_code': lambda r: r.train_no,
+    'from_station_telecode': lambda r: r.from_station_telecode,
+    'to_station_telecode': lambda r: r.to_station_telecode,
+}
+
+
+def parse_rows(result_list: List[str]) -> List[TrainRecord]:
+    """解析 data.result 中的所有行"""
+    return [TrainRecord.from_row(row) for row in result_list if row]
+
+
+def parse_left_ticket_response(resp_json: Dict) -> Optional[List[TrainRecord]]:
+    """
+    解析 leftTicket/query 的 JSON 响应
+    数据异常时返回 None
+    """
+    data = resp_json.get('data') if isinstance(resp_json, dict) else None
+    if not isinstance(data, dict) or 'result' not in data:
+        return None
+    return parse_rows(data['result'] or [])
@@ -0,0 +1,221 @@
+"""
+一次换乘行程规划 (出发站 -> 中转站 -> 到达站)
+直达无票时在枢纽车站中寻找换乘方案：
+- 第一程对所有候选枢纽并发查询，没有可预订车次到达的枢纽直接剪枝
+- 按最早到达枢纽的时间排序，在查询预算内依次查询第二程（可能跨天）
+- 同一 (出发, 到达, 日期) 在一次规划中只请求一次，跨规划由进程级余票缓存复用
+- 只在同一车站换乘，换乘时间限制在 [最短, 最长] 窗口内；同一趟第二程只保留出发最晚的第一程
+结果按总历时升序、余票降序排列
+"""
+
+import os
+import threading
+from bisect import bisect_left, bisect_right
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from log_setup import get_logger
+from ticket_parser import TrainRecord
+
+log = get_logger("transfer")
+
+# 换乘时间窗口(分钟)
+TRANSFER_MIN_LAYOVER = int(os.getenv('TRANSFER_MIN_LAYOVER', 20))
+TRANSFER_MAX_LAYOVER = int(os.getenv('TRANSFER_MAX_LAYOVER', 240))
+# 一次规划最多请求的余票查询数、并发数和单个请求超时(秒)
+TRANSFER_MAX_QUERIES = int(os.getenv('TRANSFER_MAX_QUERIES', 16))
+TRANSFER_MAX_WORKERS = int(os.getenv('TRANSFER_MAX_WORKERS', 6))
+TRANSFER_QUERY_TIMEOUT = float(os.getenv('TRANSFER_QUERY_TIMEOUT', 10))
+
+# 默认候选枢纽（逗号分隔的车站名，可通过 TRANSFER_HUBS 覆盖）
+DEFAULT_HUBS = ('郑州东', '武汉', '南京南', '济南西', '徐州东', '长沙南',
+                '西安北', '合肥南', '杭州东', '石家庄', '天津西', '广州南')
+TRANSFER_HUBS = tuple(h.strip() for h in os.getenv('TRANSFER_HUBS', '').split(',') if h.strip()) or DEFAULT_HUBS
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def shift_date(date: str, days: int) -> str:
+    if not days:
+        return date
+    return (datetime.strptime(date, "%Y-%m-%d") + timedelta(days=days)).strftime("%Y-%m-%d")
+
+
+class Leg(NamedTuple):
+    """一程车次；depart/arrive 为相对规划日期 0 点的分钟数"""
+    record: TrainRecord
+    date: str
+    depart: int
+    arrive: int
+
+    @classmethod
+    def from_record(cls, record: TrainRecord, date: str, day_offset: int = 0) -> Optional['Leg']:
+        start, duration = record.start_minutes, record.duration_minutes
+        if start < 0 or duration < 0:
+            return None
+        depart = day_offset * MINUTES_PER_DAY + start
+        return cls(record, date, depart, depart + duration)
+
+    def to_dict(self) -> Dict:
+        data = self.record.to_dict()
+        data['date'] = self.date
+        return data
+
+
+class Itinerary(NamedTuple):
+    hub: str
+    first: Leg
+    second: Leg
+
+    @property
+    def total_minutes(self) -> int:
+        return self.second.arrive - self.first.depart
+
+    @property
+    def layover_minutes(self) -> int:
+        return self.second.depart - self.first.arrive
+
+    @property
+    def seats(self) -> int:
+        """两程中余票较少一程的余票数"""
+        return min(self.first.record.total_seats(), self.second.record.total_seats())
+
+    def to_dict(self) -> Dict:
+        return {
+            'hub': self.hub,
+            'total_minutes': self.total_minutes,
+            'layover_minutes': self.layover_minutes,
+            'seats': self.seats,
+            'legs': [self.first.to_dict(), self.second.to_dict()],
+        }
+
+
+class TransferPlanner:
+    """一次规划使用一个实例（查询结果只在本次规划内记忆）"""
+
+    def __init__(self, booking, min_layover: int = TRANSFER_MIN_LAYOVER, max_layover: int = TRANSFER_MAX_LAYOVER,
+                 max_queries: int = TRANSFER_MAX_QUERIES, max_workers: int = TRANSFER_MAX_WORKERS,
+                 timeout: float = TRANSFER_QUERY_TIMEOUT):
+        if min_layover > max_layover:
+            raise ValueError("最短换乘时间不能大于最长换乘时间")
+        self.booking = booking
+        self.min_layover = min_layover
+        self.max_layover = max_layover
+        self.max_queries = max_queries
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.queries = 0  # 实际发起的查询数
+        self._legs: Dict[Tuple[str, str, str], Future] = {}
+        self._lock = threading.Lock()
+
+    def _query(self, pool: ThreadPoolExecutor, from_code: str, to_code: str, date: str) -> Future:
+        key = (from_code, to_code, date)
+        with self._lock:
+            future = self._legs.get(key)
+            if future is None:
+                future = pool.submit(self._fetch, from_code, to_code, date)
+                self._legs[key] = future
+                self.queries += 1
+        return future
+
+    def _fetch(self, from_code: str, to_code: str, date: str) -> List[TrainRecord]:
+        with self.booking.worker_session() as session:
+            return self.booking.query_records_by_code(from_code, to_code, date, session=session,
+                                                      timeout=self.timeout, store=False) or []
+
+    def _result(self, future: Future, description: str) -> List[TrainRecord]:
+        try:
+            return future.result(self.timeout * 3)
+        except Exception as e:
+            log.warning("换乘查询 %s 失败: %s", description, e)
+            return []
+
+    def _candidate_hubs(self, from_code: str, to_code: str, hubs: Sequence[str]) -> List[Tuple[str, str]]:
+        """解析枢纽车站，排除与出发/到达站同城的枢纽"""
+        registry = self.booking.mcp_service.registry
+        excluded_cities = set()
+        for code in (from_code, to_code):
+            record = registry.get_by_code(code)
+            if record and record.city:
+                excluded_cities.add(record.city)
+        result = []
+        for name in hubs:
+            record = registry.get(name) or registry.resolve(name)
+            if record is None:
+                log.debug("未知的枢纽车站 %s", name)
+                continue
+            if record.code in (from_code, to_code) or record.city in excluded_cities:
+                continue
+            if all(record.code != code for _, code in result):
+                result.append((record.name, record.code))
+        return result
+
+    def _transfer_days(self, legs: List[Leg]) -> List[int]:
+        """第二程可能出发的日期（相对规划日期的天数）"""
+        days = set()
+        for leg in legs:
+            first_day = (leg.arrive + self.min_layover) // MINUTES_PER_DAY
+            last_day = (leg.arrive + self.max_layover) // MINUTES_PER_DAY
+            days.update(range(first_day, last_day + 1))
+        return sorted(days)
+
+    def plan(self, from_code: str, to_code: str, date: str, hubs: Optional[Sequence[str]] = None,
+             limit: int = 20) -> List[Itinerary]:
+        hub_stations = self._candidate_hubs(from_code, to_code, hubs or TRANSFER_HUBS)
+        # 至少留一半查询预算给第二程
+        hub_stations = hub_stations[:max(1, self.max_queries // 2)]
+        if not hub_stations:
+            return []
+
+        pool = ThreadPoolExecutor(max_workers=max(1, self.max_workers))
+        try:
+            first_futures = [(name, code, self._query(pool, from_code, code, date)) for name, code in hub_stations]
+
+            # 第一程：只保留可预订、确实到达该枢纽车站的车次
+            arrivals = []
+            for name, code, future in first_futures:
+                legs = [Leg.from_record(record, date) for record in self._result(future, f"{from_code}->{code}")
+                        if record.can_book and record.to_station_telecode == code]
+                legs = sorted((leg for leg in legs if leg), key=lambda leg: leg.arrive)
+                if legs:
+                    arrivals.append((name, code, legs))
+
+            # 按最早到达枢纽的时间依次查询第二程，超出预算的枢纽不再查询
+            arrivals.sort(key=lambda item: item[2][0].arrive)
+            second_futures = []
+            pruned = 0
+            for name, code, legs in arrivals:
+                for day in self._transfer_days(legs):
+                    second_date = shift_date(date, day)
+                    if self.queries >= self.max_queries and (code, to_code, second_date) not in self._legs:
+                        pruned += 1
+                        continue
+                    second_futures.append((name, code, legs, day, second_date,
+                                           self._query(pool, code, to_code, second_date)))
+
+            itineraries = []
+            for name, code, legs, day, second_date, future in second_futures:
+                arrive_times = [leg.arrive for leg in legs]
+                for record in self._result(future, f"{code}->{to_code} {second_date}"):
+                    if not record.can_book or record.from_station_telecode != code:
+                        continue
+                    second = Leg.from_record(record, second_date, day)
+                    if second is None:
+                        continue
+                    lo = bisect_left(arrive_times, second.depart - self.max_layover)
+                    hi = bisect_right(arrive_times, second.depart - self.min_layover)
+                    if lo < hi:
+                        # 总历时最短的是出发最晚的第一程
+                        first = max(legs[lo:hi], key=lambda leg: (leg.depart, leg.record.total_seats()))
+                        itineraries.append(Itinerary(name, first, second))
+        finally:
+            for future in self._legs.values():
+                future.cancel()
+            pool.shutdown(wait=False)
+
+        log.info("换乘规划完成", extra={"from": from_code, "to": to_code, "date": date,
+                                       "hubs": len(hub_stations), "queries": self.queries,
+                                       "pruned": pruned, "itineraries": len(itineraries)})
+        itineraries.sort(key=lambda it: (it.total_minutes, -it.seats))
+        return itineraries[:limit]